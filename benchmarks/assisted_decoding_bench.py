@@ -0,0 +1,124 @@
+"""
+Decoding speed of PubGuard with and without a draft model (assisted generation).
+
+    python -m benchmarks.assisted_decoding_bench [--prompts 8] [--max-new-tokens 128]
+    python -m benchmarks.assisted_decoding_bench --model Lihuchen/pub-guard-llama-8b \
+        --draft-model Lihuchen/pub-guard-llama-1b --device cuda
+
+Without ``--model`` both models are built offline: a randomly initialised Llama whose
+later layers only slightly refine its first, and as its draft the same network cut down
+to that first layer, which agrees with it on most tokens the way a distilled checkpoint
+would. Prompts are formatted synthetic articles; enrichment is skipped.
+
+The acceptance rate is estimated from forward-pass counts: each verification pass of the
+target model keeps the accepted draft tokens plus one token of its own, and each draft
+pass proposes one token.
+"""
+import argparse
+import copy
+import time
+import torch
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.utils import format_prompt
+from pub_guard_llm.test.tiny_model import build_tiny_llama, build_tiny_tokenizer, make_article
+
+
+def load_models(args):
+    if args.model:
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        dtype = getattr(torch, args.dtype)
+        model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=dtype).to(args.device).eval()
+        draft_model = AutoModelForCausalLM.from_pretrained(args.draft_model, torch_dtype=dtype).to(args.device).eval()
+        return tokenizer, model, draft_model
+    tokenizer = build_tiny_tokenizer()
+    model = build_tiny_llama(tokenizer, hidden_size=args.hidden_size, num_hidden_layers=args.layers)
+    with torch.no_grad():
+        # Make the later layers refine rather than overwrite the first one's output, so the
+        # one-layer draft agrees with the full model on most, but not all, tokens
+        for layer in model.model.layers[1:]:
+            layer.self_attn.o_proj.weight.mul_(args.refinement)
+            layer.mlp.down_proj.weight.mul_(args.refinement)
+    draft_model = copy.deepcopy(model)
+    draft_model.model.layers = draft_model.model.layers[:1]
+    draft_model.config.num_hidden_layers = 1
+    return tokenizer, model, draft_model
+
+
+class Counter:
+    """
+    Counts the forward passes of a model and, unless it is a draft, the tokens its
+    ``generate`` calls produce.
+    """
+    def __init__(self, model, draft: bool = False):
+        self.model = model
+        self.draft = draft
+        self.passes = 0
+        self.tokens = 0
+        self._handle = model.register_forward_hook(self._count)
+        if not draft:
+            self._generate = model.generate
+            model.generate = self._counting_generate
+
+    def _count(self, *args):
+        self.passes += 1
+
+    def _counting_generate(self, *args, **kwargs):
+        outputs = self._generate(*args, **kwargs)
+        self.tokens += outputs.shape[1] - kwargs['input_ids'].shape[1]
+        return outputs
+
+    def remove(self):
+        self._handle.remove()
+        if not self.draft:
+            del self.model.generate
+
+
+def run(pub_guard: PubGuard, prompts: list, max_new_tokens: int):
+    counter = Counter(pub_guard.model)
+    draft = Counter(pub_guard.draft_model, draft=True) if pub_guard.draft_model is not None else None
+    start = time.perf_counter()
+    try:
+        answers = pub_guard.predict_prompts(prompts, batch_size=1, max_new_token=max_new_tokens, do_sample=False)
+    finally:
+        counter.remove()
+        if draft is not None:
+            draft.remove()
+    return answers, time.perf_counter() - start, counter, draft
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", help="the target model; built offline if omitted")
+    parser.add_argument("--draft-model", help="the draft model, required with --model")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--dtype", default="bfloat16")
+    parser.add_argument("--prompts", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--hidden-size", type=int, default=1024, help="the hidden size of the offline target")
+    parser.add_argument("--layers", type=int, default=12, help="the depth of the offline target")
+    parser.add_argument("--refinement", type=float, default=0.02,
+                        help="the scale of the offline target's later layers; lower means more agreement")
+    args = parser.parse_args()
+
+    tokenizer, model, draft_model = load_models(args)
+    prompts = [format_prompt(make_article(i)) for i in range(args.prompts)]
+    plain = PubGuard(model=model, tokenizer=tokenizer, metadata=object())
+    assisted = PubGuard(model=model, tokenizer=tokenizer, metadata=object(), draft_model=draft_model)
+    run(plain, prompts[:1], 8)  # warm-up
+
+    expected, plain_time, plain_counts, _ = run(plain, prompts, args.max_new_tokens)
+    answers, assisted_time, target, draft = run(assisted, prompts, args.max_new_tokens)
+
+    # Each target pass keeps the draft tokens it accepts plus one token of its own
+    accepted = target.tokens - target.passes
+    print(f"{len(prompts)} prompts, {target.tokens} generated tokens")
+    print(f"autoregressive  {plain_time:8.2f}s  {plain_counts.tokens / plain_time:8.1f} tokens/s")
+    print(f"assisted        {assisted_time:8.2f}s  {target.tokens / assisted_time:8.1f} tokens/s")
+    print(f"speedup         {plain_time / assisted_time:8.2f}x")
+    print(f"acceptance rate {max(accepted, 0) / max(draft.passes, 1):8.1%}  "
+          f"({target.passes} target passes, {draft.passes} draft passes)")
+    print(f"identical answers: {sum(a == b for a, b in zip(answers, expected))}/{len(prompts)}")
+
+if __name__ == '__main__':
+    main()
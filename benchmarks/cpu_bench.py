@@ -0,0 +1,133 @@
+"""
+CPU throughput and memory of PubGuard in float32, bfloat16 and int8, and of a worker pool.
+
+    python -m benchmarks.cpu_bench [--articles 64] [--batch-size 8] [--workers 2]
+
+The model is a randomly initialised Llama with the project's chat template (see
+``test/tiny_model.py``), saved as a safetensors checkpoint in a temporary directory and
+loaded with ``load_cpu_model``. Each dtype runs in a fresh process, so that its memory
+figures are its own:
+
+    load RSS      resident memory after loading the model
+    load PSS      the same, with pages shared with other processes (the memory-mapped
+                  checkpoint) divided between them
+    mapped        the fraction of parameter bytes still backed by the checkpoint file; for
+                  int8, of the parameters left in floating point (embeddings, norms and
+                  the head), as the quantized weights are packed copies
+    articles/s    ``predict_prompts`` on the same prompts, enriched beforehand against the
+                  local Semantic Scholar stand-in
+
+The pool run starts a ``CPUWorkerPool`` and reports the total RSS and PSS of its workers:
+when the weights are shared, PSS grows by less than RSS as workers are added.
+"""
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import tempfile
+import time
+import torch
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.cpu import CPU_DTYPES, CPUWorkerPool, available_cpus, configure_threads, load_cpu_model, mapped_weight_fraction
+from pub_guard_llm.model.semantic_scholar import SemanticScholarClient
+from pub_guard_llm.model.utils import Metadata, prepare_prompts
+from pub_guard_llm.test.stand_in_server import StandInSemanticScholar, make_papers
+from pub_guard_llm.test.tiny_model import build_tiny_llama, build_tiny_tokenizer, make_article
+
+
+def memory_mb(pid="self") -> dict:
+    """
+    Returns the resident and proportional set sizes of a process, in MB (Linux only).
+    """
+    sizes = {}
+    with open(f"/proc/{pid}/smaps_rollup") as rollup:
+        for line in rollup:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                sizes[key.lower()] = int(value.split()[0]) / 1024
+    return sizes
+
+
+def run_dtype(model_path: str, dtype: str, prompts: list, batch_size: int, max_new_tokens: int, threads: int) -> dict:
+    """
+    Loads the model in ``dtype`` and screens ``prompts``; runs in its own process.
+    """
+    configure_threads(threads)
+    model, tokenizer = load_cpu_model(model_path, dtype)
+    memory = memory_mb()
+    pub_guard = PubGuard(model=model, tokenizer=tokenizer, metadata=Metadata())
+    pub_guard.predict_prompts(prompts[:2], batch_size=2, max_new_token=2, do_sample=False)  # warm-up
+    start = time.perf_counter()
+    pub_guard.predict_prompts(prompts, batch_size=batch_size, max_new_token=max_new_tokens, do_sample=False)
+    elapsed = time.perf_counter() - start
+    return {'articles_per_sec': len(prompts) / elapsed, 'load_rss_mb': memory['rss'], 'load_pss_mb': memory['pss'],
+            'mapped': mapped_weight_fraction(model)}
+
+
+def run_pool(model_path: str, metadata: Metadata, articles: list, workers: int, batch_size: int,
+             max_new_tokens: int) -> dict:
+    with CPUWorkerPool(model_path, workers=workers, metadata=metadata) as pool:
+        pool.predict_batch(articles[:workers], batch_size=1, max_new_token=2, do_sample=False)  # loads every worker
+        start = time.perf_counter()
+        pool.predict_batch(articles, batch_size=batch_size, max_new_token=max_new_tokens, do_sample=False)
+        elapsed = time.perf_counter() - start
+        memory = [memory_mb(pid) for pid in pool._executor._processes]
+    return {'articles_per_sec': len(articles) / elapsed, 'rss_mb': sum(m['rss'] for m in memory),
+            'pss_mb': sum(m['pss'] for m in memory)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--dtypes", default=",".join(CPU_DTYPES), help="comma-separated dtypes")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes for the pool run, 0 to skip it")
+    parser.add_argument("--threads", type=int, help="torch threads for the single-process runs")
+    parser.add_argument("--hidden-size", type=int, default=512)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.getLogger("pub_guard_llm").setLevel(logging.WARNING)
+    torch.set_grad_enabled(False)
+
+    if args.child:
+        job = json.loads(args.child)
+        print(json.dumps(run_dtype(**job)))
+        return
+
+    papers = make_papers(args.articles)
+    articles = [dict(make_article(i), Title=title) for i, title in enumerate(papers)]
+    with StandInSemanticScholar(papers) as stand_in, tempfile.TemporaryDirectory() as model_path:
+        tokenizer = build_tiny_tokenizer()
+        model = build_tiny_llama(tokenizer, hidden_size=args.hidden_size, num_hidden_layers=args.layers)
+        model.save_pretrained(model_path)
+        tokenizer.save_pretrained(model_path)
+        print(f"model: {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M parameters, "
+              f"{args.articles} articles, batch size {args.batch_size}")
+        del model
+
+        metadata = Metadata(client=SemanticScholarClient(base_url=stand_in.url, rate_limit=0))
+        prompts = [record['prompt'] for record in prepare_prompts([dict(article) for article in articles], metadata)]
+        print(f"\n  {'dtype':<10}{'articles/s':>12}{'load RSS':>12}{'load PSS':>12}{'mapped':>8}")
+        for dtype in args.dtypes.split(","):
+            job = {'model_path': model_path, 'dtype': dtype, 'prompts': prompts, 'batch_size': args.batch_size,
+                   'max_new_tokens': args.max_new_tokens, 'threads': args.threads}
+            output = subprocess.run([sys.executable, "-m", "benchmarks.cpu_bench", "--child", json.dumps(job)],
+                                    check=True, capture_output=True, text=True).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+            print(f"  {dtype:<10}{run['articles_per_sec']:12.1f}{run['load_rss_mb']:9.1f} MB"
+                  f"{run['load_pss_mb']:9.1f} MB{run['mapped']:8.0%}")
+
+        if args.workers:
+            for workers in sorted({1, args.workers}):
+                run = run_pool(model_path, metadata, [dict(article) for article in articles], workers,
+                               args.batch_size, args.max_new_tokens)
+                print(f"\n  pool of {workers}: {run['articles_per_sec']:.1f} articles/s, "
+                      f"workers' RSS {run['rss_mb']:.1f} MB, PSS {run['pss_mb']:.1f} MB")
+        print(f"\n  CPUs available: {available_cpus()}")
+
+
+if __name__ == '__main__':
+    main()
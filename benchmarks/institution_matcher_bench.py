@@ -0,0 +1,98 @@
+"""
+Throughput and accuracy of InstitutionMatcher on a synthetic list of 100k institutions.
+
+    python -m benchmarks.institution_matcher_bench [--institutions 100000] [--queries 5000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from pub_guard_llm.model import utils
+from pub_guard_llm.model.matching import InstitutionMatcher, normalize_institution
+from pub_guard_llm.model.reference_index import ReferenceIndex, build_reference_index, read_jsonl_records
+
+TEMPLATES = ["University of {place}", "{place} University", "{place} State University", "{place} General Hospital",
+             "{place} Institute of Technology", "{place} Medical Center", "{place} Cancer Centre",
+             "{person} Research Foundation", "{place} College of Medicine", "Affiliated Hospital of {place} University",
+             "{place} University of Science and Technology", "{person} Children's Hospital", "National {field} Institute",
+             "{place} Academy of {field}", "{person} Institute for {field} Research"]
+FIELDS = ["Medicine", "Surgery", "Oncology", "Physics", "Chemistry", "Biology", "Cardiology", "Neuroscience",
+          "Public Health", "Immunology", "Genetics", "Pharmacology", "Engineering", "Agricultural Sciences"]
+CONSONANTS, VOWELS = "bcdfghjklmnprstvwz", "aeiou"
+
+
+def make_word(rng: random.Random) -> str:
+    return "".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def make_institutions(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    records = [r for r in read_jsonl_records(utils.AFFILIATION_SOURCE) if utils.institution_keys(r)]
+    names = {normalize_institution(r['name']) for r in records}
+    while len(records) < n:
+        name = rng.choice(TEMPLATES).format(place=make_word(rng), person=f"{make_word(rng)} {make_word(rng)}",
+                                            field=rng.choice(FIELDS))
+        if normalize_institution(name) in names:
+            continue
+        names.add(normalize_institution(name))
+        records.append({'name': name, 'works_count': rng.randint(1, 10**5), 'cited_by_count': rng.randint(0, 10**7)})
+    return records
+
+
+def make_affiliation(rng: random.Random, name: str) -> str:
+    """
+    Wraps an institution name in a department, street, city and postcode, with the
+    spelling variations found in real affiliations.
+    """
+    name = name.replace("University", rng.choice(["University", "Univ.", "UNIVERSITY"]))
+    name = name.replace("Center", rng.choice(["Center", "Centre", "Ctr"]))
+    parts = [f"Department of {rng.choice(FIELDS)}", name, f"{rng.randint(1, 999)} {make_word(rng)} Road",
+             make_word(rng), f"{rng.randint(10000, 99999)} {make_word(rng)}"]
+    if rng.random() < 0.5:
+        parts.pop(2)
+    return ", ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--institutions", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=5_000)
+    args = parser.parse_args()
+
+    records = make_institutions(args.institutions)
+    rng = random.Random(1)
+    targets = [rng.choice(records[-args.institutions // 2:]) for _ in range(args.queries)]
+    known = [make_affiliation(rng, target['name']) for target in targets]
+    unknown = [make_affiliation(rng, f"{make_word(rng)} {make_word(rng)} Polyclinic") for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "institutions.idx")
+        start = time.perf_counter()
+        written = build_reference_index(records, utils.institution_keys, path, **utils.INSTITUTION_SEARCH)
+        print(f"{written:,} institutions, index build: {time.perf_counter() - start:.2f}s")
+        matcher = InstitutionMatcher(ReferenceIndex(path))
+        start = time.perf_counter()
+        matcher.match(make_affiliation(rng, targets[0]['name']))
+        print(f"open and first match: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        for label, affiliations in (("known institution", known), ("unknown institution", unknown)):
+            latencies, results = [], []
+            for affiliation in affiliations:
+                start = time.perf_counter()
+                results.append(matcher.match(affiliation))
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f"{label:<20}{len(affiliations) / sum(latencies):>10,.0f} affiliations/s"
+                  f"  mean {statistics.mean(latencies) * 1e3:.3f} ms  p99 {latencies[len(latencies) * 99 // 100] * 1e3:.3f} ms")
+            if label == "known institution":
+                correct = sum(result is not None and normalize_institution(result[0]['name'])
+                              == normalize_institution(target['name']) for result, target in zip(results, targets))
+                print(f"{'':<20}{correct / len(targets):.1%} matched to the right institution")
+            else:
+                print(f"{'':<20}{sum(r is not None for r in results) / len(results):.1%} matched to some institution")
+
+
+if __name__ == '__main__':
+    main()
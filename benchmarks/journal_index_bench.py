@@ -0,0 +1,86 @@
+"""
+Lookup throughput of JournalIndex on a synthetic table of 100k journals.
+
+    python -m benchmarks.journal_index_bench [--journals 100000] [--queries 20000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from pub_guard_llm.model import utils
+from pub_guard_llm.model.matching import JournalIndex, journal_index_keys
+from pub_guard_llm.model.reference_index import ReferenceIndex, build_reference_index
+
+WORDS = ["journal", "international", "clinical", "research", "cell", "molecular", "biology", "cancer",
+         "medicine", "letters", "reports", "advances", "frontiers", "science", "chemistry", "genetics",
+         "oncology", "surgery", "neuroscience", "physiology", "pharmacology", "immunology", "pathology",
+         "translational", "experimental", "applied", "european", "american", "asian", "reviews"]
+
+
+def make_journals(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    syllables = ["ba", "cor", "den", "fi", "gal", "hep", "ix", "lum", "mor", "nor", "pal", "quin",
+                 "ros", "sul", "tor", "ur", "vel", "xan", "yor", "zet"]
+    vocabulary = WORDS + ["".join(rng.sample(syllables, 3)) for _ in range(3000)]
+    titles = set()
+    journals = []
+    while len(journals) < n:
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(2, 6))]
+        title = " ".join(w.capitalize() for w in words)
+        if title in titles:
+            continue
+        titles.add(title)
+        i = len(journals)
+        journals.append({
+            'jcr': f"Q{rng.randint(1, 4)}", 'journal': title, 'issn': f"{i // 1000:04d}-{i % 1000:03d}X",
+            'journal_abbr': " ".join(w[:5].capitalize() for w in words) + f" {i}",
+            'factor': round(rng.random() * 10, 1), 'nlm_id': str(10000000 + i),
+            'eissn': f"{9000 + i // 1000:04d}-{i % 1000:03d}1",
+        })
+    return journals
+
+
+def bench(name: str, resolve, queries: list, expected: list):
+    start = time.perf_counter()
+    hits = sum(resolve(query) is not None and resolve(query)['journal'] == title
+               for query, title in zip(queries, expected))
+    elapsed = time.perf_counter() - start
+    # resolve runs twice per query above
+    print(f"{name:<24}{len(queries) * 2 / elapsed:>14,.0f} lookups/s{hits / len(queries):>10.1%} correct")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--journals", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=20_000)
+    args = parser.parse_args()
+
+    journals = make_journals(args.journals)
+    rng = random.Random(1)
+    sample = [rng.choice(journals) for _ in range(args.queries)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "journals.idx")
+        start = time.perf_counter()
+        build_reference_index(journals, journal_index_keys, path, **utils.JOURNAL_SEARCH)
+        print(f"build: {time.perf_counter() - start:.2f}s, {os.path.getsize(path) / 2**20:.1f} MiB")
+
+        start = time.perf_counter()
+        index = JournalIndex(ReferenceIndex(path))
+        len(index.index)
+        print(f"open: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        titles = [j['journal'] for j in sample]
+        bench("title", index.resolve, titles, titles)
+        bench("ISSN", index.resolve, [j['issn'] for j in sample], titles)
+        bench("eISSN (no hyphen)", index.resolve, [j['eissn'].replace("-", "") for j in sample], titles)
+        bench("NLM ID", index.resolve, [j['nlm_id'] for j in sample], titles)
+        bench("abbreviation", index.resolve, [j['journal_abbr'].replace(" ", ". ") for j in sample], titles)
+        bench("'The ... &' variant", index.resolve, ["The " + t.replace(" And ", " & ") for t in titles], titles)
+
+        typos = [t[:len(t) // 2] + t[len(t) // 2 + 1:] for t in titles[:2000]]
+        bench("fuzzy (one typo)", index.resolve, typos, titles[:2000])
+
+
+if __name__ == '__main__':
+    main()
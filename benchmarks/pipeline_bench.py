@@ -0,0 +1,184 @@
+"""
+Per-stage latency, throughput and peak memory of the full PubGuard pipeline, offline.
+
+    python -m benchmarks.pipeline_bench [--sizes 16,64,256] [--batch-sizes 1,4,8,16]
+    python -m benchmarks.pipeline_bench --latency 0.05 --error-rate 0.1 --json after.json --compare before.json
+
+The model is a randomly initialised Llama with the project's chat template (see
+``test/tiny_model.py``), and Semantic Scholar is the local stand-in server, answering after
+``--latency`` seconds and failing ``--error-rate`` of its requests. Every corpus is made of
+synthetic articles the stand-in knows, half of them carrying a PMID.
+
+Stages are timed by PubGuard itself (see ``PubGuard.stats``) during one ``predict_batch``
+run on the largest corpus:
+
+    enrichment   Metadata.get_external_knowledge_batch, i.e. Semantic Scholar and the
+                 bundled institution and journal indexes
+    formatting   format_prompt
+    tokenization the chat template and the tokenizer
+    prefill      from the start of generate to its first token
+    decode       from the first token to the end of generate
+    extraction   decoding the output and extract_answer
+
+Stage latencies are per article. Throughput is end-to-end ``predict_batch`` on each corpus
+at each batch size. Peak memory is the Python heap high-water mark of a run (tracemalloc)
+and the process's maximum resident set size so far, which includes tensors.
+
+``--json`` writes the results; ``--compare`` reads earlier ones and exits with status 1 if
+a stage or throughput figure regressed by more than ``--tolerance``.
+"""
+import argparse
+import copy
+import json
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+import torch
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.metrics import Metrics
+from pub_guard_llm.model.semantic_scholar import SemanticScholarClient
+from pub_guard_llm.model.utils import Metadata
+from pub_guard_llm.test.stand_in_server import StandInSemanticScholar, make_papers
+from pub_guard_llm.test.tiny_model import build_tiny_llama, build_tiny_tokenizer, make_article
+
+STAGES = ("enrichment", "formatting", "tokenization", "prefill", "decode", "extraction")
+
+
+def make_corpus(n: int):
+    """
+    Returns ``n`` synthetic articles and the stand-in papers and identifiers that match them.
+    """
+    papers = make_papers(n, authors_per_paper=4, shared_authors=1)
+    titles = list(papers)
+    paper_ids = {f"PMID:{i}": title for i, title in enumerate(titles)}
+    articles = []
+    for i, title in enumerate(titles):
+        article = dict(make_article(i), Title=title)
+        if i % 2 == 0:
+            article['PMID'] = str(i)
+        articles.append(article)
+    return articles, papers, paper_ids
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def time_stages(pub_guard: PubGuard, articles: list, batch_size: int, max_new_tokens: int) -> dict:
+    """
+    Screens ``articles`` with ``predict_batch`` and returns the seconds spent per article in
+    each stage, as ``PubGuard.stats`` reports them.
+    """
+    metadata = pub_guard.metadata
+    metrics = metadata.metrics
+    measured = PubGuard(model=pub_guard.model, tokenizer=pub_guard.tokenizer, metadata=metadata, metrics=Metrics())
+    try:
+        measured.predict_batch(copy.deepcopy(articles), batch_size=batch_size, max_new_token=max_new_tokens,
+                               do_sample=False)
+    finally:
+        metadata.use_metrics(metrics)
+    stages = measured.stats()['stages']
+    return {stage: stages.get(stage, {}).get('total_seconds', 0.0) / len(articles) for stage in STAGES}
+
+
+def measure_throughput(pub_guard: PubGuard, articles: list, batch_size: int, max_new_tokens: int) -> dict:
+    """
+    Screens ``articles`` end to end and returns the articles per second and peak memory.
+
+    Tracing allocations slows Python down, so the heap peak comes from a second run.
+    """
+    start = time.perf_counter()
+    pub_guard.predict_batch(copy.deepcopy(articles), batch_size=batch_size, max_new_token=max_new_tokens, do_sample=False)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    pub_guard.predict_batch(copy.deepcopy(articles), batch_size=batch_size, max_new_token=max_new_tokens, do_sample=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'articles_per_sec': len(articles) / elapsed, 'heap_peak_mb': peak / 2**20, 'max_rss_mb': max_rss_mb()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a description of every figure at least ``tolerance`` worse than in ``baseline``.
+    """
+    regressions = []
+    for stage, seconds in results['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if before and seconds > before * (1 + tolerance):
+            regressions.append(f"{stage}: {before * 1e3:.2f} -> {seconds * 1e3:.2f} ms/article")
+    for key, run in results['throughput'].items():
+        before = baseline.get('throughput', {}).get(key, {}).get('articles_per_sec')
+        if before and run['articles_per_sec'] < before / (1 + tolerance):
+            regressions.append(f"throughput {key}: {before:.1f} -> {run['articles_per_sec']:.1f} articles/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="16,64,256", help="comma-separated corpus sizes")
+    parser.add_argument("--batch-sizes", default="1,4,8,16", help="comma-separated batch sizes")
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the stand-in API takes per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="the fraction of API requests that fail")
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="a --json file of earlier results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="the slowdown counted as a regression")
+    args = parser.parse_args()
+    sizes = [int(n) for n in args.sizes.split(",")]
+    batch_sizes = [int(n) for n in args.batch_sizes.split(",")]
+
+    logging.getLogger("pub_guard_llm").setLevel(logging.WARNING)
+    torch.set_grad_enabled(False)
+    tokenizer = build_tiny_tokenizer()
+    model = build_tiny_llama(tokenizer, hidden_size=args.hidden_size, num_hidden_layers=args.layers)
+    results = {'config': vars(args), 'stages': {}, 'throughput': {}}
+    print(f"model: {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M parameters, "
+          f"API latency {args.latency * 1e3:.0f} ms, error rate {args.error_rate:.0%}")
+
+    for size in sizes:
+        articles, papers, paper_ids = make_corpus(size)
+        with StandInSemanticScholar(papers, paper_ids=paper_ids, latency=args.latency,
+                                    error_rate=args.error_rate) as stand_in:
+            metadata = Metadata(client=SemanticScholarClient(base_url=stand_in.url, rate_limit=0))
+            pub_guard = PubGuard(model=model, tokenizer=tokenizer, metadata=metadata)
+            pub_guard.predict_batch(copy.deepcopy(articles[:2]), batch_size=2, max_new_token=2, do_sample=False)  # warm-up
+
+            if size == max(sizes):
+                stages = time_stages(pub_guard, articles, max(batch_sizes), args.max_new_tokens)
+                results['stages'] = stages
+                print(f"\nper-article latency, {size} articles, batch size {max(batch_sizes)}")
+                for stage in STAGES:
+                    print(f"  {stage:<14}{stages[stage] * 1e3:10.3f} ms")
+                print(f"  {'total':<14}{sum(stages.values()) * 1e3:10.3f} ms")
+
+            print(f"\nthroughput, {size} articles")
+            for batch_size in batch_sizes:
+                run = measure_throughput(pub_guard, articles, batch_size, args.max_new_tokens)
+                results['throughput'][f"{size}x{batch_size}"] = run
+                print(f"  batch size {batch_size:<4}{run['articles_per_sec']:10.1f} articles/s"
+                      f"  heap peak {run['heap_peak_mb']:7.1f} MB  max RSS {run['max_rss_mb']:7.1f} MB")
+            if args.error_rate:
+                print(f"  API requests: {sum(stand_in.request_counts.values())}, "
+                      f"circuit breaker: {metadata.client.breaker.stats()}, "
+                      f"degraded enrichments: {metadata.degradation_stats()}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
-from .model import PubGuard
-
 __all__ = [
-    PubGuard
-]
\ No newline at end of file
+    'PubGuard'
+]
+
+
+def __getattr__(name):
+    # Imported on first use so that ``pub_guard_llm.model.utils`` loads without torch
+    if name == 'PubGuard':
+        from .model import PubGuard
+        return PubGuard
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
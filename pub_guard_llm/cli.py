@@ -0,0 +1,418 @@
+"""
+The ``pub-guard`` command line.
+
+    pub-guard screen articles.jsonl -o results.jsonl
+    zcat pubmed.jsonl.gz | pub-guard screen - -o results.jsonl --batch-size 16
+    pub-guard serve --port 8000 --max-batch-size 8
+    pub-guard enrich articles.jsonl -o prompts.jsonl && pub-guard screen prompts.jsonl --prompts -o results.jsonl
+    pub-guard prefetch articles.jsonl --cache s2.sqlite --refresh
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import IO, Iterator, List, Set, Tuple
+
+DEFAULT_MODEL = "Lihuchen/pub-guard-llama-8b"
+
+
+def read_articles(path: str, parquet_batch_size: int = 1024) -> Iterator[dict]:
+    """
+    Streams articles from a JSON Lines file, a Parquet file or, for ``-``, standard input.
+
+    Parquet files are read one record batch at a time and need ``pyarrow``.
+    """
+    if path == "-":
+        yield from _read_jsonl(sys.stdin)
+    elif path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Reading Parquet files requires pyarrow: pip install pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=parquet_batch_size):
+            yield from batch.to_pylist()
+    else:
+        with open(path, 'r', encoding='utf-8') as file:
+            yield from _read_jsonl(file)
+
+
+def _read_jsonl(file: IO[str]) -> Iterator[dict]:
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Skipping line {line_number}: {e}", file=sys.stderr)
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """
+    Returns the IDs already written to an output file, first cutting off a trailing
+    partial line left by an interrupted run.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    ids = set()
+    end = 0
+    with open(output_path, 'rb+') as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            try:
+                ids.add(json.loads(line)['id'])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+        file.truncate(end)
+    return ids
+
+
+def _article_ids(articles: Iterator[dict], id_field: str) -> Iterator[Tuple[str, dict]]:
+    """
+    Gives every article an ``id``: its ``id_field``, or its position in the input.
+    """
+    for position, article in enumerate(articles):
+        article_id = article.get(id_field)
+        yield str(article_id if article_id is not None else f"#{position}"), article
+
+
+def _chunks(items: Iterator, size: int) -> Iterator[list]:
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def load_metadata(args):
+    from .model.cache import SQLiteMetadataCache
+    from .model.semantic_scholar import API_URL, SemanticScholarClient
+    from .model.utils import Metadata
+
+    client = SemanticScholarClient(base_url=args.api_url or API_URL, api_key=args.api_key or os.environ.get("S2_API_KEY"),
+                                   cache=SQLiteMetadataCache(args.cache) if args.cache else None)
+    return Metadata(client=client, enrichment_timeout=args.enrichment_timeout)
+
+
+def load_pub_guard(args, with_metrics: bool = False):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from .model import PubGuard
+    from .model.cache import PredictionCache
+    from .model.metrics import Metrics
+
+    device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    draft_model = None
+    if device == 'cpu':
+        from .model.cpu import CPU_DTYPES, configure_threads, load_cpu_model
+        if args.dtype not in CPU_DTYPES:
+            raise SystemExit(f"--dtype {args.dtype} is not supported on CPU, use one of {', '.join(CPU_DTYPES)}")
+        configure_threads(args.threads)
+        model, tokenizer = load_cpu_model(args.model, args.dtype)
+        if args.draft_model:
+            draft_model, _ = load_cpu_model(args.draft_model, args.dtype)
+    else:
+        if args.dtype == "int8":
+            raise SystemExit("--dtype int8 is only supported on CPU")
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=getattr(torch, args.dtype))
+        model.to(device)
+        model.eval()
+        if args.draft_model:
+            draft_model = AutoModelForCausalLM.from_pretrained(args.draft_model, torch_dtype=getattr(torch, args.dtype))
+            draft_model.to(device)
+            draft_model.eval()
+    result_cache = PredictionCache(args.result_cache) if args.result_cache else None
+    return PubGuard(model=model, tokenizer=tokenizer, metadata=load_metadata(args), prefix_cache=args.prefix_cache,
+                    draft_model=draft_model, result_cache=result_cache, metrics=Metrics() if with_metrics else None)
+
+
+def screen(args) -> int:
+    """
+    Screens every article of the input not yet in the output, appending one JSON line per
+    article as its batch completes. Articles screened without Semantic Scholar author data
+    are marked with a "degraded" reason. With --prompts, the input is the output of
+    pub-guard enrich and is screened without enriching it again.
+    """
+    done = completed_ids(args.output) if args.output != "-" else set()
+    id_field = 'id' if args.prompts else args.id_field
+    articles = ((article_id, article) for article_id, article in _article_ids(read_articles(args.input), id_field)
+                if article_id not in done)
+    if done:
+        print(f"Resuming: {len(done)} articles already screened", file=sys.stderr)
+    pub_guard = load_pub_guard(args, with_metrics=bool(args.metrics))
+    if args.prompts:
+        return _screen_prompts(args, pub_guard, articles)
+
+    # Enrichment rewrites articles in place, so the IDs of articles in flight are kept aside;
+    # results come back in input order
+    ids = deque()
+
+    def tracked():
+        for article_id, article in articles:
+            ids.append(article_id)
+            yield article
+
+    key = 'score' if args.score else 'answer'
+    output = sys.stdout if args.output == "-" else open(args.output, 'a', encoding='utf-8')
+    count = 0
+    try:
+        results = pub_guard.screen_stream(tracked(), batch_size=args.batch_size, chunk_size=args.chunk_size,
+                                          workers=args.workers, queue_size=args.queue_size, score=args.score,
+                                          max_new_token=args.max_new_tokens, temperature=args.temperature)
+        for count, (article, result) in enumerate(results, 1):
+            line = {'id': ids.popleft(), key: result}
+            if article.get('Degraded'):
+                line['degraded'] = article['Degraded']
+            output.write(json.dumps(line, ensure_ascii=False) + "\n")
+            if count % args.chunk_size == 0:
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if args.metrics:
+            pub_guard.metrics.write_prometheus(args.metrics)
+    degraded = pub_guard.metadata.degradation_stats()
+    if degraded:
+        details = ", ".join(f"{n} {reason}" for reason, n in sorted(degraded.items()))
+        print(f"Screened {count} articles, {sum(degraded.values())} without author data ({details})", file=sys.stderr)
+    else:
+        print(f"Screened {count} articles", file=sys.stderr)
+    return 0
+
+
+def _screen_prompts(args, pub_guard, records: Iterator[Tuple[str, dict]]) -> int:
+    """
+    Screens the prompts written by ``enrich``, one chunk at a time. Records that hold an
+    error instead of a prompt get it as their answer, or no score.
+    """
+    key = 'score' if args.score else 'answer'
+    output = sys.stdout if args.output == "-" else open(args.output, 'a', encoding='utf-8')
+    count = 0
+    try:
+        for chunk in _chunks(records, args.chunk_size):
+            prompts = [record['prompt'] for _, record in chunk if 'prompt' in record]
+            if args.score:
+                results = iter(pub_guard.score_prompts(prompts, batch_size=args.batch_size))
+            else:
+                results = iter(pub_guard.predict_prompts(prompts, batch_size=args.batch_size,
+                                                         max_new_token=args.max_new_tokens,
+                                                         temperature=args.temperature))
+            for record_id, record in chunk:
+                if 'prompt' in record:
+                    result = next(results)
+                else:
+                    result = None if args.score else record.get('error')
+                line = {'id': record_id, key: result}
+                if record.get('degraded'):
+                    line['degraded'] = record['degraded']
+                output.write(json.dumps(line, ensure_ascii=False) + "\n")
+            output.flush()
+            count += len(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if args.metrics:
+            pub_guard.metrics.write_prometheus(args.metrics)
+    print(f"Screened {count} prompts", file=sys.stderr)
+    return 0
+
+
+def enrich(args) -> int:
+    """
+    Enriches every article of the input not yet in the output and appends its prompt as a
+    JSON line, for pub-guard screen --prompts to run through the model elsewhere. Needs
+    neither a model nor torch.
+    """
+    from .model.utils import prepare_prompts
+
+    done = completed_ids(args.output) if args.output != "-" else set()
+    articles = ((article_id, article) for article_id, article in _article_ids(read_articles(args.input), args.id_field)
+                if article_id not in done)
+    if done:
+        print(f"Resuming: {len(done)} articles already enriched", file=sys.stderr)
+    metadata = load_metadata(args)
+
+    def write(ids: List[str], records: List[dict]):
+        for record_id, record in zip(ids, records):
+            output.write(json.dumps(dict(record, id=record_id), ensure_ascii=False) + "\n")
+        output.flush()
+
+    output = sys.stdout if args.output == "-" else open(args.output, 'a', encoding='utf-8')
+    count = 0
+    try:
+        # Up to --workers chunks are enriched at once; they are written in input order
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            pending = deque()
+            for chunk in _chunks(articles, args.chunk_size):
+                ids = [article_id for article_id, _ in chunk]
+                pending.append((ids, executor.submit(prepare_prompts, [article for _, article in chunk], metadata)))
+                if len(pending) >= args.workers:
+                    ids, future = pending.popleft()
+                    write(ids, future.result())
+                count += len(chunk)
+            while pending:
+                ids, future = pending.popleft()
+                write(ids, future.result())
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    degraded = metadata.degradation_stats()
+    if degraded:
+        details = ", ".join(f"{n} {reason}" for reason, n in sorted(degraded.items()))
+        print(f"Enriched {count} articles, {sum(degraded.values())} without author data ({details})", file=sys.stderr)
+    else:
+        print(f"Enriched {count} articles", file=sys.stderr)
+    return 0
+
+
+def prefetch(args) -> int:
+    """
+    Fetches the Semantic Scholar authors and the OpenAlex institution counts of every
+    article of the input into --cache, ahead of screening them. With --refresh, also
+    re-fetches cached entries expiring within --refresh-days, rewriting only those that
+    changed.
+    """
+    from .model.cache import DAY
+    from .model.openalex import OPENALEX_URL, OpenAlexClient
+    from .model.prefetch import Prefetcher
+
+    if not args.cache:
+        raise SystemExit("pub-guard prefetch needs a --cache file to fill")
+    openalex = None if args.no_openalex else OpenAlexClient(base_url=args.openalex_url or OPENALEX_URL, mailto=args.mailto)
+    prefetcher = Prefetcher(load_metadata(args), openalex=openalex, chunk_size=args.chunk_size,
+                            refresh_window=args.refresh_days * DAY)
+    if args.input:
+        for chunk in _chunks(read_articles(args.input), args.chunk_size):
+            prefetcher.prefetch(chunk)
+    if args.refresh:
+        prefetcher.refresh()
+    stats = prefetcher.stats()
+    print(", ".join(f"{name.replace('_', ' ')}: {n}" for name, n in sorted(stats.items())) or "Nothing to do",
+          file=sys.stderr)
+    return 0
+
+
+def serve(args) -> int:
+    """
+    Serves POST /predict and POST /score over HTTP, batching concurrent requests together.
+    """
+    import asyncio
+    from .server import PubGuardServer
+
+    pub_guard = load_pub_guard(args, with_metrics=True)
+    server = PubGuardServer(pub_guard, host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+                            max_wait=args.max_wait_ms / 1000, max_concurrency=args.max_concurrency,
+                            max_queue=args.max_queue, max_new_token=args.max_new_tokens, temperature=args.temperature)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _add_model_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="a model name or local directory")
+    parser.add_argument("--draft-model",
+                        help="a smaller model with the same tokenizer proposing tokens for --model to verify, "
+                             "e.g. Lihuchen/pub-guard-llama-1b")
+    parser.add_argument("--device", help="the device to run the model on (default: cuda if available)")
+    parser.add_argument("--dtype", default="bfloat16", choices=["bfloat16", "float16", "float32", "int8"],
+                        help="the weight dtype; int8 quantizes the linear layers and needs --device cpu")
+    parser.add_argument("--threads", type=int, help="torch threads on CPU (default: all available CPUs)")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--temperature", type=float, default=0.1)
+    parser.add_argument("--prefix-cache", action="store_true",
+                        help="reuse the KV cache of the instructions shared by all prompts")
+    _add_metadata_arguments(parser)
+    parser.add_argument("--result-cache", help="a SQLite file of earlier results, reused for prompts seen before")
+    parser.add_argument("--verbose", action="store_true", help="log every generated prompt")
+
+
+def _add_metadata_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--api-url", help="the Semantic Scholar Graph API base URL")
+    parser.add_argument("--api-key", help="a Semantic Scholar API key (default: $S2_API_KEY)")
+    parser.add_argument("--enrichment-timeout", type=float,
+                        help="seconds to wait for an article's authors, rate limiting included, before screening "
+                             "it without them")
+    parser.add_argument("--cache", help="a SQLite file caching Semantic Scholar lookups across runs")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="pub-guard", description="Screen biomedical articles for signs of fraud.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    screen_parser = commands.add_parser("screen", help="screen a stream of articles",
+                                        description=screen.__doc__.strip())
+    screen_parser.add_argument("input", help="a .jsonl or .parquet file of articles, or - for standard input")
+    screen_parser.add_argument("-o", "--output", default="-",
+                               help="the JSON Lines file results are appended to (default: standard output)")
+    screen_parser.add_argument("--id-field", default="PMID", help="the article field identifying it in the output")
+    _add_model_arguments(screen_parser)
+    screen_parser.add_argument("--prompts", action="store_true",
+                               help="the input holds prompts written by pub-guard enrich, identified by their id")
+    screen_parser.add_argument("--score", action="store_true",
+                               help="output the retraction probability instead of a generated answer")
+    screen_parser.add_argument("--batch-size", type=int, default=8, help="prompts per model batch")
+    screen_parser.add_argument("--chunk-size", type=int, default=64, help="articles enriched together")
+    screen_parser.add_argument("--workers", type=int, default=4, help="chunks enriched concurrently")
+    screen_parser.add_argument("--queue-size", type=int, default=4, help="enriched chunks buffered ahead of the model")
+    screen_parser.add_argument("--metrics",
+                               help="a file to write stage timings, request and token counts to, "
+                                    "in the Prometheus text format")
+    screen_parser.set_defaults(func=screen)
+
+    enrich_parser = commands.add_parser("enrich", help="write the enriched prompts of a stream of articles",
+                                        description=enrich.__doc__.strip())
+    enrich_parser.add_argument("input", help="a .jsonl or .parquet file of articles, or - for standard input")
+    enrich_parser.add_argument("-o", "--output", default="-",
+                               help="the JSON Lines file prompts are appended to (default: standard output)")
+    enrich_parser.add_argument("--id-field", default="PMID", help="the article field identifying it in the output")
+    _add_metadata_arguments(enrich_parser)
+    enrich_parser.add_argument("--chunk-size", type=int, default=64, help="articles enriched together")
+    enrich_parser.add_argument("--workers", type=int, default=4, help="chunks enriched concurrently")
+    enrich_parser.set_defaults(func=enrich)
+
+    prefetch_parser = commands.add_parser("prefetch", help="fill the metadata cache ahead of screening",
+                                          description=prefetch.__doc__.strip())
+    prefetch_parser.add_argument("input", nargs="?",
+                                 help="a .jsonl or .parquet file of articles, or - for standard input")
+    _add_metadata_arguments(prefetch_parser)
+    prefetch_parser.add_argument("--openalex-url", help="the OpenAlex API base URL")
+    prefetch_parser.add_argument("--mailto", help="a contact e-mail address for OpenAlex's polite pool")
+    prefetch_parser.add_argument("--no-openalex", action="store_true", help="keep the bundled institution counts")
+    prefetch_parser.add_argument("--chunk-size", type=int, default=256, help="articles resolved together")
+    prefetch_parser.add_argument("--refresh", action="store_true", help="re-fetch cached entries about to expire")
+    prefetch_parser.add_argument("--refresh-days", type=float, default=7,
+                                 help="how many days before they expire entries are refreshed")
+    prefetch_parser.set_defaults(func=prefetch)
+
+    serve_parser = commands.add_parser("serve", help="serve the model over HTTP", description=serve.__doc__.strip())
+    serve_parser.add_argument("--host", default="127.0.0.1", help="the interface to listen on")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    _add_model_arguments(serve_parser)
+    serve_parser.add_argument("--max-batch-size", type=int, default=8, help="prompts per model batch")
+    serve_parser.add_argument("--max-wait-ms", type=float, default=10,
+                              help="milliseconds a prompt may wait for others to fill its batch")
+    serve_parser.add_argument("--max-concurrency", type=int, default=64,
+                              help="requests handled at once; more are answered 503")
+    serve_parser.add_argument("--max-queue", type=int,
+                              help="prompts waiting for the model per endpoint before requests are answered 503 "
+                                   "(default: --max-concurrency)")
+    serve_parser.set_defaults(func=serve)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    if not getattr(args, 'verbose', False):
+        logging.getLogger("pub_guard_llm").setLevel(logging.WARNING)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
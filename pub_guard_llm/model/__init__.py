@@ -1,5 +1,20 @@
-from .inference import PubGuard
+"""
+``PubGuard`` needs torch and transformers, which take seconds to import, so it is only
+imported on first use: enrichment alone (``Metadata``, ``prepare_prompts``) runs without them.
+"""
+import importlib
 
-__all__ = [
-    PubGuard
-]
\ No newline at end of file
+_EXPORTS = {
+    'PubGuard': '.inference',
+    'Metadata': '.utils',
+    'format_prompt': '.utils',
+    'prepare_prompts': '.utils',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+DAY = 24 * 60 * 60
+_MISSING = object()
+
+# The SQLite table and key column of each kind of record that expires and can be refreshed
+TABLES = {'author': ("authors", "author_id"), 'institution': ("institutions", "name")}
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalizes a paper title into a cache key: case, accents, punctuation and spacing
+    differences do not produce different keys.
+    """
+    title = unicodedata.normalize("NFKD", title.casefold())
+    title = "".join(ch for ch in title if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", title))
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded in-memory cache that evicts the least recently used entry.
+    """
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._data.items())
+
+    def __len__(self):
+        return len(self._data)
+
+
+def connect_sqlite(local: threading.local, path: str) -> sqlite3.Connection:
+    """
+    Returns the connection to ``path`` of the calling thread, opening it in WAL mode with a
+    busy timeout if needed. A forked process opens its own instead of reusing its parent's.
+    """
+    connection = getattr(local, "connection", None)
+    if connection is None or local.pid != os.getpid():
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        local.connection, local.pid = connection, os.getpid()
+    return connection
+
+
+class MetadataCache:
+    """
+    Stores what Semantic Scholar told us about papers and authors, and what OpenAlex told
+    us about institutions.
+
+    This base class caches nothing; subclasses override the accessors. Author IDs are
+    keyed by normalized title; an empty list records that no paper was found. Institutions
+    are keyed by their casefolded name in the bundled affiliation index.
+    """
+    def __init__(self):
+        self.counts = Counter()
+        self._counts_lock = threading.Lock()
+
+    def get_author_ids(self, title: str) -> Optional[List[str]]:
+        """
+        Returns:
+            Optional[List[str]]: The cached author IDs, [] if the title is known to have no
+            match, or None if the title is not cached.
+        """
+        return None
+
+    def put_author_ids(self, title: str, author_ids: List[str]):
+        pass
+
+    def get_author(self, author_id: str) -> Optional[Dict[str, str]]:
+        return None
+
+    def put_authors(self, authors: Dict[str, Dict[str, str]]):
+        pass
+
+    def get_institution(self, name: str) -> Optional[dict]:
+        return None
+
+    def put_institutions(self, institutions: Dict[str, dict]):
+        pass
+
+    def expiring(self, kind: str, within: float = 0.0, limit: Optional[int] = None) -> List[str]:
+        """
+        Returns the keys of ``kind`` ("author" or "institution") entries that have expired or
+        will within ``within`` seconds, the soonest to expire first.
+        """
+        return []
+
+    def refresh(self, kind: str, records: Dict[str, dict]) -> int:
+        """
+        Stores freshly fetched ``kind`` records, rewriting only those that changed; the
+        others just get a new expiry.
+
+        Returns:
+            int: The number of records that changed.
+        """
+        return 0
+
+    def count(self, name: str, n: int = 1):
+        with self._counts_lock:
+            self.counts[name] += n
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns hit/miss counts for titles and authors since the cache was created.
+        """
+        with self._counts_lock:
+            return dict(self.counts)
+
+
+class SQLiteMetadataCache(MetadataCache):
+    """
+    A ``MetadataCache`` persisted in SQLite, with an LRU tier in memory in front of it.
+
+    The database runs in WAL mode with a busy timeout, and every process and thread opens
+    its own connection, so several workers can share one cache file.
+
+    Args:
+        path (str): The SQLite database file.
+        ttl (float): Seconds before a found title, author or institution has to be fetched again.
+        negative_ttl (float): Seconds before a title without a match is searched again.
+        memory_size (int): The number of entries kept in the in-memory tier.
+    """
+    def __init__(self, path: str, ttl: float = 30 * DAY, negative_ttl: float = DAY, memory_size: int = 4096):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(memory_size)
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS titles (key TEXT PRIMARY KEY, author_ids TEXT, expires REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS authors (author_id TEXT PRIMARY KEY, record TEXT, expires REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS institutions (name TEXT PRIMARY KEY, record TEXT, expires REAL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(self._local, self.path)
+
+    def _lookup(self, kind: str, key: str, query: str):
+        now = time.time()
+        entry = self.memory.get((kind, key))
+        if entry is None or entry[1] < now:
+            # Another process may have refreshed an entry that expired in our memory tier
+            row = self._connect().execute(query, (key,)).fetchone()
+            entry = (json.loads(row[0]), row[1]) if row is not None else None
+            if entry is not None:
+                self.memory.put((kind, key), entry)
+        if entry is None or entry[1] < now:
+            self.count(f"{kind}_misses")
+            return None
+        self.count(f"{kind}_hits")
+        return entry[0]
+
+    def get_author_ids(self, title: str) -> Optional[List[str]]:
+        return self._lookup("title", normalize_title(title), "SELECT author_ids, expires FROM titles WHERE key = ?")
+
+    def put_author_ids(self, title: str, author_ids: List[str]):
+        key = normalize_title(title)
+        expires = time.time() + (self.ttl if author_ids else self.negative_ttl)
+        self._connect().execute("INSERT OR REPLACE INTO titles VALUES (?, ?, ?)", (key, json.dumps(author_ids), expires))
+        self.memory.put(("title", key), (list(author_ids), expires))
+
+    def get_author(self, author_id: str) -> Optional[Dict[str, str]]:
+        return self._lookup("author", author_id, "SELECT record, expires FROM authors WHERE author_id = ?")
+
+    def put_authors(self, authors: Dict[str, Dict[str, str]]):
+        self._put("author", authors)
+
+    def get_institution(self, name: str) -> Optional[dict]:
+        return self._lookup("institution", name.casefold(), "SELECT record, expires FROM institutions WHERE name = ?")
+
+    def put_institutions(self, institutions: Dict[str, dict]):
+        self._put("institution", {name.casefold(): record for name, record in institutions.items()})
+
+    def _put(self, kind: str, records: Dict[str, dict], unchanged: Iterable[str] = ()):
+        table, column = TABLES[kind]
+        unchanged = list(unchanged)
+        if not records and not unchanged:
+            return
+        expires = time.time() + self.ttl
+        connection = self._connect()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)",
+                                   [(key, json.dumps(record), expires) for key, record in records.items()])
+            connection.executemany(f"UPDATE {table} SET expires = ? WHERE {column} = ?",
+                                   [(expires, key) for key in unchanged])
+        for key, record in records.items():
+            self.memory.put((kind, key), (record, expires))
+        for key in unchanged:
+            entry = self.memory.get((kind, key))
+            if entry is not None:
+                self.memory.put((kind, key), (entry[0], expires))
+
+    def expiring(self, kind: str, within: float = 0.0, limit: Optional[int] = None) -> List[str]:
+        table, column = TABLES[kind]
+        rows = self._connect().execute(f"SELECT {column} FROM {table} WHERE expires < ? ORDER BY expires LIMIT ?",
+                                       (time.time() + within, -1 if limit is None else limit))
+        return [row[0] for row in rows]
+
+    def refresh(self, kind: str, records: Dict[str, dict]) -> int:
+        table, column = TABLES[kind]
+        keys = list(records)
+        stored = {}
+        connection = self._connect()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = connection.execute(f"SELECT {column}, record FROM {table} WHERE {column} IN "
+                                      f"({', '.join('?' * len(chunk))})", chunk)
+            stored.update((key, json.loads(record)) for key, record in rows)
+        changed = {key: record for key, record in records.items() if stored.get(key) != record}
+        self._put(kind, changed, unchanged=[key for key in records if key not in changed])
+        return len(changed)
+
+
+class PredictionCache:
+    """
+    Stores PubGuard results by a hash of the prompt, the generation parameters and the
+    model, so that an article submitted again with the same enriched metadata skips the
+    model. Results are kept in an LRU tier in memory and, if ``path`` is given, in SQLite.
+
+    Entries do not expire: a change in what the prompt says about the authors, institutions
+    or journal changes the key.
+
+    Args:
+        path (str): The SQLite database file, or None to keep results in memory only.
+        memory_size (int): The number of results kept in the in-memory tier.
+    """
+    def __init__(self, path: Optional[str] = None, memory_size: int = 4096):
+        self.path = path
+        self.memory = LRUCache(memory_size)
+        self.counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._local = threading.local()
+        if path is not None:
+            self._connect().execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect_sqlite(self._local, self.path)
+
+    @staticmethod
+    def key(prompt: str, params: dict, model_id: str) -> str:
+        """
+        Returns the cache key of a prompt run with generation ``params`` on ``model_id``.
+        """
+        blob = json.dumps([model_id, params, prompt], sort_keys=True, default=repr, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key, _MISSING)
+        tier = "memory"
+        if value is _MISSING and self.path is not None:
+            row = self._connect().execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                self.memory.put(key, value)
+                tier = "disk"
+        with self._counts_lock:
+            if value is _MISSING:
+                self.counts["misses"] += 1
+                return None
+            self.counts[f"{tier}_hits"] += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        self.warm([(key, value)])
+
+    def warm(self, entries: Iterable[Tuple[str, Any]]) -> int:
+        """
+        Stores many ``(key, value)`` pairs at once, e.g. from another cache's ``export``.
+
+        Returns:
+            int: The number of entries stored.
+        """
+        entries = list(entries)
+        if self.path is not None and entries:
+            connection = self._connect()
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?)",
+                                       [(key, json.dumps(value)) for key, value in entries])
+        for key, value in entries:
+            self.memory.put(key, value)
+        return len(entries)
+
+    def export(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Yields every stored ``(key, value)`` pair: those on disk, or those in memory when the
+        cache has no ``path``.
+        """
+        if self.path is None:
+            yield from self.memory.items()
+            return
+        for key, value in self._connect().execute("SELECT key, value FROM predictions"):
+            yield key, json.loads(value)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the hits per tier, the misses and the hit rate since the cache was created.
+        """
+        with self._counts_lock:
+            stats = {name: self.counts[name] for name in ("memory_hits", "disk_hits", "misses")}
+        lookups = sum(stats.values())
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,213 @@
+"""
+Running PubGuard on CPUs: int8 weights, thread tuning and a pool of worker processes.
+"""
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+import torch
+from .inference import PubGuard
+from .utils import Metadata, error_message, enrich_and_format
+
+CPU_DTYPES = ("float32", "bfloat16", "int8")
+
+
+def available_cpus() -> int:
+    """
+    Returns the number of CPUs this process may run on, which can be fewer than the machine has.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def configure_threads(num_threads: Optional[int] = None, workers: int = 1) -> int:
+    """
+    Sets the number of threads torch runs operators on, by default an equal share of the
+    available CPUs for each of ``workers`` processes, so that workers do not compete for
+    the same cores.
+
+    Returns:
+        int: The number of threads set.
+    """
+    num_threads = num_threads or max(1, available_cpus() // workers)
+    torch.set_num_threads(num_threads)
+    try:
+        # Generation runs one operator at a time; inter-op threads would only compete
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Only possible before the first parallel operation
+    return num_threads
+
+
+def quantize_int8(model):
+    """
+    Quantizes the linear layers of the decoder to int8 weights with activations quantized
+    on the fly (dynamic quantization), in place. The language-model head stays in floating
+    point, as it decides between the "Yes" and "No" tokens.
+
+    Uses ``torchao`` if it is installed and ``torch.ao.quantization`` otherwise. The model
+    must be in float32; it still reports that dtype afterwards, so its
+    ``weight_quantization`` is set to ``"int8"`` to keep ``model_identity`` apart from the
+    unquantized model's.
+
+    Returns:
+        The quantized model.
+    """
+    try:
+        from torchao.quantization import Int8DynamicActivationInt8WeightConfig, quantize_
+    except ImportError:
+        with warnings.catch_warnings():
+            # Deprecated in favour of torchao, but still the only option without it
+            warnings.simplefilter("ignore", DeprecationWarning)
+            warnings.simplefilter("ignore", UserWarning)
+            torch.ao.quantization.quantize_dynamic(model.get_decoder(), {torch.nn.Linear}, dtype=torch.qint8,
+                                                   inplace=True)
+    else:
+        quantize_(model.get_decoder(), Int8DynamicActivationInt8WeightConfig())
+    model.weight_quantization = "int8"
+    return model
+
+
+def load_cpu_model(model_path: str, dtype: str = "float32"):
+    """
+    Loads a model and its tokenizer for CPU inference.
+
+    Safetensors checkpoints are memory-mapped: when ``dtype`` is the dtype the checkpoint
+    was saved in, the weights stay in the page cache, shared by every process that loads
+    the same file, instead of being copied into each (see ``mapped_weight_fraction``).
+    int8 weights are quantized after loading and are private to each process.
+
+    Args:
+        model_path (str): A model name or local directory.
+        dtype (str): ``float32``, ``bfloat16`` or ``int8``.
+
+    Returns:
+        The model, in evaluation mode, and its tokenizer.
+    """
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    if dtype not in CPU_DTYPES:
+        raise ValueError(f"Unsupported CPU dtype {dtype!r}, use one of {CPU_DTYPES}")
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    torch_dtype = torch.bfloat16 if dtype == "bfloat16" else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch_dtype)
+    model.eval()
+    if dtype == "int8":
+        quantize_int8(model)
+    return model, tokenizer
+
+
+def mapped_weight_fraction(model) -> Optional[float]:
+    """
+    Returns the fraction of parameter bytes that are memory-mapped from ``.safetensors``
+    files rather than held in private memory, or None where ``/proc/self/maps`` is not
+    available.
+    """
+    try:
+        with open("/proc/self/maps") as maps:
+            ranges = [tuple(int(address, 16) for address in line.split()[0].split("-"))
+                      for line in maps if ".safetensors" in line]
+    except OSError:
+        return None
+    total = mapped = 0
+    for parameter in model.parameters():
+        size = parameter.numel() * parameter.element_size()
+        total += size
+        if any(start <= parameter.data_ptr() < end for start, end in ranges):
+            mapped += size
+    return mapped / total if total else 0.0
+
+
+_worker: Optional[PubGuard] = None
+
+
+def _init_worker(model_path: str, dtype: str, num_threads: int, prefix_cache: bool):
+    global _worker
+    configure_threads(num_threads)
+    model, tokenizer = load_cpu_model(model_path, dtype)
+    _worker = PubGuard(model=model, tokenizer=tokenizer, metadata=Metadata(), prefix_cache=prefix_cache)
+
+
+def _predict_shard(prompts: List[str], batch_size: int, max_new_token: int, temperature: float, kwargs: dict) -> List[str]:
+    return _worker.predict_prompts(prompts, batch_size=batch_size, max_new_token=max_new_token,
+                                   temperature=temperature, **kwargs)
+
+
+def _score_shard(prompts: List[str], batch_size: int) -> List[Optional[float]]:
+    return _worker.score_prompts(prompts, batch_size=batch_size)
+
+
+class CPUWorkerPool:
+    """
+    Screens articles with several worker processes, each running the model on its share of
+    the CPU cores.
+
+    Articles are enriched in the calling process, so one Semantic Scholar client, rate
+    limit and cache serve all workers. Their prompts are sorted by length and sent to the
+    workers one batch at a time, so a worker that finishes early takes the next batch.
+    Workers load the model with ``load_cpu_model``: with a float32 or bfloat16 checkpoint
+    served in its own dtype, they share one copy of the weights in the page cache.
+
+    Args:
+        model_path (str): A model name or local directory.
+        workers (int): The number of worker processes.
+        dtype (str): ``float32``, ``bfloat16`` or ``int8``.
+        threads_per_worker (int): Torch threads per worker; an equal share of the available
+            CPUs if omitted.
+        metadata (Metadata): Enrichment configuration, a default ``Metadata()`` if omitted.
+        prefix_cache (bool): Passed to each worker's ``PubGuard``.
+    """
+    def __init__(self, model_path: str, workers: int = 2, dtype: str = "float32",
+                 threads_per_worker: Optional[int] = None, metadata: Optional[Metadata] = None,
+                 prefix_cache: bool = False):
+        if dtype not in CPU_DTYPES:
+            raise ValueError(f"Unsupported CPU dtype {dtype!r}, use one of {CPU_DTYPES}")
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, available_cpus() // workers)
+        self.metadata = metadata or Metadata()
+        # Forking a process that has run torch can deadlock, so workers start afresh
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+            initargs=(model_path, dtype, self.threads_per_worker, prefix_cache))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+    def predict_batch(self, input_articles: List[dict], batch_size=8, max_new_token=256, temperature=0.1,
+                      **kwargs) -> List[str]:
+        """
+        The multi-process version of ``PubGuard.predict_batch``. With greedy decoding the
+        answers match those of a single process running the same model.
+        """
+        prompts, results = enrich_and_format(input_articles, self.metadata, error_message,
+                                             metrics=self.metadata.metrics)
+        for shard, answers in self._run(prompts, batch_size, _predict_shard, max_new_token, temperature, kwargs):
+            for idx, answer in zip(shard, answers):
+                results[idx] = answer
+        return results
+
+    def score_batch(self, input_articles: List[dict], batch_size=8) -> List[Optional[float]]:
+        """
+        The multi-process version of ``PubGuard.score_batch``.
+        """
+        prompts, results = enrich_and_format(input_articles, self.metadata, lambda e: None,
+                                             metrics=self.metadata.metrics)
+        for shard, scores in self._run(prompts, batch_size, _score_shard):
+            for idx, score in zip(shard, scores):
+                results[idx] = score
+        return results
+
+    def _run(self, prompts: List[Optional[str]], batch_size: int, task, *args) -> List[Tuple[List[int], list]]:
+        pending = sorted((idx for idx, prompt in enumerate(prompts) if prompt is not None),
+                         key=lambda idx: len(prompts[idx]))
+        shards = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        futures = [self._executor.submit(task, [prompts[idx] for idx in shard], batch_size, *args) for shard in shards]
+        return [(shard, future.result()) for shard, future in zip(shards, futures)]
@@ -1,65 +1,726 @@
+import asyncio
+import copy
+import queue
+import threading
+import time
 import traceback
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from .utils import format_prompt, extract_answer, Metadata
-
-# Configure logging to print INFO messages to the console
-logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteriaList
+from .cache import PredictionCache
+from .metrics import NULL_METRICS, Metrics
+from .streaming import StopOnEvent, StreamDecoder, TokenStreamer, cached_events
+from .utils import REQUIRED_KEYS, error_message, enrich_and_format, format_prompt, extract_answer, Metadata
 
 logger = logging.getLogger(__name__)
 
+# Everything in a formatted prompt up to and including this line is the same for every article
+ARTICLE_MARKER = "Analyze the following paper:\n"
+PLACEHOLDER_ARTICLE = {key: "" for key in REQUIRED_KEYS}
+
+
+def model_identity(*models) -> str:
+    """
+    Names the weights behind models for cache keys: checkpoint, revision, dtype and weight
+    quantization (see ``cpu.quantize_int8``).
+    """
+    return "+".join(f"{model.config._name_or_path}@{getattr(model.config, '_commit_hash', None) or ''}:{model.dtype}"
+                    + (f":{model.weight_quantization}" if getattr(model, 'weight_quantization', None) else "")
+                    for model in models if model is not None)
+
+
+def _cacheable(result) -> bool:
+    return result is not None and not (isinstance(result, str) and result.startswith("Error:"))
+
+
+def fit_platt_scaling(margins: List[float], labels: List[bool]) -> Tuple[float, float]:
+    """
+    Fits ``sigmoid(scale * margin + bias)`` to binary labels by maximum likelihood.
+
+    Returns:
+        Tuple[float, float]: The scale and bias.
+    """
+    x = torch.tensor(margins, dtype=torch.float64)
+    y = torch.tensor([float(label) for label in labels], dtype=torch.float64)
+    params = torch.tensor([1.0, 0.0], dtype=torch.float64, requires_grad=True)
+    optimizer = torch.optim.LBFGS([params], max_iter=100, line_search_fn="strong_wolfe")
+
+    def closure():
+        optimizer.zero_grad()
+        loss = torch.nn.functional.binary_cross_entropy_with_logits(params[0] * x + params[1], y)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    scale, bias = params.detach().tolist()
+    return scale, bias
+
+
 class PubGuard():
-    def __init__(self, model, tokenizer):
-        self.metadata = Metadata()
+    def __init__(self, model, tokenizer, metadata=None, prefix_cache=False, draft_model=None, result_cache=None,
+                 metrics: Optional[Metrics] = None):
+        """
+        Args:
+            model: The causal language model, already moved to its device.
+            tokenizer: The tokenizer of ``model``, with its chat template.
+            metadata (Metadata): Enrichment configuration, a default ``Metadata()`` if omitted.
+            prefix_cache (bool): Encode the chat template and instruction block shared by all
+                prompts once, and only prefill the article-specific suffix of each request.
+            draft_model: A smaller model sharing ``tokenizer`` (e.g. pub-guard-llama-1b for
+                pub-guard-llama-8b), on the same device. It proposes tokens that ``model``
+                verifies several at a time (assisted generation); under greedy decoding the
+                answers are the same as without it. Prompts are then generated one at a
+                time and without the prefix cache, and ``score`` does not use it.
+            result_cache (PredictionCache): Reuses the answers and scores of prompts seen
+                before with the same generation parameters and model (see ``model_id``).
+            metrics (Metrics): Receives stage timings and token counts, and is passed on to
+                ``metadata``; see ``stats``. Nothing is measured without it.
+        """
+        self.metadata = metadata or Metadata()
         self.tokenizer = tokenizer
         self.model = model
+        self.draft_model = draft_model
+        self.result_cache = result_cache
+        self.metrics = metrics or NULL_METRICS
+        if metrics is not None and isinstance(self.metadata, Metadata):
+            self.metadata.use_metrics(metrics)
+        # Part of every result cache key; set it to tell apart models loaded without a name
+        self.model_id = model_identity(model, draft_model)
+        # The number of prompt positions run through prefill, for measuring the prefix cache
+        self.prefill_tokens = 0
+        self._prefix_ids = None
+        self._prefix_cache = None
+        self._label_ids = None
+        # Platt scaling of the Yes/No logit margin used by score; see calibrate
+        self.score_scale = 1.0
+        self.score_bias = 0.0
+        if prefix_cache:
+            self._build_prefix_cache()
+
+    def stats(self) -> dict:
+        """
+        Returns a snapshot of what has been measured since the ``metrics`` were created.
+
+        Besides the raw ``counters`` and ``histograms`` of ``Metrics.snapshot``:
+
+        - ``stages``: the count, total and mean seconds of each stage: ``enrichment``,
+          ``formatting``, ``tokenization``, ``prefill``, ``decode``, ``extraction`` and
+          ``scoring``;
+        - ``tokens``: the ``prompt`` and ``generated`` token counts, and ``tokens_per_sec``,
+          the generated tokens over the time spent in prefill and decode;
+        - ``http``: Semantic Scholar requests by endpoint and outcome (``200``, other
+          statuses, ``timeout``, ``error``, ``rejected`` by the circuit breaker, ...);
+        - ``reference_lookups``: institution lookups that hit the index ``exact``-ly, through
+          the ``fuzzy`` matcher, or ``miss``-ed, and journal ``hit``-s and ``miss``-es;
+        - ``author_cache``, ``degraded`` and ``result_cache``: the counts kept by the author
+          lookup cache, ``Metadata`` and ``result_cache``.
+        """
+        stats = self.metrics.snapshot()
+        stats['stages'] = {
+            stage: {'count': h['count'], 'total_seconds': h['sum'], 'mean_seconds': h['mean']}
+            for stage, h in ((labels.split("=", 1)[1], h) for labels, h in stats['histograms'].get('stage_seconds', {}).items())
+        }
+        generated = self.metrics.counter('generated_tokens_total')
+        _, generation_seconds = self.metrics.histogram_totals('stage_seconds', stage='prefill')
+        _, decode_seconds = self.metrics.histogram_totals('stage_seconds', stage='decode')
+        generation_seconds += decode_seconds
+        stats['tokens'] = {
+            'prompt': self.metrics.counter('prompt_tokens_total'),
+            'generated': generated,
+            'tokens_per_sec': generated / generation_seconds if generation_seconds else 0.0,
+        }
+        stats['http'] = stats['counters'].get('http_requests_total', {})
+        stats['reference_lookups'] = stats['counters'].get('reference_lookups_total', {})
+        if isinstance(self.metadata, Metadata):
+            stats['author_cache'] = self.metadata.cache_stats()
+            stats['degraded'] = self.metadata.degradation_stats()
+        if self.result_cache is not None:
+            stats['result_cache'] = self.result_cache.stats()
+        return stats
     
     def predict(self, input_article, max_new_token=256, temperature=0.1, **kwargs):
-        required_keys = {'Title', 'Abstract', 'Authors', 'Institutions', 'Journal'}
-
         # Ensure all required keys are present
-        assert required_keys.issubset(input_article.keys()), f"Missing keys: {required_keys - input_article.keys()}"
+        assert REQUIRED_KEYS.issubset(input_article.keys()), f"Missing keys: {REQUIRED_KEYS - input_article.keys()}"
         
         try:
-            input_article = self.metadata.get_external_knowledge(input_article)
-            prompt = format_prompt(input_article, examples=[], k_shot=0)
-            logger.info(f"Generated Prompt: {prompt}")
-            messages = [
-            {"from": "human", "value": prompt},
-            ]
-            inputs = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=True,
-                add_generation_prompt=True,
-                return_tensors="pt",
-            ).to(self.model.device)
-
-            outputs = self.model.generate(input_ids=inputs, max_new_tokens=max_new_token, use_cache=True,
-                                temperature=temperature, **kwargs)
-            generated_text = self.tokenizer.batch_decode(outputs)
-            answer = extract_answer(generated_text[0])
+            prompt = self._build_prompt(input_article)
+            params = dict(kwargs, max_new_token=max_new_token, temperature=temperature)
+            answer = self._cached([prompt], 'answer', params, lambda prompts: self._generate_batch(
+                [self._encode(prompts[0])], max_new_token=max_new_token, temperature=temperature, **kwargs))[0]
             
             return answer
         
         except ValueError as ve:
             traceback.print_exc() 
             logger.error(f"ValueError: {ve}")
-            return "Error: Invalid input provided."
+            return error_message(ve)
 
         except RuntimeError as re:
             traceback.print_exc() 
             logger.error(f"RuntimeError: {re}")
-            return "Error: Model failed to generate a response."
+            return error_message(re)
 
         except Exception as e:
             traceback.print_exc() 
             logger.error(f"Unexpected Error: {e}")
-            return "Error: An unexpected issue occurred during prediction."
+            return error_message(e)
+
+    def predict_stream(self, input_article, max_new_token=256, temperature=0.1, **kwargs) -> Iterator[dict]:
+        """
+        Predicts one article, yielding the answer while it is being generated.
+
+        Yields, in order:
+
+        - ``{'type': 'label', 'label': 'Yes' | 'No' | None, 'ttft': float}`` as soon as the
+          first generated token shows the verdict;
+        - ``{'type': 'text', 'text': str}`` for each new piece of the explanation;
+        - ``{'type': 'done', 'answer': str, 'ttft': float, 'prefill_time': float, 'tokens': int,
+          'tokens_per_sec': float, 'latency': float, 'cached': bool}``, where ``answer`` is
+          what ``predict`` returns, ``ttft`` and ``latency`` count from the call (enrichment
+          included) and ``tokens_per_sec`` is the decoding rate after the first token. An
+          answer found in ``result_cache`` is replayed at once, with ``cached`` set.
+
+        A failure yields ``{'type': 'error', 'message': str}`` with the message ``predict``
+        would return. Closing the generator early stops generation.
+        """
+        # Ensure all required keys are present
+        assert REQUIRED_KEYS.issubset(input_article.keys()), f"Missing keys: {REQUIRED_KEYS - input_article.keys()}"
+        start = time.perf_counter()
+        try:
+            prompt = self._build_prompt(input_article)
+            ids = self._encode(prompt)
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Failed to prepare article: {e}")
+            yield {'type': 'error', 'message': error_message(e)}
+            return
+        key = self._result_key(prompt, 'answer', dict(kwargs, max_new_token=max_new_token, temperature=temperature))
+        answer = self.result_cache.get(key) if key else None
+        if answer is not None:
+            yield from cached_events(answer, start)
+            return
+
+        tokens = queue.Queue()
+        stop = threading.Event()
+        decoder = StreamDecoder(self.tokenizer, ids, *self._label_token_ids(), start)
+        thread = threading.Thread(target=self._generate_streaming, daemon=True,
+                                  args=(ids, tokens.put, stop, decoder, max_new_token, temperature, kwargs))
+        thread.start()
+        try:
+            while True:
+                item = tokens.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    yield {'type': 'error', 'message': error_message(item)}
+                    return
+                yield from decoder.feed(item)
+            for event in decoder.finish():
+                self._store_streamed(key, event)
+                yield event
+        finally:
+            stop.set()
+            thread.join()
+            self._observe_streamed(decoder)
+
+    async def apredict_stream(self, input_article, max_new_token=256, temperature=0.1, **kwargs) -> AsyncIterator[dict]:
+        """
+        The asynchronous version of ``predict_stream``, yielding the same events.
+
+        Enrichment runs on the event loop; generation runs in a thread, so the loop stays
+        free to serve other requests. Cancelling the consumer stops generation.
+        """
+        # Ensure all required keys are present
+        assert REQUIRED_KEYS.issubset(input_article.keys()), f"Missing keys: {REQUIRED_KEYS - input_article.keys()}"
+        start = time.perf_counter()
+        try:
+            with self.metrics.timer("stage_seconds", stage="enrichment"):
+                input_article = await self.metadata.aget_external_knowledge(input_article)
+            prompt = self._format(input_article)
+            ids = self._encode(prompt)
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Failed to prepare article: {e}")
+            yield {'type': 'error', 'message': error_message(e)}
+            return
+        key = self._result_key(prompt, 'answer', dict(kwargs, max_new_token=max_new_token, temperature=temperature))
+        answer = self.result_cache.get(key) if key else None
+        if answer is not None:
+            for event in cached_events(answer, start):
+                yield event
+            return
+
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        stop = threading.Event()
+        decoder = StreamDecoder(self.tokenizer, ids, *self._label_token_ids(), start)
+        push = lambda item: loop.call_soon_threadsafe(tokens.put_nowait, item)
+        generation = loop.run_in_executor(None, self._generate_streaming, ids, push, stop, decoder,
+                                          max_new_token, temperature, kwargs)
+        try:
+            while True:
+                item = await tokens.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    yield {'type': 'error', 'message': error_message(item)}
+                    return
+                for event in decoder.feed(item):
+                    yield event
+            for event in decoder.finish():
+                self._store_streamed(key, event)
+                yield event
+        finally:
+            stop.set()
+            await asyncio.shield(generation)
+            self._observe_streamed(decoder)
+
+    def predict_batch(self, input_articles: List[dict], batch_size=8, max_new_token=256, temperature=0.1, **kwargs) -> List[str]:
+        """
+        Predicts many articles, generating up to ``batch_size`` of them per ``model.generate`` call.
+
+        Authors of all articles are resolved together through the Semantic Scholar batch
+        endpoints (see ``Metadata.get_external_knowledge_batch``).
+
+        Args:
+            input_articles (List[dict]): Articles with the same keys as accepted by ``predict``.
+            batch_size (int): The maximum number of prompts generated together.
+
+        Returns:
+            List[str]: One answer per article, in input order. An article that fails
+            enrichment or generation gets the same error message ``predict`` would return,
+            without affecting the rest of the batch.
+        """
+        prompts, results = self.prepare_prompts(input_articles, error_message)
+
+        pending = [idx for idx, prompt in enumerate(prompts) if prompt is not None]
+        answers = self.predict_prompts([prompts[idx] for idx in pending], batch_size=batch_size,
+                                       max_new_token=max_new_token, temperature=temperature, **kwargs)
+        for idx, answer in zip(pending, answers):
+            results[idx] = answer
+        return results
+
+    def predict_prompts(self, prompts: List[str], batch_size=8, max_new_token=256, temperature=0.1, **kwargs) -> List[str]:
+        """
+        Runs already formatted prompts through the model in length-bucketed batches.
+
+        Prompts are sorted by token length before being split into batches so that each
+        batch is left-padded only up to its own longest prompt.
+
+        Args:
+            prompts (List[str]): Prompts built by ``format_prompt``.
+            batch_size (int): The maximum number of prompts generated together.
+
+        Returns:
+            List[str]: One answer per prompt, in input order.
+        """
+        params = dict(kwargs, max_new_token=max_new_token, temperature=temperature)
+        return self._cached(prompts, 'answer', params, lambda misses: self._run_batches(
+            misses, batch_size,
+            lambda batch_ids: self._generate_batch(batch_ids, max_new_token=max_new_token, temperature=temperature, **kwargs),
+            error_message,
+        ))
+
+    def score_prompts(self, prompts: List[str], batch_size=8) -> List[Optional[float]]:
+        """
+        Scores already formatted prompts in length-bucketed batches, as ``score_batch`` does
+        for articles.
+
+        Returns:
+            List[Optional[float]]: One retraction probability per prompt, in input order;
+            None for a prompt that could not be scored.
+        """
+        return [self._probability(margin) for margin in self._prompt_margins(prompts, batch_size)]
+
+    def score(self, input_article: dict) -> float:
+        """
+        Returns the probability that an article should be retracted from a single forward
+        pass, without generating an explanation.
+
+        The probability compares the logits of the "Yes" and "No" tokens at the position
+        where the model writes its label, mapped through the calibration set by ``calibrate``.
+        """
+        # Ensure all required keys are present
+        assert REQUIRED_KEYS.issubset(input_article.keys()), f"Missing keys: {REQUIRED_KEYS - input_article.keys()}"
+        return self.score_batch([input_article], batch_size=1)[0]
+
+    def score_batch(self, input_articles: List[dict], batch_size=8) -> List[Optional[float]]:
+        """
+        Scores many articles with one forward pass per batch.
+
+        Returns:
+            List[Optional[float]]: One retraction probability per article, in input order;
+            None for an article that could not be scored.
+        """
+        margins = self._score_margins(input_articles, batch_size)
+        return [self._probability(margin) for margin in margins]
+
+    def calibrate(self, input_articles: List[dict], labels: List[bool], batch_size=8):
+        """
+        Fits the mapping from the Yes/No logit margin to a probability (Platt scaling) on
+        articles with known outcomes, and uses it for subsequent ``score`` calls.
+
+        Args:
+            input_articles (List[dict]): Articles with the same keys as accepted by ``predict``.
+            labels (List[bool]): Whether each article was retracted.
+
+        Returns:
+            Tuple[float, float]: The fitted scale and bias.
+        """
+        margins = self._score_margins(input_articles, batch_size)
+        scored = [(margin, label) for margin, label in zip(margins, labels) if margin is not None]
+        self.score_scale, self.score_bias = fit_platt_scaling([m for m, _ in scored], [l for _, l in scored])
+        return self.score_scale, self.score_bias
+
+    def screen_stream(self, input_articles: Iterable[dict], batch_size=8, chunk_size=64, workers=4, queue_size=4,
+                      score=False, max_new_token=256, temperature=0.1, **kwargs) -> Iterator[Tuple[dict, Any]]:
+        """
+        Screens a stream of articles of any length, yielding results as batches complete.
+
+        Articles are read ``chunk_size`` at a time and enriched by ``workers`` threads while
+        the model works on earlier chunks, so Semantic Scholar lookups overlap with
+        generation. Reading stops while ``workers + queue_size`` chunks are being enriched or
+        waiting for the model, so memory use depends on the chunk and queue sizes, not on the
+        length of the stream.
+
+        Args:
+            input_articles (Iterable[dict]): Articles with the same keys as accepted by ``predict``.
+            batch_size (int): The maximum number of prompts run through the model together.
+            chunk_size (int): The number of articles enriched together.
+            workers (int): The number of chunks enriched concurrently.
+            queue_size (int): The number of chunks buffered ahead of the model on top of
+                those being enriched.
+            score (bool): Yield the retraction probability from ``score`` instead of a
+                generated answer.
+
+        Yields:
+            Tuple[dict, Any]: Each article, enriched, and its answer (or probability), in
+            input order. Failures are reported per article as in ``predict_batch`` and
+            ``score_batch``.
+        """
+        if score:
+            kind, params, on_error, run = 'margin', {}, lambda e: None, self._score_batch
+        else:
+            kind, on_error = 'answer', error_message
+            params = dict(kwargs, max_new_token=max_new_token, temperature=temperature)
+            run = lambda batch_ids: self._generate_batch(batch_ids, max_new_token=max_new_token,
+                                                         temperature=temperature, **kwargs)
+        articles = iter(input_articles)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            def submit() -> bool:
+                chunk = list(islice(articles, chunk_size))
+                if chunk:
+                    pending.append((chunk, executor.submit(self.prepare_prompts, chunk, on_error)))
+                return bool(chunk)
+
+            while len(pending) < workers + queue_size and submit():
+                pass
+            while pending:
+                chunk, future = pending.popleft()
+                prompts, results = future.result()
+                submit()
+                ready = [idx for idx, prompt in enumerate(prompts) if prompt is not None]
+                outputs = self._cached([prompts[idx] for idx in ready], kind, params,
+                                       lambda misses: self._run_batches(misses, batch_size, run, on_error))
+                for idx, output in zip(ready, outputs):
+                    results[idx] = self._probability(output) if score else output
+                yield from zip(chunk, results)
+
+    def prepare_prompts(self, input_articles: List[dict], on_error: Callable[[Exception], Any] = error_message
+                        ) -> Tuple[List[Optional[str]], list]:
+        """
+        Validates, enriches and formats articles, enriching them all at once (see
+        ``utils.enrich_and_format``). Enriched articles are updated in place.
+
+        Returns:
+            The prompts, with None for articles that could not be prepared, and the results
+            list with ``on_error(exception)`` already filled in for those articles.
+        """
+        return enrich_and_format(input_articles, self.metadata, on_error, format=self._format, metrics=self.metrics)
+
+    def _probability(self, margin: Optional[float]) -> Optional[float]:
+        if margin is None:
+            return None
+        return torch.sigmoid(torch.tensor(self.score_scale * margin + self.score_bias)).item()
+
+    def _score_margins(self, input_articles: List[dict], batch_size: int) -> List[Optional[float]]:
+        prompts, results = self.prepare_prompts(input_articles, lambda e: None)
+        pending = [idx for idx, prompt in enumerate(prompts) if prompt is not None]
+        margins = self._prompt_margins([prompts[idx] for idx in pending], batch_size)
+        for idx, margin in zip(pending, margins):
+            results[idx] = margin
+        return results
+
+    def _prompt_margins(self, prompts: List[str], batch_size: int) -> List[Optional[float]]:
+        return self._cached(prompts, 'margin', {},
+                            lambda misses: self._run_batches(misses, batch_size, self._score_batch, lambda e: None))
+
+    def _label_token_ids(self):
+        if self._label_ids is None:
+            # The label may be written with or without a leading space; count both spellings
+            first_token = lambda word: self.tokenizer(word, add_special_tokens=False)["input_ids"][0]
+            yes_ids = sorted({first_token(word) for word in ("Yes", " Yes")})
+            no_ids = sorted({first_token(word) for word in ("No", " No")})
+            self._label_ids = (yes_ids, no_ids)
+        return self._label_ids
+
+    def _score_batch(self, batch_ids: List[List[int]]) -> List[float]:
+        """
+        Returns the log-odds of "Yes" over "No" for the next token of each prompt.
+        """
+        input_ids, attention_mask, prefix_len, prefix_cache = self._prepare_inputs(batch_ids)
+        # Positions skip the padding, as they do during generation
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        with torch.no_grad(), self.metrics.timer("stage_seconds", stage="scoring"):
+            # Only the last position is needed, so skip the language-model head elsewhere
+            hidden_states = self.model.get_decoder()(
+                input_ids=input_ids[:, prefix_len:],
+                attention_mask=attention_mask,
+                position_ids=position_ids[:, prefix_len:],
+                past_key_values=prefix_cache,
+                use_cache=prefix_cache is not None,
+            ).last_hidden_state
+            logits = self.model.get_output_embeddings()(hidden_states[:, -1, :]).float()
+        yes_ids, no_ids = self._label_token_ids()
+        self.metrics.inc("prompt_tokens_total", sum(len(ids) for ids in batch_ids))
+        margins = torch.logsumexp(logits[:, yes_ids], dim=-1) - torch.logsumexp(logits[:, no_ids], dim=-1)
+        return margins.tolist()
+
+    def _cached(self, prompts: List[str], kind: str, params: dict, compute) -> list:
+        """
+        Returns the results of ``prompts``, taking those it can from ``result_cache`` and
+        computing the rest with ``compute(missing_prompts)``. Failed results are not stored.
+
+        Args:
+            kind (str): What the results are ("answer", "margin"), part of the key.
+            params (dict): The generation parameters, part of the key.
+        """
+        if self.result_cache is None:
+            return compute(prompts)
+        keys = [self._result_key(prompt, kind, params) for prompt in prompts]
+        results = [self.result_cache.get(key) for key in keys]
+        missing = [idx for idx, result in enumerate(results) if result is None]
+        if missing:
+            for idx, result in zip(missing, compute([prompts[idx] for idx in missing])):
+                results[idx] = result
+            self.result_cache.warm((keys[idx], results[idx]) for idx in missing if _cacheable(results[idx]))
+        return results
+
+    def _result_key(self, prompt: str, kind: str, params: dict) -> Optional[str]:
+        if self.result_cache is None:
+            return None
+        return PredictionCache.key(prompt, dict(params, kind=kind), self.model_id)
+
+    def _store_streamed(self, key: Optional[str], event: dict):
+        if key is not None and event['type'] == 'done' and _cacheable(event['answer']):
+            self.result_cache.put(key, event['answer'])
+
+    def _observe_streamed(self, decoder: StreamDecoder):
+        if not self.metrics.enabled or decoder.generation_start is None:
+            return
+        end = time.perf_counter()
+        first_token = decoder.first_token_time or end
+        self.metrics.inc("prompt_tokens_total", len(decoder.prompt_ids))
+        self.metrics.inc("generated_tokens_total", len(decoder.ids))
+        self.metrics.observe("stage_seconds", first_token - decoder.generation_start, stage="prefill")
+        self.metrics.observe("stage_seconds", end - first_token, stage="decode")
+
+    def _run_batches(self, prompts: List[str], batch_size: int, run, on_error) -> list:
+        """
+        Tokenizes prompts, sorts them by token length and calls ``run`` on each batch of
+        token IDs, so that each batch is padded only up to its own longest prompt.
+
+        Returns:
+            The results of ``run`` in prompt order, with ``on_error(exception)`` for prompts
+            that failed to tokenize or whose batch failed.
+        """
+        results = [None] * len(prompts)
+        encoded = []
+        for idx, prompt in enumerate(prompts):
+            try:
+                encoded.append((idx, self._encode(prompt)))
+            except Exception as e:
+                traceback.print_exc()
+                logger.error(f"Failed to tokenize prompt {idx}: {e}")
+                results[idx] = on_error(e)
+
+        encoded.sort(key=lambda item: len(item[1]))
+        for start in range(0, len(encoded), batch_size):
+            batch = encoded[start:start + batch_size]
+            try:
+                outputs = run([ids for _, ids in batch])
+            except Exception as e:
+                traceback.print_exc()
+                logger.error(f"Batch failed: {e}")
+                outputs = [on_error(e)] * len(batch)
+            for (idx, _), output in zip(batch, outputs):
+                results[idx] = output
+        return results
+
+    def _build_prompt(self, input_article: dict) -> str:
+        with self.metrics.timer("stage_seconds", stage="enrichment"):
+            input_article = self.metadata.get_external_knowledge(input_article)
+        return self._format(input_article)
+
+    def _format(self, input_article: dict) -> str:
+        with self.metrics.timer("stage_seconds", stage="formatting"):
+            prompt = format_prompt(input_article, examples=[], k_shot=0)
+        logger.info(f"Generated Prompt: {prompt}")
+        return prompt
+
+    def _encode(self, prompt: str) -> List[int]:
+        messages = [
+        {"from": "human", "value": prompt},
+        ]
+        with self.metrics.timer("stage_seconds", stage="tokenization"):
+            text = self.tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True,
+            )
+            return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def _pad_token_id(self) -> int:
+        if self.tokenizer.pad_token_id is not None:
+            return self.tokenizer.pad_token_id
+        return self.tokenizer.eos_token_id
+
+    def _build_prefix_cache(self):
+        """
+        Runs the part of the chat-formatted prompt that precedes the article once and keeps
+        its ``past_key_values``.
+        """
+        text = self.tokenizer.apply_chat_template(
+            [{"from": "human", "value": format_prompt(PLACEHOLDER_ARTICLE)}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        prefix_text = text[:text.index(ARTICLE_MARKER) + len(ARTICLE_MARKER)]
+        self._prefix_ids = self.tokenizer(prefix_text, add_special_tokens=False)["input_ids"]
+        with torch.no_grad():
+            outputs = self.model(input_ids=torch.tensor([self._prefix_ids], device=self.model.device), use_cache=True)
+        self._prefix_cache = outputs.past_key_values
+
+    def _cached_prefix_len(self, batch_ids: List[List[int]]) -> int:
+        if self._prefix_cache is None:
+            return 0
+        prefix_len = len(self._prefix_ids)
+        # A prompt whose tokenization merges across the boundary cannot reuse the cache
+        if all(len(ids) > prefix_len and ids[:prefix_len] == self._prefix_ids for ids in batch_ids):
+            return prefix_len
+        return 0
+
+    def _prepare_inputs(self, batch_ids: List[List[int]], use_prefix_cache: bool = True):
+        """
+        Pads a batch of token IDs into model inputs, reusing the cached prefix when possible.
+
+        Returns:
+            ``(input_ids, attention_mask, prefix_len, prefix_cache)``, where the first
+            ``prefix_len`` positions are covered by ``prefix_cache`` (None when unused).
+        """
+        pad_token_id = self._pad_token_id()
+        prefix_len = self._cached_prefix_len(batch_ids) if use_prefix_cache else 0
+        suffix_len = max(len(ids) for ids in batch_ids) - prefix_len
+        width = prefix_len + suffix_len
+        input_ids = torch.full((len(batch_ids), width), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch_ids), width), dtype=torch.long)
+        for row, ids in enumerate(batch_ids):
+            # Padding goes between the shared prefix and the suffix, so every prompt's last
+            # token sits next to its generated tokens; without a cached prefix this is plain
+            # left padding
+            input_ids[row, :prefix_len] = torch.tensor(ids[:prefix_len], dtype=torch.long)
+            attention_mask[row, :prefix_len] = 1
+            input_ids[row, width - len(ids) + prefix_len:] = torch.tensor(ids[prefix_len:], dtype=torch.long)
+            attention_mask[row, width - len(ids) + prefix_len:] = 1
+
+        prefix_cache = None
+        if prefix_len:
+            # The model extends the cache in place, so every call works on its own copy
+            prefix_cache = copy.deepcopy(self._prefix_cache)
+            if len(batch_ids) > 1:
+                prefix_cache.batch_repeat_interleave(len(batch_ids))
+        self.prefill_tokens += len(batch_ids) * suffix_len
+        return input_ids.to(self.model.device), attention_mask.to(self.model.device), prefix_len, prefix_cache
+
+    def _generate_streaming(self, ids: List[int], push, stop: threading.Event, decoder: StreamDecoder,
+                            max_new_token: int, temperature: float, kwargs: dict):
+        """
+        Generates for one prompt, calling ``push`` with each list of new token IDs, then with
+        None at the end, or with the exception that stopped generation.
+        """
+        try:
+            input_ids, attention_mask, _, prefix_cache = self._prepare_inputs([ids], use_prefix_cache=self.draft_model is None)
+            kwargs = dict(kwargs)
+            if prefix_cache is not None:
+                kwargs['past_key_values'] = prefix_cache
+            if self.draft_model is not None:
+                kwargs['assistant_model'] = self.draft_model
+            stopping_criteria = StoppingCriteriaList(kwargs.pop('stopping_criteria', None) or [])
+            stopping_criteria.append(StopOnEvent(stop))
+            decoder.generation_start = time.perf_counter()
+            self.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                max_new_tokens=max_new_token, use_cache=True, temperature=temperature,
+                                pad_token_id=self._pad_token_id(), streamer=TokenStreamer(push),
+                                stopping_criteria=stopping_criteria, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Streaming generation failed: {e}")
+            push(e)
+
+    def _generate_batch(self, batch_ids: List[List[int]], max_new_token=256, temperature=0.1, **kwargs) -> List[str]:
+        if self.draft_model is not None:
+            if len(batch_ids) > 1:
+                # Assisted generation verifies the draft of a single sequence
+                return [answer for ids in batch_ids
+                        for answer in self._generate_batch([ids], max_new_token=max_new_token,
+                                                           temperature=temperature, **kwargs)]
+            # Assisted generation does not give the same tokens on top of a pre-filled cache, so
+            # the prompt is prefilled in full
+            kwargs['assistant_model'] = self.draft_model
+        pad_token_id = self._pad_token_id()
+        input_ids, attention_mask, _, prefix_cache = self._prepare_inputs(batch_ids, use_prefix_cache=self.draft_model is None)
+        width = input_ids.shape[1]
+        if prefix_cache is not None:
+            kwargs['past_key_values'] = prefix_cache
 
+        first_token = []
+        if self.metrics.enabled and 'streamer' not in kwargs:
+            # Time the first token to tell prefill from decoding
+            kwargs['streamer'] = TokenStreamer(lambda tokens: first_token or first_token.append(time.perf_counter()))
+        start = time.perf_counter()
+        outputs = self.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                      max_new_tokens=max_new_token, use_cache=True, temperature=temperature,
+                                      pad_token_id=pad_token_id, **kwargs)
+        end = time.perf_counter()
+        answers = []
+        with self.metrics.timer("stage_seconds", stage="extraction"):
+            n_generated = 0
+            for row, ids in enumerate(batch_ids):
+                # Drop the prompt padding and the padding appended after an early end of sequence
+                generated_tokens = outputs[row, width:].tolist()
+                if pad_token_id in generated_tokens:
+                    generated_tokens = generated_tokens[:generated_tokens.index(pad_token_id)]
+                n_generated += len(generated_tokens)
+                generated_text = self.tokenizer.decode(ids + generated_tokens)
+                answers.append(extract_answer(generated_text))
+        if self.metrics.enabled:
+            self.metrics.inc("prompt_tokens_total", sum(len(ids) for ids in batch_ids))
+            self.metrics.inc("generated_tokens_total", n_generated)
+            first = first_token[0] if first_token else end
+            self.metrics.observe("stage_seconds", first - start, stage="prefill")
+            self.metrics.observe("stage_seconds", end - first, stage="decode")
+        return answers
 
 
 if __name__ == '__main__':
+    # Print INFO messages, the generated prompts among them, to the console
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
     input_article = {
         'Title':"The prevalence of diabetes in children and adolescents is increasing worldwide",
         'Abstract':"The prevalence of diabetes in children and adolescents is increasing worldwide, with profound implications on the long-term health of individuals, societies, and nations. The diagnosis and management of diabetes in youth presents several unique challenges. Although type 1 diabetes is more common among children and adolescents, the incidence of type 2 diabetes in youth is also on the rise, particularly among certain ethnic groups. In addition, less common types of diabetes such as monogenic diabetes syndromes and diabetes secondary to pancreatopathy (in some parts of the world) need to be accurately identified to initiate the most appropriate treatment. A detailed patient history and physical examination usually provides clues to the diagnosis. However, specific laboratory and imaging tests are needed to confirm the diagnosis. The management of diabetes in children and adolescents is challenging in some cases due to age-specific issues and the more aggressive nature of the disease. Nonetheless, a patient-centered approach focusing on comprehensive risk factor reduction with the involvement of all concerned stakeholders (the patient, parents, peers and teachers) could help in ensuring the best possible level of diabetes control and prevention or delay of long-term complications. ",
@@ -0,0 +1,348 @@
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from .reference_index import ReferenceIndex, term_idf
+
+ISSN_PATTERN = re.compile(r"^\s*(\d{4})-?(\d{3}[\dxX])\s*$")
+NLM_ID_PATTERN = re.compile(r"^\s*(\d{5,9}[A-Za-z]?)\s*$")
+INSTITUTION_ABBREVIATIONS = {
+    "univ": "university", "universitat": "university", "universite": "university", "universidad": "university",
+    "hosp": "hospital", "inst": "institute", "natl": "national", "ctr": "center", "centre": "center",
+    "dept": "department", "coll": "college", "sch": "school", "acad": "academy",
+}
+DEPARTMENT_PATTERN = re.compile(r"^(department|division|section|unit|laboratory|lab|faculty|program|programme) ")
+SUBUNIT_PATTERN = re.compile(r"^(school|college|graduate school|center|institute) (of|for|in) ")
+LETTERS = re.compile(r"[^\W\d_]")
+# Words, or word stems, of a normalized institution name in the languages of the bundled list
+INSTITUTION_WORDS = re.compile(
+    r"\b(univers|uniwersytet|hospi|hopital|ospedal|klinik|clinic|infirmary|institu|instytut|istituto|college|"
+    r"colegio|collegium|school|escola|escuela|faculdade|facultad|center|centro|zentrum|academ|foundation|"
+    r"fondazione|fundacion|fundacao|laborator|council|agency|administration|ministry|ministerio|society|"
+    r"museum|museu|observator|polytechn|politecnic|corporation|company|inc\b|ltd\b|limited|gmbh|trust|health|"
+    r"mc\b|umc\b)")
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a journal or institution name for matching: case, accents and punctuation
+    are dropped, "&" reads as "and" and a leading "The" is ignored.
+    """
+    tokens = re.findall(r"\w+", _fold(name).replace("&", " and "))
+    if tokens and tokens[0] == "the":
+        tokens = tokens[1:]
+    return " ".join(tokens)
+
+
+def normalize_issn(issn: str) -> Optional[str]:
+    match = ISSN_PATTERN.match(issn or "")
+    return f"{match.group(1)}-{match.group(2).upper()}" if match else None
+
+
+def word_tokens(text: str) -> Set[str]:
+    return set(text.split())
+
+
+def char_ngrams(text: str, n: int = 3) -> Set[str]:
+    """
+    Returns the character n-grams of a normalized name, padded so that word boundaries
+    count as features.
+    """
+    text = f" {text} "
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class FuzzyIndex:
+    """
+    An inverted index from character n-grams to names, for approximate matching.
+
+    A query only reads the posting lists of its ``max_probe`` rarest features to collect
+    candidates, keeps the ``max_candidates`` that share the most of them, and scores those
+    by IDF-weighted overlap with the query. Common features ("uni", "ity") are never
+    scanned, so a lookup costs about the same on a hundred thousand names as on a hundred.
+
+    The score is the Tversky index ``shared / (shared + alpha * query_only + beta *
+    name_only)`` over feature weights; the default ``alpha = beta = 0.5`` is the Dice
+    coefficient. A small ``alpha`` tolerates extra words in the query, such as the
+    department and address around an institution name.
+
+    The index is built in memory from ``names``, or read from the search section of a
+    reference index (see ``from_reference_index``), which costs nothing up front and is
+    shared through the page cache like the rest of the index.
+
+    Args:
+        names (List[str]): Normalized names; a match is reported by its position in the list.
+        features (Callable[[str], Set[str]]): Extracts the matching features of a name.
+        max_postings (int): Once this many postings have been read, rarer features are
+            enough and the remaining, more common ones are not probed; None to always probe
+            ``max_probe`` features.
+    """
+    def __init__(self, names: Optional[List[str]], features: Callable[[str], Set[str]] = char_ngrams,
+                 max_probe: int = 8, max_candidates: int = 32, max_postings: Optional[int] = None,
+                 alpha: float = 0.5, beta: float = 0.5):
+        self.features = features
+        self.max_probe = max_probe
+        self.max_candidates = max_candidates
+        self.max_postings = max_postings
+        self.alpha = alpha
+        self.beta = beta
+        self._index = None
+        if names is None:
+            return
+        self._names = names
+        self.size = len(names)
+        postings: Dict[str, array] = defaultdict(lambda: array("I"))
+        for name_id, name in enumerate(names):
+            for feature in features(name):
+                postings[feature].append(name_id)
+        self._postings = dict(postings)
+        self._weights = array("d", (sum(term_idf(self.size, len(self._postings[feature])) for feature in features(name))
+                                    for name in names))
+
+    @classmethod
+    def from_reference_index(cls, index: ReferenceIndex, **kwargs) -> "FuzzyIndex":
+        """
+        Searches the search texts of a reference index built with a ``search_text`` and
+        with ``search_terms`` extracting the same features as ``features``.
+        """
+        fuzzy = cls(None, **kwargs)
+        fuzzy._index = index
+        fuzzy.size = len(index)
+        return fuzzy
+
+    def name(self, name_id: int) -> str:
+        return self._names[name_id] if self._index is None else self._index.search_text(name_id)
+
+    def _frequency(self, feature: str) -> int:
+        if self._index is None:
+            postings = self._postings.get(feature)
+            return len(postings) if postings else 0
+        return self._index.document_frequency(feature)
+
+    def _feature_postings(self, feature: str) -> array:
+        return self._postings[feature] if self._index is None else self._index.postings(feature)
+
+    def _name_weight(self, name_id: int) -> float:
+        return self._weights[name_id] if self._index is None else self._index.search_weight(name_id)
+
+    def search(self, name: str, limit: int = 1) -> List[Tuple[int, float]]:
+        """
+        Returns up to ``limit`` ``(name id, score)`` pairs, best first, scores in [0, 1].
+        """
+        query = self.features(name)
+        frequencies = {feature: self._frequency(feature) for feature in query}
+        known = sorted((f for f in query if frequencies[f]), key=frequencies.get)
+        if not known:
+            return []
+        hits = Counter()
+        read = 0
+        for feature in known[:self.max_probe]:
+            if read and self.max_postings is not None and read + frequencies[feature] > self.max_postings:
+                break
+            hits.update(self._feature_postings(feature))
+            read += frequencies[feature]
+        # A feature no name has weighs as much as one only a single name has
+        idf = {feature: term_idf(self.size, frequencies[feature] or 1) for feature in query}
+        query_weight = sum(idf.values())
+        results = []
+        for name_id, _ in hits.most_common(self.max_candidates):
+            shared = sum(idf[feature] for feature in query & self.features(self.name(name_id)))
+            name_weight = self._name_weight(name_id)
+            denominator = shared + self.alpha * (query_weight - shared) + self.beta * (name_weight - shared)
+            results.append((name_id, shared / denominator if denominator else 0.0))
+        results.sort(key=lambda item: -item[1])
+        return results[:limit]
+
+
+def normalize_institution(name: str) -> str:
+    """
+    ``normalize_name`` with common abbreviations and spellings in institution names
+    ("Univ.", "Dept", "Centre") written out the same way.
+    """
+    return " ".join(INSTITUTION_ABBREVIATIONS.get(token, token) for token in normalize_name(name).split())
+
+
+def affiliation_segments(affiliation: str) -> List[str]:
+    """
+    Splits an affiliation into the strings an institution name may be: every
+    comma-separated segment, and every two adjacent segments joined, since names such as
+    "University of California, Berkeley" contain a comma themselves.
+    """
+    segments = [segment.strip() for segment in affiliation.split(",")]
+    segments = [segment for segment in segments if segment]
+    return segments + [f"{first} {second}" for first, second in zip(segments, segments[1:])]
+
+
+def journal_index_keys(record: dict) -> List[str]:
+    """
+    Returns the keys a journal is indexed under: its casefolded title as matched before,
+    its normalized title and MEDLINE abbreviation, its print and electronic ISSNs, and
+    its NLM ID. Identifier keys are prefixed so they cannot collide with titles.
+    """
+    if 'journal' not in record:
+        return []
+    keys = [record['journal'].casefold(), f"name:{normalize_name(record['journal'])}"]
+    if record.get('journal_abbr'):
+        keys.append(f"name:{normalize_name(record['journal_abbr'])}")
+    for field in ('issn', 'eissn'):
+        issn = normalize_issn(record.get(field) or "")
+        if issn:
+            keys.append(f"issn:{issn}")
+    if record.get('nlm_id'):
+        keys.append(f"nlm:{str(record['nlm_id']).strip().upper()}")
+    return keys
+
+
+def journal_search_text(record: dict) -> str:
+    """
+    The text a journal is approximately matched by: its normalized title. Pass it, with
+    ``char_ngrams`` as the ``search_terms``, to ``build_reference_index``.
+    """
+    return normalize_name(record.get('journal', ""))
+
+
+def institution_search_text(record: dict) -> str:
+    """
+    The text an institution is approximately matched by: its normalized name. Pass it,
+    with ``word_tokens`` as the ``search_terms``, to ``build_reference_index``.
+    """
+    return normalize_institution(record.get('name', ""))
+
+
+class JournalIndex:
+    """
+    Resolves a journal given by title, MEDLINE abbreviation, ISSN, eISSN or NLM ID.
+
+    Identifiers and normalized titles are hash lookups in the underlying
+    ``ReferenceIndex`` (built with ``journal_index_keys``). Only when they all miss does
+    ``resolve`` fall back to approximate title matching, through the search section of
+    the index if it was built with ``journal_search_text``, or else through an n-gram
+    index built in memory on first use.
+
+    Args:
+        index (ReferenceIndex): The journal index.
+        fuzzy_threshold (float): The minimum score of an approximate match, or None to
+            disable approximate matching.
+    """
+    def __init__(self, index: ReferenceIndex, fuzzy_threshold: Optional[float] = 0.85):
+        self.index = index
+        self.fuzzy_threshold = fuzzy_threshold
+        self._fuzzy = None
+        self._lock = threading.Lock()
+
+    def resolve(self, journal: str) -> Optional[dict]:
+        """
+        Returns the record of the journal, or None if nothing matches.
+        """
+        record = self.index.record(journal.casefold())
+        if record is not None:
+            return record
+        issn = normalize_issn(journal)
+        if issn:
+            record = self.index.record(f"issn:{issn}")
+            if record is not None:
+                return record
+        if NLM_ID_PATTERN.match(journal):
+            record = self.index.record(f"nlm:{journal.strip().upper()}")
+            if record is not None:
+                return record
+        name = normalize_name(journal)
+        record = self.index.record(f"name:{name}")
+        if record is not None or self.fuzzy_threshold is None or not name:
+            return record
+        return self.fuzzy_match(name)
+
+    def fuzzy_match(self, name: str) -> Optional[dict]:
+        matches = self._fuzzy_index().search(normalize_name(name))
+        if matches and matches[0][1] >= self.fuzzy_threshold:
+            return self.index.record_at(matches[0][0])
+        return None
+
+    def _fuzzy_index(self) -> FuzzyIndex:
+        if self._fuzzy is None:
+            with self._lock:
+                if self._fuzzy is None:
+                    if self.index.searchable:
+                        self._fuzzy = FuzzyIndex.from_reference_index(self.index)
+                    else:
+                        self._fuzzy = FuzzyIndex([journal_search_text(record) for record in self.index.records()])
+        return self._fuzzy
+
+
+class InstitutionMatcher:
+    """
+    Approximately matches affiliation strings to the institutions of a reference index.
+
+    Every segment of the affiliation (see ``affiliation_segments``) is looked up in a word
+    inverted index over the institution names (the search section of the index if it was
+    built with ``institution_search_text``, or else one built in memory on first use), and
+    the best match over all segments is
+    returned. Words a segment has beyond the institution name (a street, a city) barely
+    lower the score, while a name word missing from the segment lowers it in full, so
+    "University of Madras" does not match "Madras Diabetes Research Foundation".
+
+    The reference list also holds departments ("Department of Medicine") and schools
+    ("School of Nursing") as institutions; segments naming a department are skipped, and
+    those naming a school, college or institute only match when no other segment does.
+    It also maps bare places ("Chennai", "Paris", "UK") to institutions, which would match
+    wherever the place appears in an affiliation; so a match's name must contain an
+    institution word (see ``INSTITUTION_WORDS``).
+
+    Args:
+        index (ReferenceIndex): The institution index; records carry a ``name``.
+        threshold (float): The minimum score of a match.
+        max_postings (int): The posting budget of a segment lookup (see ``FuzzyIndex``).
+    """
+    def __init__(self, index: ReferenceIndex, threshold: float = 0.9, max_postings: int = 512):
+        self.index = index
+        self.threshold = threshold
+        self.max_postings = max_postings
+        self._fuzzy = None
+        self._lock = threading.Lock()
+
+    def match(self, affiliation: str) -> Optional[Tuple[dict, float]]:
+        """
+        Returns the record of the best matching institution and its score in [0, 1], or
+        None if no segment scores at least ``threshold``.
+        """
+        fuzzy = self._fuzzy_index()
+        best, best_key = None, None
+        for name in dict.fromkeys(map(normalize_institution, affiliation_segments(affiliation))):
+            if not LETTERS.search(name) or DEPARTMENT_PATTERN.match(name):
+                continue
+            match = match_name = None
+            for candidate in fuzzy.search(name, limit=fuzzy.max_candidates):
+                if candidate[1] < self.threshold:
+                    break
+                if INSTITUTION_WORDS.search(fuzzy.name(candidate[0])):
+                    match, match_name = candidate, fuzzy.name(candidate[0])
+                    break
+            if match is None:
+                continue
+            # Ties go to the longer, more specific name
+            key = (not SUBUNIT_PATTERN.match(name), match[1], len(match_name.split()))
+            if best_key is None or key > best_key:
+                best, best_key = match, key
+        if best is None:
+            return None
+        return self.index.record_at(best[0]), best[1]
+
+    def _fuzzy_index(self) -> FuzzyIndex:
+        if self._fuzzy is None:
+            with self._lock:
+                if self._fuzzy is None:
+                    options = dict(features=word_tokens, max_candidates=16, max_postings=self.max_postings,
+                                   alpha=0.1, beta=1.0)
+                    if self.index.searchable:
+                        self._fuzzy = FuzzyIndex.from_reference_index(self.index, **options)
+                    else:
+                        names = [institution_search_text(record) for record in self.index.records()]
+                        self._fuzzy = FuzzyIndex(names, **options)
+        return self._fuzzy
@@ -0,0 +1,290 @@
+import bisect
+import contextlib
+import threading
+import time
+import traceback
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# What each metric measures, for the Prometheus HELP lines
+DESCRIPTIONS = {
+    'stage_seconds': "Time spent in each stage of the pipeline.",
+    'http_requests_total': "Semantic Scholar and OpenAlex requests by endpoint and outcome.",
+    'http_request_seconds': "Semantic Scholar and OpenAlex request latency by endpoint.",
+    'reference_lookups_total': "Institution and journal lookups in the bundled indexes by outcome.",
+    'degraded_articles_total': "Articles enriched without Semantic Scholar, by reason.",
+    'prefetched_institutions_total': "Institution counts fetched from OpenAlex ahead of enrichment.",
+    'refreshed_records_total': "Cached records refreshed before they expired, by kind and outcome.",
+    'prompt_tokens_total': "Prompt tokens run through the model.",
+    'generated_tokens_total': "Tokens generated by the model.",
+    'server_requests_total': "Server requests by endpoint and HTTP status.",
+    'server_request_seconds': "Server request latency by endpoint.",
+    'server_queue_seconds': "Time prompts waited for a model batch, by endpoint.",
+    'server_queue_depth': "Prompts waiting for a model batch, by endpoint.",
+    'server_in_flight': "Server requests being handled.",
+    'server_batches_total': "Model batches run by the server, by endpoint.",
+    'server_batch_items_total': "Prompts in the model batches run by the server, by endpoint.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+Hook = Callable[[str, float, Dict[str, str]], None]
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, as Prometheus histograms do.
+    """
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class Metrics:
+    """
+    A thread-safe registry of counters, gauges and latency histograms, each identified by
+    a name and a set of labels.
+
+    ``PubGuard``, ``Metadata`` and ``SemanticScholarClient`` report to the ``Metrics`` they
+    are given; see ``PubGuard.stats`` for what they record. Every update is also passed to
+    the hooks added with ``add_hook``, e.g. to forward it to StatsD or OpenTelemetry.
+
+    Args:
+        buckets (Tuple[float, ...]): The upper bounds of the histogram buckets.
+    """
+    enabled = True
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters: Dict[str, Dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+        self.hooks: List[Hook] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook):
+        """
+        Calls ``hook(name, value, labels)`` on every counter increment, gauge update and
+        observation.
+        """
+        self.hooks.append(hook)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.counters[name][key] += value
+        self._call_hooks(name, value, labels)
+
+    def set(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.gauges[name][key] = value
+        self._call_hooks(name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms[name].get(key)
+            if histogram is None:
+                histogram = self.histograms[name][key] = Histogram(self.buckets)
+            histogram.observe(value)
+        self._call_hooks(name, value, labels)
+
+    def timer(self, name: str, **labels):
+        """
+        Returns a context manager observing the seconds spent in it.
+        """
+        return _Timer(self, name, labels)
+
+    def _call_hooks(self, name: str, value: float, labels: dict):
+        for hook in self.hooks:
+            try:
+                hook(name, value, labels)
+            except Exception:
+                traceback.print_exc()
+
+    def counter(self, name: str, **labels) -> float:
+        """
+        Returns the value of a counter, summed over the labels not given.
+        """
+        with self._lock:
+            return sum(value for key, value in self.counters.get(name, {}).items() if set(labels.items()) <= set(key))
+
+    def histogram_totals(self, name: str, **labels) -> Tuple[int, float]:
+        """
+        Returns the number and the sum of the observations of a histogram, summed over the
+        labels not given.
+        """
+        count, total = 0, 0.0
+        with self._lock:
+            for key, histogram in self.histograms.get(name, {}).items():
+                if set(labels.items()) <= set(key):
+                    count += histogram.count
+                    total += histogram.sum
+        return count, total
+
+    def snapshot(self) -> dict:
+        """
+        Returns every counter, gauge and histogram, keyed by name and then by labels written as
+        ``key=value,key=value`` (an empty string for no labels).
+        """
+        with self._lock:
+            counters = {name: {_label_text(key): value for key, value in series.items()}
+                        for name, series in self.counters.items()}
+            gauges = {name: {_label_text(key): value for key, value in series.items()}
+                      for name, series in self.gauges.items()}
+            histograms = {
+                name: {_label_text(key): {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                    'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+                } for key, histogram in series.items()}
+                for name, series in self.histograms.items()
+            }
+        return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def to_prometheus(self, namespace: str = "pub_guard") -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                full_name = f"{namespace}_{name}"
+                lines += _header(full_name, name, "counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_prometheus_labels(key)} {_number(value)}")
+            for name, series in sorted(self.gauges.items()):
+                full_name = f"{namespace}_{name}"
+                lines += _header(full_name, name, "gauge")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_prometheus_labels(key)} {_number(value)}")
+            for name, series in sorted(self.histograms.items()):
+                full_name = f"{namespace}_{name}"
+                lines += _header(full_name, name, "histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else _number(bound)
+                        lines.append(f"{full_name}_bucket{_prometheus_labels(key + (('le', le),))} {count}")
+                    lines.append(f"{full_name}_sum{_prometheus_labels(key)} {_number(histogram.sum)}")
+                    lines.append(f"{full_name}_count{_prometheus_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, namespace: str = "pub_guard"):
+        """
+        Writes ``to_prometheus`` to a file, e.g. for the node exporter's textfile collector.
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.to_prometheus(namespace))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+class NullMetrics(Metrics):
+    """
+    Metrics that records nothing, used when none are configured; every call returns at once.
+    """
+    enabled = False
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        pass
+
+    def set(self, name: str, value: float, **labels):
+        pass
+
+    def observe(self, name: str, value: float, **labels):
+        pass
+
+    def timer(self, name: str, **labels):
+        return _NULL_TIMER
+
+
+_NULL_TIMER = contextlib.nullcontext()
+NULL_METRICS = NullMetrics()
+
+
+def serve_prometheus(metrics: Metrics, port: int, host: str = "127.0.0.1", namespace: str = "pub_guard"):
+    """
+    Serves ``metrics`` at ``/metrics`` for Prometheus to scrape, from a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: The server; call ``shutdown()`` to stop it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = metrics.to_prometheus(namespace).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _label_text(key: Labels) -> str:
+    return ",".join(f"{name}={value}" for name, value in key)
+
+
+def _prometheus_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in key) + "}"
+
+
+def _header(full_name: str, name: str, kind: str) -> List[str]:
+    lines = [f"# HELP {full_name} {DESCRIPTIONS[name]}"] if name in DESCRIPTIONS else []
+    return lines + [f"# TYPE {full_name} {kind}"]
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
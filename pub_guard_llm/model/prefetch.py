@@ -0,0 +1,213 @@
+"""
+Fetching external metadata ahead of enrichment, and keeping it fresh, in a background thread.
+"""
+import logging
+import queue
+import threading
+import time
+import traceback
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+from .cache import MetadataCache
+from .openalex import OpenAlexClient
+from .semantic_scholar import SemanticScholarClient, get_default_client, run_sync
+from .utils import Metadata
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Prefetcher:
+    """
+    Resolves the author, institution and journal metadata of upcoming articles in a
+    background thread, so that by the time ``PubGuard.predict`` enriches them, every lookup
+    is local.
+
+    - Authors are fetched through the Semantic Scholar batch endpoints of ``metadata``'s
+      client, which stores them in its cache.
+    - Institutions are matched in the bundled affiliation index as enrichment matches them.
+      With ``openalex``, their current works and citation counts are stored in the same
+      cache, and enrichment prefers them to the bundled snapshot.
+    - Journals are resolved in the bundled journal index. JCR quartiles are licensed data
+      with no open API, so they are not refreshed.
+
+    Every ``refresh_interval`` seconds, the thread also re-fetches cached authors and
+    institutions that expire within ``refresh_window`` seconds. Only records that changed
+    are rewritten; the others just get a new expiry.
+
+    Both need a cache such as ``SQLiteMetadataCache`` on the client. Without one, fetched
+    metadata would be thrown away, so the constructor raises ``ValueError``.
+
+    Args:
+        metadata (Metadata): The enrichment to prepare for.
+        openalex (OpenAlexClient): Where institution counts come from; None keeps the
+            bundled ones.
+        chunk_size (int): The number of articles resolved together.
+        queue_size (int): The number of chunks waiting before ``submit`` blocks.
+        refresh_interval (float): Seconds between refresh passes; None never refreshes.
+        refresh_window (float): How long before they expire entries are refreshed, in seconds.
+        refresh_limit (int): The most authors, and the most institutions, refreshed per pass.
+    """
+    def __init__(self, metadata: Metadata, openalex: Optional[OpenAlexClient] = None, chunk_size: int = 256,
+                 queue_size: int = 64, refresh_interval: Optional[float] = None, refresh_window: float = 0.0,
+                 refresh_limit: int = 10000):
+        self.metadata = metadata
+        if type(self.client.cache) is MetadataCache:
+            raise ValueError("Prefetching needs a persistent metadata cache, such as SQLiteMetadataCache")
+        self.openalex = openalex
+        self.chunk_size = chunk_size
+        self.refresh_interval = refresh_interval
+        self.refresh_window = refresh_window
+        self.refresh_limit = refresh_limit
+        self.counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+    @property
+    def client(self) -> SemanticScholarClient:
+        return self.metadata.client or get_default_client()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the thread once the articles already submitted are prefetched.
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, input_articles: Iterable[dict]):
+        """
+        Queues articles to be prefetched. Articles are copied, so they can be enriched in
+        place while they wait.
+        """
+        articles = iter(input_articles)
+        while chunk := [dict(article) for article in islice(articles, self.chunk_size)]:
+            self._queue.put(chunk)
+
+    def join(self):
+        """
+        Waits until every article submitted so far has been prefetched.
+        """
+        self._queue.join()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the articles prefetched and the records fetched and refreshed, by kind.
+        """
+        with self._counts_lock:
+            return dict(self.counts)
+
+    def prefetch(self, input_articles: List[dict]) -> Dict[str, int]:
+        """
+        Resolves the metadata of articles now, in the calling thread.
+
+        Returns:
+            Dict[str, int]: The articles, the institutions fetched from OpenAlex and the
+            journals missing from the bundled index.
+        """
+        articles = [article for article in input_articles if article.get('Title')]
+        run_sync(self.client.aget_author_info_bulk(articles))
+
+        institutions = {}
+        journals_missing = 0
+        for article in articles:
+            for affiliation in article.get('Institutions') or []:
+                record, _ = self.metadata.institution_record(affiliation)
+                if record is not None:
+                    institutions[record['name'].casefold()] = record
+            if article.get('Journal') and self.metadata.journal_index.resolve(article['Journal']) is None:
+                journals_missing += 1
+        fetched = {}
+        if self.openalex is not None:
+            cache = self.client.cache
+            fetched = self._fetch_institutions({key: record for key, record in institutions.items()
+                                                if cache.get_institution(key) is None})
+            cache.put_institutions(fetched)
+            self.metadata.metrics.inc("prefetched_institutions_total", len(fetched))
+        return self._count({'articles': len(articles), 'institutions_fetched': len(fetched),
+                            'journals_missing': journals_missing})
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        Re-fetches the cached authors and institutions that expire within
+        ``refresh_window`` seconds, now, in the calling thread.
+
+        Returns:
+            Dict[str, int]: The records that changed, did not change or were not found, by kind.
+        """
+        cache = self.client.cache
+        author_ids = cache.expiring("author", self.refresh_window, self.refresh_limit)
+        authors = run_sync(self.client.afetch_authors(author_ids)) if author_ids else {}
+        counts = self._record_refresh("author", author_ids, authors, cache.refresh("author", authors))
+
+        if self.openalex is not None:
+            names = cache.expiring("institution", self.refresh_window, self.refresh_limit)
+            records = {name: self.metadata.cache_institution_info.record(name) for name in names}
+            institutions = self._fetch_institutions({name: record for name, record in records.items() if record})
+            counts.update(self._record_refresh("institution", names, institutions,
+                                               cache.refresh("institution", institutions)))
+        return self._count(counts)
+
+    def _fetch_institutions(self, records: Dict[str, dict]) -> Dict[str, dict]:
+        """
+        Returns bundled institution ``records`` with their counts updated from OpenAlex,
+        for those it knows.
+        """
+        by_ror = {record['ror']: key for key, record in records.items() if record.get('ror')}
+        if not by_ror:
+            return {}
+        counts = run_sync(self.openalex.aget_institutions_by_ror(list(by_ror)))
+        return {by_ror[ror]: dict(records[by_ror[ror]], **counts[ror]) for ror in by_ror if ror in counts}
+
+    def _record_refresh(self, kind: str, keys: List[str], fetched: Dict[str, dict], changed: int) -> Dict[str, int]:
+        outcomes = {'changed': changed, 'unchanged': len(fetched) - changed, 'not_found': len(keys) - len(fetched)}
+        for outcome, n in outcomes.items():
+            self.metadata.metrics.inc("refreshed_records_total", n, kind=kind, result=outcome)
+        return {f"{kind}s_{outcome}": n for outcome, n in outcomes.items()}
+
+    def _count(self, counts: Dict[str, int]) -> Dict[str, int]:
+        with self._counts_lock:
+            self.counts.update(counts)
+        return counts
+
+    def _run(self):
+        next_refresh = time.monotonic() + self.refresh_interval if self.refresh_interval else None
+        while True:
+            timeout = max(0.0, next_refresh - time.monotonic()) if next_refresh is not None else None
+            try:
+                chunk = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                chunk = None
+            if chunk is _STOP:
+                self._queue.task_done()
+                return
+            if chunk is not None:
+                try:
+                    self.prefetch(chunk)
+                except Exception as e:
+                    traceback.print_exc()
+                    logger.error(f"Prefetching {len(chunk)} articles failed: {e}")
+                finally:
+                    self._queue.task_done()
+            if next_refresh is not None and time.monotonic() >= next_refresh:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    traceback.print_exc()
+                    logger.error(f"Refreshing cached metadata failed: {e}")
+                next_refresh = time.monotonic() + self.refresh_interval
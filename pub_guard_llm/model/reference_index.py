@@ -0,0 +1,398 @@
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import traceback
+from array import array
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+MAGIC = b"PGREFIDX"
+VERSION = 3
+# magic, version, schema, n_slots, n_records, slots_pos, offsets_pos, search_pos (0 without a search section)
+HEADER = struct.Struct("<8sI16sQQQQQ")
+# key hash, key position, key length, record id; a zero key position marks an empty slot
+SLOT = struct.Struct("<QQII")
+# record position, record length
+OFFSET = struct.Struct("<QI")
+# n_term_slots, term_slots_pos, texts_pos, weights_pos
+SEARCH_HEADER = struct.Struct("<QQQQ")
+# term hash, term position, term length, document frequency, postings position
+TERM_SLOT = struct.Struct("<QQIIQ")
+WEIGHT = struct.Struct("<d")
+LOAD_FACTOR = 0.7
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def term_idf(n_records: int, document_frequency: int) -> float:
+    """
+    The inverse document frequency of a term found in ``document_frequency`` of
+    ``n_records`` records.
+    """
+    return math.log(1 + max(1, n_records) / document_frequency)
+
+
+def _table_size(n_keys: int) -> int:
+    n_slots = 1
+    while n_slots * LOAD_FACTOR < max(1, n_keys):
+        n_slots *= 2
+    return n_slots
+
+
+def _uint32_bytes(values: Iterable[int]) -> bytes:
+    values = array("I", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _search_section(texts: List[str], search_terms: Callable[[str], Iterable[str]], start: int) -> bytes:
+    """
+    Lays out the search section of an index whose records have the search ``texts``, for
+    the file position ``start``: a hash table from terms to their postings (the ascending
+    IDs of the records having the term), the texts, and the IDF weight of each record's
+    terms.
+    """
+    postings: Dict[bytes, List[int]] = defaultdict(list)
+    record_terms = []
+    for record_id, text in enumerate(texts):
+        terms = {term.encode("utf-8") for term in search_terms(text)}
+        for term in terms:
+            postings[term].append(record_id)
+        record_terms.append(terms)
+    idf = {term: term_idf(len(texts), len(ids)) for term, ids in postings.items()}
+
+    n_slots = _table_size(len(postings))
+    slots_pos = start + SEARCH_HEADER.size
+    texts_pos = slots_pos + n_slots * TERM_SLOT.size
+    weights_pos = texts_pos + len(texts) * OFFSET.size
+    data_pos = weights_pos + len(texts) * WEIGHT.size
+
+    slots = bytearray(n_slots * TERM_SLOT.size)
+    data = bytearray()
+    for term, ids in postings.items():
+        term_hash = _hash(term)
+        slot = term_hash & (n_slots - 1)
+        while TERM_SLOT.unpack_from(slots, slot * TERM_SLOT.size)[1]:
+            slot = (slot + 1) & (n_slots - 1)
+        term_pos = data_pos + len(data)
+        data += term
+        TERM_SLOT.pack_into(slots, slot * TERM_SLOT.size, term_hash, term_pos, len(term), len(ids), data_pos + len(data))
+        data += _uint32_bytes(ids)
+    offsets = bytearray()
+    for text in texts:
+        blob = text.encode("utf-8")
+        offsets += OFFSET.pack(data_pos + len(data), len(blob))
+        data += blob
+    weights = b"".join(WEIGHT.pack(sum(idf[term] for term in terms)) for terms in record_terms)
+    return SEARCH_HEADER.pack(n_slots, slots_pos, texts_pos, weights_pos) + slots + offsets + weights + data
+
+
+def build_reference_index(records: Iterable[dict], keys: Callable[[dict], Iterable[str]], out_path: str,
+                          schema: str = "", search_text: Optional[Callable[[dict], str]] = None,
+                          search_terms: Callable[[str], Iterable[str]] = str.split) -> int:
+    """
+    Compiles records into a memory-mappable index file.
+
+    The file holds an open-addressing hash table over the keys, a table of record offsets
+    and the records themselves as compact JSON, so a lookup touches a handful of pages
+    and needs no parsing at open time. When several records share a key, the last one
+    wins, as it would in a dict. The file is written to a temporary name and moved into
+    place, so concurrent builders and readers never see a partial index.
+
+    With ``search_text``, the file also holds an inverted index over the terms of each
+    record's search text, for approximate matching (see ``matching.FuzzyIndex``) without
+    reading the records.
+
+    Args:
+        records (Iterable[dict]): The records to index; every field is kept.
+        keys (Callable[[dict], Iterable[str]]): Returns the lookup keys of a record.
+        out_path (str): The index file to write.
+        schema (str): A short tag naming the key scheme, so that an index built with
+            different ``keys`` can be told apart.
+        search_text (Callable[[dict], str]): Returns the text a record is searched by.
+        search_terms (Callable[[str], Iterable[str]]): Splits a search text into terms.
+
+    Returns:
+        int: The number of records written.
+    """
+    all_records: List[dict] = []
+    key_to_record: Dict[bytes, int] = {}
+    for record in records:
+        record_keys = [key.encode("utf-8") for key in keys(record)]
+        if not record_keys:
+            continue
+        for key in record_keys:
+            key_to_record[key] = len(all_records)
+        all_records.append(record)
+
+    # Drop records whose keys were all taken over by later records
+    record_ids = {record_id: new_id for new_id, record_id in enumerate(sorted(set(key_to_record.values())))}
+    key_to_record = {key: record_ids[record_id] for key, record_id in key_to_record.items()}
+    record_blobs = [json.dumps(all_records[record_id], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                    for record_id in record_ids]
+
+    n_slots = _table_size(len(key_to_record))
+    slots_pos = HEADER.size
+    offsets_pos = slots_pos + n_slots * SLOT.size
+    keys_pos = offsets_pos + len(record_blobs) * OFFSET.size
+
+    slots = bytearray(n_slots * SLOT.size)
+    key_blob = bytearray()
+    for key, record_id in key_to_record.items():
+        key_hash = _hash(key)
+        slot = key_hash & (n_slots - 1)
+        while SLOT.unpack_from(slots, slot * SLOT.size)[1]:
+            slot = (slot + 1) & (n_slots - 1)
+        SLOT.pack_into(slots, slot * SLOT.size, key_hash, keys_pos + len(key_blob), len(key), record_id)
+        key_blob += key
+
+    records_pos = keys_pos + len(key_blob)
+    offsets = bytearray()
+    position = records_pos
+    for blob in record_blobs:
+        offsets += OFFSET.pack(position, len(blob))
+        position += len(blob)
+    search = b""
+    if search_text is not None:
+        texts = [search_text(all_records[record_id]) for record_id in record_ids]
+        search = _search_section(texts, search_terms, position)
+
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_path.parent, prefix=out_path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, schema.encode("ascii"), n_slots, len(record_blobs),
+                                   slots_pos, offsets_pos, position if search else 0))
+            file.write(slots)
+            file.write(offsets)
+            file.write(key_blob)
+            for blob in record_blobs:
+                file.write(blob)
+            file.write(search)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(record_blobs)
+
+
+class ReferenceIndex:
+    """
+    A read-only view of an index built by ``build_reference_index``.
+
+    The file is memory-mapped on first use, which costs the same whatever its size, and
+    is shared through the page cache by every process that opens it. ``get`` behaves like
+    ``dict.get`` on the value ``value`` derives from a record, so an index can stand in for
+    the dicts returned by ``load_cache_journal`` and ``load_cache_affiliation``; ``record``
+    returns every field of the record. An index built with a ``search_text`` also answers
+    ``postings`` and ``search_text`` queries.
+
+    Args:
+        path (str): The index file.
+        value (Callable[[dict], Any]): Derives the value returned by ``get`` from a record.
+    """
+    def __init__(self, path: str, value: Optional[Callable[[dict], Any]] = None):
+        self.path = str(path)
+        self.value = value or (lambda record: record)
+        self._mm = None
+        self._lock = threading.Lock()
+
+    def _map(self) -> mmap.mmap:
+        if self._mm is None:
+            with self._lock:
+                if self._mm is None:
+                    with open(self.path, "rb") as file:
+                        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                    magic, version = struct.unpack_from("<8sI", mm, 0)
+                    if magic != MAGIC or version != VERSION:
+                        raise ValueError(f"Not a reference index: {self.path}")
+                    _, _, schema, n_slots, n_records, slots_pos, offsets_pos, search_pos = HEADER.unpack_from(mm, 0)
+                    self._schema = schema.rstrip(b"\0").decode("ascii")
+                    self._n_slots, self._n_records = n_slots, n_records
+                    self._slots_pos, self._offsets_pos = slots_pos, offsets_pos
+                    self._search = SEARCH_HEADER.unpack_from(mm, search_pos) if search_pos else None
+                    self._mm = mm
+        return self._mm
+
+    @property
+    def schema(self) -> str:
+        self._map()
+        return self._schema
+
+    def record_at(self, record_id: int) -> dict:
+        """
+        Returns the record with ordinal ``record_id``, in ``0 .. len(index) - 1``.
+        """
+        mm = self._map()
+        position, length = OFFSET.unpack_from(mm, self._offsets_pos + record_id * OFFSET.size)
+        return json.loads(mm[position:position + length])
+
+    def record(self, key: str) -> Optional[dict]:
+        """
+        Returns the full record stored under ``key``, or None.
+        """
+        mm = self._map()
+        key = key.encode("utf-8")
+        key_hash = _hash(key)
+        mask = self._n_slots - 1
+        slot = key_hash & mask
+        while True:
+            slot_hash, key_pos, key_len, record_id = SLOT.unpack_from(mm, self._slots_pos + slot * SLOT.size)
+            if not key_pos:
+                return None
+            if slot_hash == key_hash and mm[key_pos:key_pos + key_len] == key:
+                return self.record_at(record_id)
+            slot = (slot + 1) & mask
+
+    def get(self, key: str, default=None):
+        record = self.record(key)
+        return default if record is None else self.value(record)
+
+    def __contains__(self, key: str) -> bool:
+        return self.record(key) is not None
+
+    def __len__(self) -> int:
+        self._map()
+        return self._n_records
+
+    @property
+    def searchable(self) -> bool:
+        """
+        Whether the index was built with a ``search_text``.
+        """
+        self._map()
+        return self._search is not None
+
+    def _term_slot(self, term: str) -> Optional[tuple]:
+        mm = self._map()
+        n_slots, slots_pos, _, _ = self._search
+        term = term.encode("utf-8")
+        term_hash = _hash(term)
+        slot = term_hash & (n_slots - 1)
+        while True:
+            slot_hash, term_pos, term_len, frequency, postings_pos = TERM_SLOT.unpack_from(
+                mm, slots_pos + slot * TERM_SLOT.size)
+            if not term_pos:
+                return None
+            if slot_hash == term_hash and mm[term_pos:term_pos + term_len] == term:
+                return frequency, postings_pos
+            slot = (slot + 1) & (n_slots - 1)
+
+    def document_frequency(self, term: str) -> int:
+        """
+        Returns the number of records whose search text has ``term``.
+        """
+        found = self._term_slot(term)
+        return found[0] if found else 0
+
+    def postings(self, term: str) -> array:
+        """
+        Returns the ascending IDs of the records whose search text has ``term``.
+        """
+        ids = array("I")
+        found = self._term_slot(term)
+        if found:
+            frequency, position = found
+            ids.frombytes(self._mm[position:position + frequency * ids.itemsize])
+            if sys.byteorder == "big":
+                ids.byteswap()
+        return ids
+
+    def search_text(self, record_id: int) -> str:
+        mm = self._map()
+        position, length = OFFSET.unpack_from(mm, self._search[2] + record_id * OFFSET.size)
+        return mm[position:position + length].decode("utf-8")
+
+    def search_weight(self, record_id: int) -> float:
+        """
+        Returns the summed ``term_idf`` of the terms of a record's search text.
+        """
+        return WEIGHT.unpack_from(self._map(), self._search[3] + record_id * WEIGHT.size)[0]
+
+    def records(self) -> Iterator[dict]:
+        """
+        Iterates over all records in build order.
+        """
+        for record_id in range(len(self)):
+            yield self.record_at(record_id)
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+
+
+def read_jsonl_records(file_name: str) -> Iterator[dict]:
+    """
+    Yields the objects of a JSON Lines file, unwrapping lines that hold a one-element list
+    as ``journal_cache.jsonl`` does, and skipping lines that cannot be parsed.
+    """
+    with open(file_name, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                obj = json.loads(line)
+                if isinstance(obj, list):
+                    obj = obj[0]
+                yield obj
+            except (json.JSONDecodeError, IndexError) as e:
+                logger.error(f"Error processing line: {line.strip()} - {e}")
+                traceback.print_exc()
+
+
+def default_index_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "pub_guard_llm"
+
+
+def ensure_index(source: str, keys: Callable[[dict], Iterable[str]], schema: str = "",
+                 index_path: Optional[str] = None, **search) -> Path:
+    """
+    Returns an up-to-date index for a JSON Lines file, building it first if it is missing,
+    older than the file or built with another key ``schema``. ``search`` holds the
+    ``search_text`` and ``search_terms`` of ``build_reference_index``.
+
+    The index lives next to the source as ``<name>.idx``; if that directory is read-only
+    (an installed package, say) it goes to ``$XDG_CACHE_HOME/pub_guard_llm`` instead.
+    """
+    source = Path(source)
+    candidates = [Path(index_path)] if index_path else [
+        source.with_suffix(".idx"), default_index_dir() / source.with_suffix(".idx").name]
+    source_mtime = source.stat().st_mtime
+    for candidate in candidates:
+        try:
+            if candidate.stat().st_mtime < source_mtime:
+                continue
+            index = ReferenceIndex(candidate)
+            current = index.schema == schema
+            index.close()
+            if current:
+                return candidate
+        except (OSError, ValueError):
+            continue
+    for candidate in candidates:
+        try:
+            build_reference_index(read_jsonl_records(str(source)), keys, str(candidate), schema=schema, **search)
+            return candidate
+        except OSError as e:
+            logger.warning(f"Cannot write index {candidate}: {e}")
+    raise OSError(f"No writable location for the index of {source}")
+
+if __name__ == '__main__':
+    from .utils import build_reference_indexes
+    for path in build_reference_indexes():
+        print(f"Built {path}")
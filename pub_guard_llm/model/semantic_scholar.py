@@ -0,0 +1,631 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Sequence
+import requests
+from requests.adapters import HTTPAdapter
+from .cache import MetadataCache
+from .metrics import NULL_METRICS, Metrics
+
+API_URL = "http://api.semanticscholar.org/graph/v1"
+PAPER_FIELDS = "title,authors.name,authors.authorId,authors.affiliations"
+AUTHOR_FIELDS = "name,affiliations,paperCount,citationCount,hIndex"
+
+# Article keys holding an identifier /paper/batch understands, with the prefix it expects
+PAPER_ID_KEYS = {'PMID': 'PMID', 'DOI': 'DOI'}
+PAPER_BATCH_SIZE = 500
+AUTHOR_BATCH_SIZE = 1000
+
+# Semantic Scholar grants keyed clients 1 request per second. Unauthenticated clients
+# share one pool with everyone else, so no rate is guaranteed to avoid 429s; the keyed
+# quota is a guess at a rate that does not drain it.
+KEYED_RATE_LIMIT = 1.0
+UNAUTHENTICATED_RATE_LIMIT = 1.0
+
+# Statuses that say the API itself is in trouble, as opposed to e.g. an unknown author (404)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter shared by threads and event loops alike.
+
+    Callers reserve a token under a thread lock and then sleep until it becomes
+    available, so the bucket never binds to a particular event loop.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes one token and returns how many seconds the caller must wait before using it.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """
+        Waits for a token.
+
+        Raises:
+            asyncio.TimeoutError: At once, without taking a token, if it would not be
+                available within ``timeout`` seconds.
+        """
+        delay = self.reserve()
+        if timeout is not None and delay > timeout:
+            with self._lock:
+                self._tokens += 1
+            raise asyncio.TimeoutError()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Stops requests to an API that keeps failing, so callers fail fast instead of each
+    waiting out a timeout.
+
+    The breaker opens after ``failure_threshold`` consecutive failures, or at once on an
+    HTTP 429, and rejects every request for ``cooldown`` seconds (or for as long as the
+    429's ``Retry-After`` asks). After that one trial request is let through: its success
+    closes the breaker, its failure opens it again.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the breaker.
+        cooldown (float): Seconds the breaker stays open.
+    """
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self._open_until = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Whether requests are currently being turned away.
+        """
+        with self._lock:
+            return self._open_until is not None and (time.monotonic() < self._open_until or self._trial_running)
+
+    def allow(self) -> bool:
+        """
+        Returns whether a request may go out now; every request allowed must be followed
+        by ``record_success``, ``record_failure`` or, if its outcome is unknown, ``release``.
+        """
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if time.monotonic() >= self._open_until and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._open_until = None
+            self._trial_running = False
+
+    def release(self):
+        """
+        Forgets a request whose outcome is unknown, letting the next one be the trial.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self, rate_limited: bool = False, retry_after: Optional[float] = None):
+        with self._lock:
+            self.failures += 1
+            if rate_limited or self._trial_running or self.failures >= self.failure_threshold:
+                if self._open_until is None or self._trial_running:
+                    self.opened += 1
+                cooldown = max(self.cooldown, retry_after or 0.0)
+                self._open_until = time.monotonic() + cooldown
+                self._trial_running = False
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns how often the breaker opened and how many requests it turned away.
+        """
+        return {'opened': self.opened, 'rejected': self.rejected}
+
+
+class Deadline:
+    """
+    The time an article's lookups may take. It starts when the lookup of the article
+    starts, and waiting for a rate limiter token counts against it: a request whose token
+    would come too late is given up at once.
+
+    Args:
+        timeout (float): Seconds from the start of the lookup on.
+    """
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires = None
+
+    def start(self):
+        if self.expires is None:
+            self.expires = time.monotonic() + self.timeout
+
+    def remaining(self) -> float:
+        if self.expires is None:
+            return self.timeout
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+
+class APIClient:
+    """
+    The plumbing shared by the API clients: one keep-alive ``requests.Session``, a
+    dedicated thread pool whose size is the concurrency limit, a rate limiter, a circuit
+    breaker and request metrics. Neither the pool nor the limiter depends on a specific
+    event loop.
+
+    Args:
+        base_url (str): The API root, overridable to point at a stand-in server.
+        max_concurrency (int): The maximum number of requests in flight.
+        rate_limit (float): Requests per second.
+        burst (float): The token bucket capacity; defaults to ``rate_limit``.
+        timeout (float): The per-request timeout in seconds.
+        breaker (CircuitBreaker): Turns requests away while the API is failing or rate limiting.
+        metrics (Metrics): Receives the count and latency of requests per endpoint.
+    """
+    thread_name_prefix = "api-client"
+
+    def __init__(self, base_url: str, max_concurrency: int = 8, rate_limit: float = 10.0,
+                 burst: Optional[float] = None, timeout: float = 10, breaker: Optional[CircuitBreaker] = None,
+                 metrics: Optional[Metrics] = None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate_limit, burst)
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or NULL_METRICS
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=self.thread_name_prefix)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def _request(self, method: str, path: str, **kwargs):
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx and 5xx)
+        return response.json()
+
+    async def _call(self, method: str, path: str, deadlines: Sequence[Deadline] = (), **kwargs):
+        """
+        Performs one rate-limited request on the client's thread pool.
+
+        Args:
+            deadlines (Sequence[Deadline]): The deadlines of the articles waiting for the
+                request; it is given up once all of them have passed.
+
+        Returns:
+            The decoded JSON body, or None if the request or the decoding failed, or if the
+            circuit breaker is open.
+
+        Raises:
+            asyncio.TimeoutError: If ``deadlines`` passed before the response arrived.
+        """
+        endpoint = _endpoint(path)
+        if deadlines and all(deadline.expired for deadline in deadlines):
+            raise asyncio.TimeoutError()
+        if not self.breaker.allow():
+            self.metrics.inc("http_requests_total", endpoint=endpoint, status="rejected")
+            return None
+        loop = asyncio.get_running_loop()
+        start = None
+        status = "cancelled"
+        for deadline in deadlines:
+            deadline.start()
+        # Everything after allow() is in the try, so that a cancelled trial request is released
+        try:
+            await self.limiter.acquire(max((deadline.remaining() for deadline in deadlines), default=None))
+            timeout = max((deadline.remaining() for deadline in deadlines), default=None)
+            if timeout is not None and timeout <= 0:
+                raise asyncio.TimeoutError()
+            start = time.perf_counter()
+            result = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, partial(self._request, method, path, **kwargs)), timeout)
+        except requests.exceptions.JSONDecodeError:
+            # Before RequestException, which it subclasses in recent versions of requests
+            status = "invalid_json"
+            logger.error("Failed to decode JSON response.")
+            self.breaker.record_failure()
+        except requests.exceptions.Timeout:
+            status = "timeout"
+            logger.error("The request timed out.")
+            self.breaker.record_failure()
+        except requests.exceptions.HTTPError as e:
+            status = str(e.response.status_code) if e.response is not None else "error"
+            logger.error(f"An error occurred while making the request: {e}")
+            self._record_http_error(e.response)
+        except requests.exceptions.RequestException as e:
+            status = "error"
+            logger.error(f"An error occurred while making the request: {e}")
+            self.breaker.record_failure()
+        except asyncio.TimeoutError:
+            status = "deadline"
+            self.breaker.release()
+            raise
+        except BaseException:
+            # Cancelled, e.g. by the caller's own timeout; the outcome is unknown
+            self.breaker.release()
+            raise
+        else:
+            status = "200"
+            self.breaker.record_success()
+            return result
+        finally:
+            # Requests given up before they were sent are not counted
+            if self.metrics.enabled and start is not None:
+                self.metrics.inc("http_requests_total", endpoint=endpoint, status=status)
+                self.metrics.observe("http_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+        return None
+
+    def _record_http_error(self, response):
+        if response is None or response.status_code not in RETRYABLE_STATUSES:
+            # The API answered, it just did not like the request
+            self.breaker.record_success()
+            return
+        retry_after = None
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            pass
+        self.breaker.record_failure(rate_limited=response.status_code == 429, retry_after=retry_after)
+
+
+class SemanticScholarClient(APIClient):
+    """
+    Asynchronous Semantic Scholar client.
+
+    Requests go through one keep-alive ``requests.Session`` and run on a dedicated thread
+    pool whose size is the concurrency limit. Every request first takes a token from the
+    rate limiter. Neither depends on a specific event loop, so one client can serve the
+    synchronous wrappers in ``utils`` and any number of asyncio callers at once.
+
+    Args:
+        base_url (str): The Graph API root, overridable to point at a stand-in server.
+        api_key (str): Optional Semantic Scholar API key, sent as ``x-api-key``.
+        max_concurrency (int): The maximum number of requests in flight.
+        rate_limit (float): Requests per second; defaults to the quota for ``api_key``.
+        burst (float): The token bucket capacity; defaults to ``rate_limit``.
+        timeout (float): The per-request timeout in seconds.
+        cache (MetadataCache): Consulted before, and filled after, every title or author lookup.
+        breaker (CircuitBreaker): Turns requests away while the API is failing or rate limiting.
+        metrics (Metrics): Receives the count and latency of requests per endpoint.
+    """
+    thread_name_prefix = "semantic-scholar"
+
+    def __init__(self, base_url: str = API_URL, api_key: Optional[str] = None, max_concurrency: int = 8,
+                 rate_limit: Optional[float] = None, burst: Optional[float] = None, timeout: float = 10,
+                 cache: Optional[MetadataCache] = None, breaker: Optional[CircuitBreaker] = None,
+                 metrics: Optional[Metrics] = None):
+        if rate_limit is None:
+            rate_limit = KEYED_RATE_LIMIT if api_key else UNAUTHENTICATED_RATE_LIMIT
+        super().__init__(base_url, max_concurrency=max_concurrency, rate_limit=rate_limit, burst=burst,
+                         timeout=timeout, breaker=breaker, metrics=metrics)
+        self.cache = cache or MetadataCache()
+        if api_key:
+            self.session.headers["x-api-key"] = api_key
+
+    async def aget_author_id_from_title(self, paper_title: str, deadline: Optional[Deadline] = None) -> List[str]:
+        """
+        Fetches author IDs of the best match for a paper title.
+
+        Args:
+            paper_title (str): The title of the paper.
+            deadline (Deadline): Gives up, raising ``asyncio.TimeoutError``, once it passes.
+
+        Returns:
+            List[str]: A list of author IDs if found, else an empty list.
+        """
+        author_ids = self.cache.get_author_ids(paper_title)
+        if author_ids is not None:
+            return author_ids
+        return await self._search_author_ids(paper_title, _deadlines(deadline))
+
+    async def _search_author_ids(self, paper_title: str, deadlines: Sequence[Deadline] = ()) -> List[str]:
+        query_params = {
+            "query": paper_title,
+            "fields": PAPER_FIELDS,
+            "limit": 1
+        }
+        response_data = await self._call("GET", "/paper/search", deadlines, params=query_params)
+        if response_data is None:
+            return []
+        papers = response_data.get("data") or []
+        if not papers:
+            logger.info(f"No papers found with the title {paper_title!r}.")
+            self.cache.put_author_ids(paper_title, [])
+            return []
+        author_ids = parse_author_ids(papers[0])  # Assuming the first result is the most relevant
+        self.cache.put_author_ids(paper_title, author_ids)
+        return author_ids
+
+    async def aget_author_info_by_id(self, author_id: str, deadline: Optional[Deadline] = None) -> Optional[Dict[str, str]]:
+        """
+        Fetches author details based on author ID.
+
+        Args:
+            author_id (str): The ID of the author.
+            deadline (Deadline): Gives up, raising ``asyncio.TimeoutError``, once it passes.
+
+        Returns:
+            Optional[Dict[str, str]]: A dictionary containing author details if found, else None.
+        """
+        author_info = self.cache.get_author(author_id)
+        if author_info is not None:
+            return author_info
+        query_params = {
+            "fields": AUTHOR_FIELDS
+        }
+        author_data = await self._call("GET", f"/author/{author_id}", _deadlines(deadline), params=query_params)
+        if author_data is None:
+            return None
+        author_info = parse_author_info(author_id, author_data)
+        self.cache.put_authors({author_id: author_info})
+        return author_info
+
+    async def aget_author_info_by_title(self, title: str, deadline: Optional[Deadline] = None) -> List[Dict]:
+        """
+        Fetches author details for a paper title, looking up all authors concurrently.
+
+        Args:
+            title (str): The title of the paper.
+            deadline (Deadline): Gives up, raising ``asyncio.TimeoutError``, once it passes.
+
+        Returns:
+            List[Dict]: A list of dictionaries containing author details, in author order.
+        """
+        if deadline is not None:
+            deadline.start()
+        author_ids = await self.aget_author_id_from_title(title, deadline)
+        if not author_ids:
+            return []
+        author_infos = await asyncio.gather(*[self.aget_author_info_by_id(aid, deadline) for aid in author_ids])
+        return [author_info for author_info in author_infos if author_info]
+
+    async def aget_papers_by_ids(self, paper_ids: List[str], deadlines: Sequence[Deadline] = ()) -> Dict[str, List[str]]:
+        """
+        Resolves paper identifiers such as ``PMID:123`` or ``DOI:10.1/x`` to author IDs
+        with ``POST /paper/batch``, 500 papers per request.
+
+        Args:
+            deadlines (Sequence[Deadline]): The deadlines of the articles being resolved;
+                past all of them, ``asyncio.TimeoutError`` is raised.
+
+        Returns:
+            Dict[str, List[str]]: Author IDs for every identifier that was found.
+        """
+        paper_ids = list(dict.fromkeys(paper_ids))
+        chunks = [paper_ids[i:i + PAPER_BATCH_SIZE] for i in range(0, len(paper_ids), PAPER_BATCH_SIZE)]
+        responses = await asyncio.gather(*[
+            self._call("POST", "/paper/batch", deadlines, params={"fields": PAPER_FIELDS}, json={"ids": chunk})
+            for chunk in chunks
+        ])
+        found = {}
+        for chunk, papers in zip(chunks, responses):
+            for paper_id, paper in zip(chunk, papers or []):
+                if paper:
+                    found[paper_id] = parse_author_ids(paper)
+        return found
+
+    async def aget_authors_by_ids(self, author_ids: List[str],
+                                  deadlines: Sequence[Deadline] = ()) -> Dict[str, Dict[str, str]]:
+        """
+        Fetches author details with ``POST /author/batch``, 1000 authors per request.
+
+        Args:
+            deadlines (Sequence[Deadline]): As for ``aget_papers_by_ids``.
+
+        Returns:
+            Dict[str, Dict[str, str]]: Author details for every ID that was found.
+        """
+        found = {}
+        missing = []
+        for author_id in dict.fromkeys(author_ids):
+            author_info = self.cache.get_author(author_id)
+            if author_info is not None:
+                found[author_id] = author_info
+            else:
+                missing.append(author_id)
+        fetched = await self.afetch_authors(missing, deadlines)
+        self.cache.put_authors(fetched)
+        found.update(fetched)
+        return found
+
+    async def afetch_authors(self, author_ids: List[str],
+                             deadlines: Sequence[Deadline] = ()) -> Dict[str, Dict[str, str]]:
+        """
+        Fetches author details with ``POST /author/batch`` without consulting or filling the
+        cache, e.g. to refresh entries about to expire.
+
+        Args:
+            deadlines (Sequence[Deadline]): As for ``aget_papers_by_ids``.
+
+        Returns:
+            Dict[str, Dict[str, str]]: Author details for every ID that was found.
+        """
+        author_ids = list(dict.fromkeys(author_ids))
+        chunks = [author_ids[i:i + AUTHOR_BATCH_SIZE] for i in range(0, len(author_ids), AUTHOR_BATCH_SIZE)]
+        responses = await asyncio.gather(*[
+            self._call("POST", "/author/batch", deadlines, params={"fields": AUTHOR_FIELDS}, json={"ids": chunk})
+            for chunk in chunks
+        ])
+        fetched = {}
+        for chunk, authors in zip(chunks, responses):
+            for author_id, author_data in zip(chunk, authors or []):
+                if author_data:
+                    fetched[author_id] = parse_author_info(author_id, author_data)
+        return fetched
+
+    async def aget_author_info_bulk(self, articles: List[dict],
+                                    deadlines: Optional[List[Deadline]] = None) -> List[Optional[List[Dict]]]:
+        """
+        Fetches author details for many articles with as few requests as possible.
+
+        Articles carrying a ``PMID`` or ``DOI`` are resolved together through ``/paper/batch``;
+        the others, and identifiers Semantic Scholar does not know, need one ``/paper/search``
+        per distinct title. The author IDs of all articles are then de-duplicated and fetched
+        through ``/author/batch``, so a prolific author is downloaded once per call. Titles and
+        authors already in the client's cache are not requested at all.
+
+        Each article has its own deadline, started here: a title search is given up when
+        the deadline of its article passes, a batch request when the deadlines of all the
+        articles waiting for it have.
+
+        Args:
+            articles (List[dict]): Articles with a ``Title`` and optionally a ``PMID`` or ``DOI``.
+            deadlines (List[Deadline]): One deadline per article, or None to wait as long
+                as the client does.
+
+        Returns:
+            List[Optional[List[Dict]]]: The author details of each article, in article order,
+            or None for an article whose deadline passed before they were all known.
+        """
+        deadlines_by_title = {}
+        for article, deadline in zip(articles, deadlines or []):
+            deadline.start()
+            deadlines_by_title.setdefault(article['Title'], []).append(deadline)
+
+        def deadlines_of(titles) -> List[Deadline]:
+            return [deadline for title in dict.fromkeys(titles) for deadline in deadlines_by_title.get(title, [])]
+
+        ids_by_title = {}
+        for article in articles:
+            author_ids = self.cache.get_author_ids(article['Title'])
+            if author_ids is not None:
+                ids_by_title[article['Title']] = author_ids
+        unresolved = [article for article in articles if article['Title'] not in ids_by_title]
+
+        paper_ids = [paper_id_of(article) for article in unresolved]
+        try:
+            ids_by_paper = await self.aget_papers_by_ids(
+                [pid for pid in paper_ids if pid],
+                deadlines_of(article['Title'] for article, pid in zip(unresolved, paper_ids) if pid))
+        except asyncio.TimeoutError:
+            # Their title searches give up at once as well
+            ids_by_paper = {}
+        for article, pid in zip(unresolved, paper_ids):
+            if pid in ids_by_paper:
+                ids_by_title[article['Title']] = ids_by_paper[pid]
+                self.cache.put_author_ids(article['Title'], ids_by_paper[pid])
+
+        async def search(title: str) -> Optional[List[str]]:
+            try:
+                return await self._search_author_ids(title, deadlines_of([title]))
+            except asyncio.TimeoutError:
+                return None
+
+        titles = list(dict.fromkeys(article['Title'] for article in unresolved if article['Title'] not in ids_by_title))
+        searched = await asyncio.gather(*[search(title) for title in titles])
+        ids_by_title.update((title, author_ids) for title, author_ids in zip(titles, searched) if author_ids is not None)
+
+        author_ids = [aid for title, ids in ids_by_title.items() for aid in ids]
+        try:
+            authors = await self.aget_authors_by_ids(author_ids, deadlines_of(ids_by_title))
+        except asyncio.TimeoutError:
+            authors = {aid: self.cache.get_author(aid) for aid in author_ids}
+            # Only articles whose authors were all cached, before or by the requests that did finish, keep them
+            ids_by_title = {title: ids for title, ids in ids_by_title.items() if all(authors[aid] for aid in ids)}
+        return [[authors[aid] for aid in ids_by_title[article['Title']] if authors.get(aid)]
+                if article['Title'] in ids_by_title else None for article in articles]
+
+
+def _deadlines(deadline: Optional[Deadline]) -> Sequence[Deadline]:
+    return (deadline,) if deadline is not None else ()
+
+
+def _endpoint(path: str) -> str:
+    """
+    Names the endpoint of a request path for metrics, e.g. ``/author/{id}``.
+    """
+    if path.startswith("/author/") and path != "/author/batch":
+        return "/author/{id}"
+    return path
+
+
+def paper_id_of(article: dict) -> Optional[str]:
+    """
+    Returns the ``/paper/batch`` identifier of an article, e.g. ``PMID:31234567``, if it has one.
+    """
+    for key, prefix in PAPER_ID_KEYS.items():
+        if article.get(key):
+            return f"{prefix}:{article[key]}"
+    return None
+
+
+def parse_author_ids(paper: dict) -> List[str]:
+    return [author["authorId"] for author in paper.get("authors") or [] if author.get("authorId")]
+
+
+def parse_author_info(author_id: str, author_data: dict) -> Dict[str, str]:
+    return {
+        'aid': author_id,
+        'name': author_data.get('name', 'N/A'),
+        'affiliations': ', '.join(author_data.get('affiliations') or []),
+        'paper_count': str(author_data.get('paperCount', 'N/A')),
+        'citation': str(author_data.get('citationCount', 'N/A')),
+        'h-index': str(author_data.get('hIndex', 'N/A'))
+    }
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> SemanticScholarClient:
+    """
+    Returns the process-wide client used when no client is configured explicitly.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = SemanticScholarClient()
+        return _default_client
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code.
+
+    When called from inside a running event loop, the coroutine runs on a fresh loop in a
+    helper thread instead of failing.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
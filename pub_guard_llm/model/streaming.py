@@ -0,0 +1,141 @@
+import threading
+import time
+from typing import Callable, Iterator, List, Optional
+import torch
+from transformers import StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
+from .utils import extract_answer
+
+LABELS = ("Yes", "No")
+
+
+class TokenStreamer(BaseStreamer):
+    """
+    Hands the token IDs ``generate`` produces to ``on_tokens`` as soon as they are sampled,
+    then None once generation ends. The prompt, which ``generate`` pushes first, is skipped.
+    """
+    def __init__(self, on_tokens: Callable[[Optional[List[int]]], None]):
+        self.on_tokens = on_tokens
+        self._prompt_skipped = False
+
+    def put(self, value):
+        if not self._prompt_skipped:
+            self._prompt_skipped = True
+            return
+        self.on_tokens(value.reshape(-1).tolist())
+
+    def end(self):
+        self.on_tokens(None)
+
+
+class StopOnEvent(StoppingCriteria):
+    """
+    Stops generation once ``event`` is set, e.g. when the reader of a stream goes away.
+    """
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class StreamDecoder:
+    """
+    Turns the tokens of one generation into the events of ``PubGuard.predict_stream``.
+
+    The label is read off the first generated token when it is a "Yes" or "No" token, and
+    otherwise off the first complete word. Text is only emitted up to the last complete
+    character, so multi-byte characters split across tokens are never garbled.
+
+    Args:
+        tokenizer: The tokenizer of the model.
+        prompt_ids (List[int]): The prompt, needed to build the final answer exactly as
+            ``predict`` does.
+        yes_ids (List[int]): The first tokens of "Yes" and " Yes".
+        no_ids (List[int]): The first tokens of "No" and " No".
+        start (float): The ``time.perf_counter()`` at which the request arrived.
+    """
+    def __init__(self, tokenizer, prompt_ids: List[int], yes_ids: List[int], no_ids: List[int], start: float):
+        self.tokenizer = tokenizer
+        self.prompt_ids = prompt_ids
+        self.label_ids = {**{i: "Yes" for i in yes_ids}, **{i: "No" for i in no_ids}}
+        self.start = start
+        self.generation_start = None
+        self.first_token_time = None
+        self.ids: List[int] = []
+        self.emitted = 0
+        self.label_sent = False
+
+    def feed(self, token_ids: List[int]) -> Iterator[dict]:
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.ids.extend(token_ids)
+        text = self.tokenizer.decode(self.ids, skip_special_tokens=True)
+        if not self.label_sent:
+            label = self._label(text, final=False)
+            if label is None:
+                return
+            yield label
+        # A trailing replacement character is the first byte of a character still being generated
+        stable = len(text.rstrip("�"))
+        if stable > self.emitted:
+            yield {'type': 'text', 'text': text[self.emitted:stable]}
+            self.emitted = stable
+
+    def finish(self) -> Iterator[dict]:
+        end = time.perf_counter()
+        text = self.tokenizer.decode(self.ids, skip_special_tokens=True)
+        if not self.label_sent:
+            yield self._label(text, final=True)
+        if len(text) > self.emitted:
+            yield {'type': 'text', 'text': text[self.emitted:]}
+        n_tokens = len(self.ids)
+        decode_time = end - self.first_token_time if self.first_token_time else 0.0
+        yield {
+            'type': 'done',
+            'answer': extract_answer(self.tokenizer.decode(self.prompt_ids + self.ids)),
+            'ttft': (self.first_token_time or end) - self.start,
+            'prefill_time': (self.first_token_time or end) - (self.generation_start or self.start),
+            'tokens': n_tokens,
+            # The decoding rate: the first token's time is prefill, not decoding
+            'tokens_per_sec': (n_tokens - 1) / decode_time if n_tokens > 1 and decode_time > 0 else 0.0,
+            'latency': end - self.start,
+            'cached': False,
+        }
+
+    def _label(self, text: str, final: bool) -> Optional[dict]:
+        """
+        Returns the label event once the label is known, and marks the text it covers as
+        emitted.
+        """
+        stripped = text.lstrip()
+        label = self.label_ids.get(self.ids[0]) if self.ids else None
+        if label is not None and stripped.startswith(label):
+            word = label
+        else:
+            words = stripped.split(maxsplit=1)
+            if not final and (len(words) < 2 and stripped == stripped.rstrip()):
+                # The first word may still grow
+                return None
+            word = words[0].rstrip(".,:;!") if words else ""
+            label = word if word in LABELS else None
+        self.label_sent = True
+        # Without a label, the whole answer goes out as text
+        self.emitted = len(text) - len(stripped) + len(word) if label is not None else 0
+        return {'type': 'label', 'label': label, 'ttft': self.first_token_time - self.start if self.first_token_time else None}
+
+
+def cached_events(answer: str, start: float) -> Iterator[dict]:
+    """
+    Replays an answer from the result cache as the events of ``PubGuard.predict_stream``.
+    """
+    words = answer.split(maxsplit=1)
+    word = words[0].rstrip(".,:;!") if words else ""
+    label = word if word in LABELS else None
+    elapsed = time.perf_counter() - start
+    yield {'type': 'label', 'label': label, 'ttft': elapsed}
+    text = answer[answer.index(word) + len(word):] if label else answer
+    if text:
+        yield {'type': 'text', 'text': text}
+    yield {'type': 'done', 'answer': answer, 'ttft': elapsed, 'prefill_time': 0.0, 'tokens': 0,
+           'tokens_per_sec': 0.0, 'latency': elapsed, 'cached': True}
@@ -1,23 +1,174 @@
+import asyncio
 import json
-from typing import Dict, Optional, List
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, List, Tuple
 import traceback
 import re
-import requests
 from pathlib import Path
+from .cache import MetadataCache
+from .matching import (InstitutionMatcher, JournalIndex, char_ngrams, institution_search_text, journal_index_keys,
+                       journal_search_text, normalize_name, word_tokens)
+from .metrics import NULL_METRICS, Metrics
+from .reference_index import ReferenceIndex, build_reference_index, ensure_index, read_jsonl_records
+from .semantic_scholar import Deadline, SemanticScholarClient, get_default_client, run_sync
 # Get the directory of the current script
 current_dir = Path(__file__).parent
 
+logger = logging.getLogger(__name__)
+
+REQUIRED_KEYS = {'Title', 'Abstract', 'Authors', 'Institutions', 'Journal'}
+
+
+class MissingKeysError(KeyError):
+    """
+    Raised for an article that lacks some of ``REQUIRED_KEYS``.
+    """
+    def __init__(self, missing_keys):
+        super().__init__(f"Missing keys: {missing_keys}")
+        self.missing_keys = missing_keys
+
+
+def error_message(error: Exception) -> str:
+    """
+    Maps an exception raised while predicting to the message returned to the caller.
+    """
+    if isinstance(error, MissingKeysError):
+        return f"Error: Missing keys: {error.missing_keys}"
+    if isinstance(error, ValueError):
+        return "Error: Invalid input provided."
+    if isinstance(error, RuntimeError):
+        return "Error: Model failed to generate a response."
+    return "Error: An unexpected issue occurred during prediction."
+
+
 class Metadata:
-    def __init__(self):
-        self.cache_journal_info = load_cache_journal(f"{current_dir}/data/journal_cache.jsonl")
-        self.cache_institution_info = load_cache_affiliation(f"{current_dir}/data/affiliation_cache.jsonl")
-        
+    metrics = NULL_METRICS
+
+    def __init__(self, client: Optional[SemanticScholarClient] = None, cache: Optional[MetadataCache] = None,
+                 enrichment_timeout: Optional[float] = None, metrics: Optional[Metrics] = None):
+        """
+        Args:
+            client (SemanticScholarClient): The client used for author lookups, the shared
+                default one if omitted.
+            cache (MetadataCache): A persistent cache for author lookups, e.g.
+                ``SQLiteMetadataCache``; it is attached to the client.
+            enrichment_timeout (float): Seconds an article's author lookups may take,
+                waiting for the client's rate limiter included; past that, its authors are
+                labelled "(null)" as if Semantic Scholar had no match. Every article of a
+                batch has its own deadline. None waits as long as the client does.
+            metrics (Metrics): Receives the outcome of institution and journal lookups, and
+                through ``use_metrics``, the client's requests.
+        """
+        # Memory-mapped indexes over the bundled caches; ``record`` on either returns every
+        # field of an entry (ROR, country, ISSN, impact factor, ...)
+        self.cache_journal_info = open_journal_index()
+        self.journal_index = JournalIndex(self.cache_journal_info)
+        self.cache_institution_info = open_institution_index()
+        self.institution_matcher = InstitutionMatcher(self.cache_institution_info)
+        if cache is not None:
+            client = client or SemanticScholarClient()
+            client.cache = cache
+        self.client = client
+        self.enrichment_timeout = enrichment_timeout
+        self.degraded = Counter()
+        self._degraded_lock = threading.Lock()
+        if metrics is not None:
+            self.use_metrics(metrics)
+
+    def use_metrics(self, metrics: Metrics):
+        """
+        Reports lookups, and the requests of the Semantic Scholar client, to ``metrics``.
+        Without a client of its own, that is the shared default client.
+        """
+        self.metrics = metrics
+        (self.client or get_default_client()).metrics = metrics
+
+    def cache_stats(self) -> Dict[str, int]:
+        """
+        Returns the hit/miss counts of the author lookup cache.
+        """
+        return (self.client or get_default_client()).cache.stats()
+
+    def degradation_stats(self) -> Dict[str, int]:
+        """
+        Returns how many articles were enriched without Semantic Scholar, by reason:
+        ``timeout`` when the enrichment deadline passed, ``circuit_open`` when the client's
+        circuit breaker was turning requests away.
+        """
+        with self._degraded_lock:
+            return dict(self.degraded)
     
     def get_external_knowledge(self, input_article: dict) -> dict:
+        return run_sync(self.aget_external_knowledge(input_article))
+
+    async def aget_external_knowledge(self, input_article: dict) -> dict:
+        """
+        Enriches an article with author, institution and journal reputation labels.
+
+        Authors are looked up on Semantic Scholar concurrently; institutions and journals
+        come from the bundled caches. An article enriched without Semantic Scholar, because
+        the deadline passed or the API is failing, gets a ``Degraded`` key with the reason.
+        """
+        client = self.client or get_default_client()
+        try:
+            external_author_info = await client.aget_author_info_by_title(input_article['Title'], self._deadline())
+            reason = self._degradation(client, external_author_info)
+        except asyncio.TimeoutError:
+            external_author_info, reason = [], 'timeout'
+        return self._apply_external_knowledge(input_article, external_author_info, reason)
+
+    def get_external_knowledge_batch(self, input_articles: List[dict]) -> List[dict]:
+        return run_sync(self.aget_external_knowledge_batch(input_articles))
+
+    async def aget_external_knowledge_batch(self, input_articles: List[dict]) -> List[dict]:
+        """
+        Enriches many articles at once, resolving their authors with the Semantic Scholar
+        batch endpoints (see ``SemanticScholarClient.aget_author_info_bulk``).
+        """
+        client = self.client or get_default_client()
+        deadlines = [self._deadline() for _ in input_articles] if self.enrichment_timeout is not None else None
+        external_author_infos = await client.aget_author_info_bulk(input_articles, deadlines)
+        reasons = ['timeout' if info is None else self._degradation(client, info) for info in external_author_infos]
+        external_author_infos = [info or [] for info in external_author_infos]
+        return [self._apply_external_knowledge(input_article, external_author_info, reason)
+                for input_article, external_author_info, reason in zip(input_articles, external_author_infos, reasons)]
+
+    def _deadline(self) -> Optional[Deadline]:
+        return Deadline(self.enrichment_timeout) if self.enrichment_timeout is not None else None
+
+    @staticmethod
+    def _degradation(client: SemanticScholarClient, external_author_info: List[Dict]) -> Optional[str]:
+        # No authors while the breaker is open means they were never asked for
+        if not external_author_info and client.breaker.is_open:
+            return 'circuit_open'
+        return None
+
+    def institution_record(self, affiliation: str) -> Tuple[Optional[dict], str]:
+        """
+        Finds the institution of an affiliation in the bundled index, by its exact name or
+        else in every part of the affiliation.
+
+        Returns:
+            The institution's record, or None, and how it was found: ``exact``, ``fuzzy``
+            or ``miss``.
+        """
+        record = self.cache_institution_info.record(get_ins_name(affiliation).casefold())
+        if record is not None:
+            return record, 'exact'
+        match = self.institution_matcher.match(affiliation)
+        return (match[0], 'fuzzy') if match else (None, 'miss')
+
+    def _average_citation(self, record: dict) -> float:
+        # Counts refreshed from OpenAlex by a ``Prefetcher`` supersede the bundled snapshot
+        refreshed = (self.client or get_default_client()).cache.get_institution(record['name'])
+        return average_citation(refreshed or record)
+
+    def _apply_external_knowledge(self, input_article: dict, external_author_info: List[Dict],
+                                  degraded: Optional[str] = None) -> dict:
         try:
-            title = input_article['Title']
             authors, affiliations, journal = input_article['Authors'], input_article['Institutions'], input_article['Journal']
-            external_author_info = get_author_info_by_title(title)
             if len(external_author_info) != 0:
                 external_author_info = '; '.join([f"{obj['name']} ({categorize_h_index(int(obj['h-index']))})" for obj in external_author_info]) 
             else:
@@ -25,16 +176,20 @@ class Metadata:
             
             external_aff_info = list()
             for aff in affiliations:
-                
-                aff_name = get_ins_name(aff).casefold()
-                external_info = self.cache_institution_info.get(aff_name, None)
+                record, lookup = self.institution_record(aff)
+                self.metrics.inc("reference_lookups_total", index="institution", result=lookup)
+                external_info = self._average_citation(record) if record is not None else None
                 if external_info:
                     external_aff_info.append(f"{aff} ({categorize_avg_citation(external_info)})")
                 else:external_aff_info.append(f"{aff} (null)")
             external_aff_info = "; ".join(external_aff_info)
             
-            external_journal_info = self.cache_journal_info.get(journal.casefold(), None)
-            if external_journal_info:
+            journal_record = self.journal_index.resolve(journal)
+            self.metrics.inc("reference_lookups_total", index="journal", result='hit' if journal_record else 'miss')
+            if journal_record and journal_record.get('jcr'):
+                # A journal given by ISSN, abbreviation or a variant spelling is shown by its title
+                if normalize_name(journal) != normalize_name(journal_record['journal']):
+                    journal = journal_record['journal']
                 external_journal_info = f"{journal} ({categorize_jcr_partition(journal)})"
             else:
                 external_journal_info = f"{journal} (null)"
@@ -46,8 +201,68 @@ class Metadata:
             'Institutions':external_aff_info,
             'Journal':external_journal_info
         })
+        if degraded:
+            input_article['Degraded'] = degraded
+            with self._degraded_lock:
+                self.degraded[degraded] += 1
+            self.metrics.inc("degraded_articles_total", reason=degraded)
         return input_article
 
+JOURNAL_SOURCE = f"{current_dir}/data/journal_cache.jsonl"
+AFFILIATION_SOURCE = f"{current_dir}/data/affiliation_cache.jsonl"
+# Bumped whenever the keys or search texts change, so stale indexes get rebuilt
+JOURNAL_SCHEMA = "journal-search"
+INSTITUTION_SCHEMA = "institution-search"
+JOURNAL_SEARCH = dict(search_text=journal_search_text, search_terms=char_ngrams)
+INSTITUTION_SEARCH = dict(search_text=institution_search_text, search_terms=word_tokens)
+
+
+def institution_keys(record: dict) -> List[str]:
+    if not {'name', 'works_count', 'cited_by_count'}.issubset(record):
+        return []
+    return [record['name'].casefold()]
+
+
+def average_citation(record: dict) -> float:
+    works_count, cited_by_count = record['works_count'], record['cited_by_count']
+    return cited_by_count / works_count if works_count!=0 else 0
+
+
+def open_journal_index() -> ReferenceIndex:
+    """
+    Opens the journal index, building it from the bundled JSON Lines file if needed.
+    Like ``load_cache_journal``, ``get`` maps casefolded journal names to JCR quartiles.
+    """
+    return ReferenceIndex(ensure_index(JOURNAL_SOURCE, journal_index_keys, schema=JOURNAL_SCHEMA, **JOURNAL_SEARCH),
+                          value=lambda record: record['jcr'])
+
+
+def open_institution_index() -> ReferenceIndex:
+    """
+    Opens the institution index, building it from the bundled JSON Lines file if needed.
+    Like ``load_cache_affiliation``, ``get`` maps casefolded institution names to their
+    average citation.
+    """
+    return ReferenceIndex(ensure_index(AFFILIATION_SOURCE, institution_keys, schema=INSTITUTION_SCHEMA,
+                                       **INSTITUTION_SEARCH), value=average_citation)
+
+
+def build_reference_indexes() -> List[Path]:
+    """
+    Compiles the bundled JSON Lines caches into their indexes, replacing existing ones.
+
+    Returns:
+        List[Path]: The index files written.
+    """
+    paths = []
+    for source, keys, schema, search in ((JOURNAL_SOURCE, journal_index_keys, JOURNAL_SCHEMA, JOURNAL_SEARCH),
+                                         (AFFILIATION_SOURCE, institution_keys, INSTITUTION_SCHEMA, INSTITUTION_SEARCH)):
+        path = Path(source).with_suffix(".idx")
+        build_reference_index(read_jsonl_records(source), keys, str(path), schema=schema, **search)
+        paths.append(path)
+    return paths
+
+
 def load_cache_journal(file_name: str) -> Dict[str, float]:
     """
     Load journal impact factors from a JSON Lines file.
@@ -111,122 +326,64 @@ def load_cache_affiliation(file_name: str) -> Dict[str, float]:
     return institution_avg_citation
 
 
-def get_author_info_by_title(title: str) -> List[Dict]:
+def get_author_info_by_title(title: str, client: Optional[SemanticScholarClient] = None) -> List[Dict]:
     """
     Fetches author details for a given paper title by retrieving their author IDs first.
     
     Args:
         title (str): The title of the paper.
+        client (SemanticScholarClient): The client to use, the shared default one if omitted.
     
     Returns:
         List[Dict]: A list of dictionaries containing author details.
     """
-    author_ids = get_author_id_from_title(title)
-    
-    if not author_ids:
-        return []
+    client = client or get_default_client()
+    return run_sync(client.aget_author_info_by_title(title))
+        
+
+def get_author_info_bulk(articles: List[dict], client: Optional[SemanticScholarClient] = None) -> List[List[Dict]]:
+    """
+    Fetches author details for many articles through the Semantic Scholar batch endpoints.
     
-    results = []
-    for aid in author_ids:
-        author_info = get_author_info_by_id(aid)
-        if author_info:
-            results.append(author_info)
+    Args:
+        articles (List[dict]): Articles with a 'Title' and optionally a 'PMID' or 'DOI'.
+        client (SemanticScholarClient): The client to use, the shared default one if omitted.
     
-    return results
-        
+    Returns:
+        List[List[Dict]]: The author details of each article, in article order.
+    """
+    client = client or get_default_client()
+    return run_sync(client.aget_author_info_bulk(articles))
+
 
-def get_author_id_from_title(paper_title: str) -> List[str]:
+def get_author_id_from_title(paper_title: str, client: Optional[SemanticScholarClient] = None) -> List[str]:
     """
     Fetches author IDs from Semantic Scholar API based on a given paper title.
     
     Args:
         paper_title (str): The title of the paper.
+        client (SemanticScholarClient): The client to use, the shared default one if omitted.
     
     Returns:
         list: A list of author IDs if found, else an empty list.
     """
-    url = "http://api.semanticscholar.org/graph/v1/paper/search"
-    query_params = {
-        "query": paper_title,
-        "fields": "title,authors.name,authors.authorId,authors.affiliations",
-        "limit": 1
-    }
-    
-    try:
-        response = requests.get(url, params=query_params, timeout=10)
-        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx and 5xx)
-        
-        try:
-            response_data = response.json()
-        except ValueError:
-            print("Error: Failed to decode JSON response.")
-            return []
-        
-        author_ids = []
-        papers = response_data.get("data", [])
-        if papers:
-            paper = papers[0]  # Assuming the first result is the most relevant
-            for author in paper.get("authors", []):
-                a_id = author.get("authorId")
-                if a_id:
-                    author_ids.append(a_id)
-        else:
-            print("No papers found with the specified title.")
-            return []
-        
-        return author_ids
-    
-    except requests.exceptions.Timeout:
-        print("Error: The request timed out.")
-    except requests.exceptions.RequestException as e:
-        print(f"Error: An error occurred while making the request: {e}")
-    
-    return []
-
+    client = client or get_default_client()
+    return run_sync(client.aget_author_id_from_title(paper_title))
 
 
-def get_author_info_by_id(author_id: str) -> Optional[Dict[str, str]]:
+def get_author_info_by_id(author_id: str, client: Optional[SemanticScholarClient] = None) -> Optional[Dict[str, str]]:
     """
     Fetches author details from Semantic Scholar API based on author ID.
     
     Args:
         author_id (str): The ID of the author.
+        client (SemanticScholarClient): The client to use, the shared default one if omitted.
     
     Returns:
         Optional[Dict[str, str]]: A dictionary containing author details if found, else None.
     """
-    url = f"http://api.semanticscholar.org/graph/v1/author/{author_id}"
-    query_params = {
-        "fields": "name,affiliations,paperCount,citationCount,hIndex"
-    }
-    
-    try:
-        response = requests.get(url, params=query_params, timeout=10)
-        response.raise_for_status()
-        
-        try:
-            author_data = response.json()
-        except ValueError:
-            print("Error: Failed to decode JSON response.")
-            return None
-        
-        author_info = {
-            'aid': author_id,
-            'name': author_data.get('name', 'N/A'),
-            'affiliations': ', '.join(author_data.get('affiliations', [])),
-            'paper_count': str(author_data.get('paperCount', 'N/A')),
-            'citation': str(author_data.get('citationCount', 'N/A')),
-            'h-index': str(author_data.get('hIndex', 'N/A'))
-        }
-        
-        return author_info
-    
-    except requests.exceptions.Timeout:
-        print("Error: The request timed out.")
-    except requests.exceptions.RequestException as e:
-        print(f"Error: An error occurred while making the request: {e}")
-    
-    return None
+    client = client or get_default_client()
+    return run_sync(client.aget_author_info_by_id(author_id))
 
 def get_ins_name(ins_name: str) -> str:
     key_words = ['university', 'hospital']
@@ -347,6 +504,79 @@ def format_prompt(input_article, examples=[], k_shot=0):
     return prompt
 
 
+def prepare_prompts(input_articles: List[dict], metadata: Optional[Metadata] = None) -> List[dict]:
+    """
+    Validates, enriches and formats a batch of articles without a model, for prompts that
+    are run through one elsewhere (``PubGuard.predict_prompts``, ``pub-guard screen --prompts``).
+
+    Args:
+        input_articles (List[dict]): Articles with the ``REQUIRED_KEYS``, enriched in place.
+        metadata (Metadata): Enrichment configuration, a default ``Metadata()`` if omitted.
+
+    Returns:
+        List[dict]: One record per article, in input order: its ``prompt`` and, for an
+        article enriched without author data, the ``degraded`` reason; or, for an article
+        that could not be prepared, the ``error`` ``PubGuard.predict`` would have returned.
+    """
+    metadata = metadata or Metadata()
+    prompts, errors = enrich_and_format(input_articles, metadata, error_message, metrics=metadata.metrics)
+    records = []
+    for input_article, prompt, error in zip(input_articles, prompts, errors):
+        if prompt is None:
+            records.append({'error': error})
+        elif input_article.get('Degraded'):
+            records.append({'prompt': prompt, 'degraded': input_article['Degraded']})
+        else:
+            records.append({'prompt': prompt})
+    return records
+
+
+def enrich_and_format(input_articles: List[dict], metadata: Metadata, on_error: Callable[[Exception], Any],
+                      format: Callable[[dict], str] = format_prompt, metrics: Metrics = NULL_METRICS) -> Tuple[list, list]:
+    """
+    Validates, enriches and formats articles, enriching them all at once, and one by one
+    if that fails. ``prepare_prompts`` and ``PubGuard`` prepare their prompts with it.
+
+    Args:
+        on_error (Callable[[Exception], Any]): Maps the exception of an article that could
+            not be prepared to its result.
+        format (Callable[[dict], str]): Builds the prompt of an enriched article.
+        metrics (Metrics): Receives the time spent enriching.
+
+    Returns:
+        The prompts, with None for articles that could not be prepared, and the results
+        list with ``on_error(exception)`` already filled in for those articles.
+    """
+    prompts = [None] * len(input_articles)
+    results = [None] * len(input_articles)
+    valid = []
+    for idx, input_article in enumerate(input_articles):
+        missing_keys = REQUIRED_KEYS - input_article.keys()
+        if missing_keys:
+            results[idx] = on_error(MissingKeysError(missing_keys))
+        else:
+            valid.append(idx)
+
+    try:
+        with metrics.timer("stage_seconds", stage="enrichment"):
+            enriched = metadata.get_external_knowledge_batch([input_articles[idx] for idx in valid])
+    except Exception as e:
+        traceback.print_exc()
+        logger.error(f"Bulk enrichment failed, enriching articles one by one: {e}")
+        enriched = [None] * len(valid)
+    for idx, input_article in zip(valid, enriched):
+        try:
+            if input_article is None:
+                with metrics.timer("stage_seconds", stage="enrichment"):
+                    input_article = metadata.get_external_knowledge(input_articles[idx])
+            prompts[idx] = format(input_article)
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Failed to prepare article {idx}: {e}")
+            results[idx] = on_error(e)
+    return prompts, results
+
+
 def extract_answer(input_string):
 
     # Define the pattern to extract text between the assistant's start and end tags
@@ -0,0 +1,372 @@
+"""
+An asyncio HTTP server screening articles with dynamic batching.
+
+    pub-guard serve --port 8000 --max-batch-size 8 --max-wait-ms 10
+
+Endpoints:
+
+    POST /predict   an article as JSON -> {"answer": str}
+    POST /score     an article as JSON -> {"score": float}
+    GET  /health    {"status": "ok", "queue_depth": {...}, "in_flight": int}
+    GET  /stats     PubGuard.stats()
+    GET  /metrics   the same, in the Prometheus text format
+
+Articles are enriched concurrently on a pool of threads, so that Semantic Scholar lookups,
+the SQLite cache and reference index matching never hold up the event loop. Their prompts then wait in a queue
+per endpoint until ``max_batch_size`` of them are pending or the oldest has waited
+``max_wait`` seconds, and run through the model together on a single model thread, so
+requests arriving while a batch is generating make up the next one. A response for an
+article enriched without Semantic Scholar carries ``"degraded": reason``.
+
+Requests beyond ``max_concurrency``, or finding ``max_queue`` prompts already waiting, are
+turned away at once with ``503 Service Unavailable`` and a ``Retry-After`` header instead of
+queueing without bound.
+"""
+import asyncio
+import json
+import logging
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .model.inference import REQUIRED_KEYS, PubGuard
+from .model.metrics import NULL_METRICS, Metrics
+from .model.utils import error_message
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1 << 20
+MAX_HEADERS = 100
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request cannot be accepted without exceeding the server's limits.
+    """
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent callers into batches for ``run_batch``.
+
+    A batch starts once ``max_batch_size`` items are pending or the oldest pending item has
+    waited ``max_wait`` seconds. ``run_batch`` runs on ``executor`` and must return one
+    result per item; each caller's future gets its own result, or the exception that failed
+    the batch. Callers that went away before their batch started are left out of it.
+
+    Args:
+        run_batch (Callable[[List[Any]], List[Any]]): Computes the results of a batch.
+        executor (ThreadPoolExecutor): Where ``run_batch`` runs; share a single-thread
+            executor between batchers using the same model.
+        max_batch_size (int): The maximum number of items per batch.
+        max_wait (float): The seconds an item may wait for others to join its batch.
+        max_queue (int): The maximum number of pending items; ``submit`` raises
+            ``Overloaded`` beyond it.
+        metrics (Metrics): Receives the queue depth, queueing time and batch sizes.
+        name (str): The ``endpoint`` label of the metrics.
+    """
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], executor: ThreadPoolExecutor,
+                 max_batch_size: int = 8, max_wait: float = 0.01, max_queue: int = 256,
+                 metrics: Optional[Metrics] = None, name: str = "predict"):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.metrics = metrics or NULL_METRICS
+        self.name = name
+        self._pending: deque = deque()
+        self._arrived = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        for _, future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def submit(self, item) -> asyncio.Future:
+        """
+        Queues an item and returns the future of its result.
+        """
+        if len(self._pending) >= self.max_queue:
+            raise Overloaded(f"{len(self._pending)} {self.name} requests are already waiting")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        self.metrics.set("server_queue_depth", len(self._pending), endpoint=self.name)
+        self._arrived.set()
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self._pending:
+                self._arrived.clear()
+                await self._arrived.wait()
+            # Items that arrived while the previous batch ran have already waited long enough
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch_size))]
+            self.metrics.set("server_queue_depth", len(self._pending), endpoint=self.name)
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            for _, _, queued in batch:
+                self.metrics.observe("server_queue_seconds", start - queued, endpoint=self.name)
+            self.metrics.inc("server_batches_total", endpoint=self.name)
+            self.metrics.inc("server_batch_items_total", len(batch), endpoint=self.name)
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, [item for item, _, _ in batch])
+            except Exception as e:
+                traceback.print_exc()
+                logger.error(f"Batch of {len(batch)} {self.name} requests failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class PubGuardServer:
+    """
+    Serves ``PubGuard`` over HTTP; see the module documentation for the endpoints.
+
+    Args:
+        pub_guard (PubGuard): The model to serve. Give it a ``Metrics`` for ``/metrics``
+            and ``/stats`` to report anything.
+        host (str): The interface to listen on.
+        port (int): The port to listen on; 0 picks a free one (see ``port`` after ``start``).
+        max_batch_size (int): The maximum number of prompts run through the model together.
+        max_wait (float): The seconds a prompt may wait for others to join its batch.
+        max_concurrency (int): The maximum number of requests handled at once, enrichment
+            included.
+        max_queue (int): The maximum number of prompts waiting for the model, per endpoint;
+            ``max_concurrency`` if omitted.
+        max_new_token (int): Passed to ``predict_prompts``.
+        temperature (float): Passed to ``predict_prompts``.
+        generation_kwargs (dict): Further ``generate`` arguments, e.g. ``{"do_sample": False}``.
+    """
+    def __init__(self, pub_guard: PubGuard, host: str = "127.0.0.1", port: int = 8000, max_batch_size: int = 8,
+                 max_wait: float = 0.01, max_concurrency: int = 64, max_queue: Optional[int] = None,
+                 max_new_token: int = 256, temperature: float = 0.1, generation_kwargs: Optional[dict] = None):
+        self.pub_guard = pub_guard
+        self.metrics = pub_guard.metrics
+        self.host = host
+        self.port = port
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue or max_concurrency
+        self.max_new_token = max_new_token
+        self.temperature = temperature
+        self.generation_kwargs = generation_kwargs or {}
+        self.in_flight = 0
+        self.batchers: Dict[str, MicroBatcher] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pub-guard-model")
+        self._enrichment_executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                                       thread_name_prefix="pub-guard-enrichment")
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> "PubGuardServer":
+        for name, run_batch in (("predict", self._predict_batch), ("score", self._score_batch)):
+            batcher = MicroBatcher(run_batch, self._executor, max_batch_size=self.max_batch_size, max_wait=self.max_wait,
+                                   max_queue=self.max_queue, metrics=self.metrics, name=name)
+            batcher.start()
+            self.batchers[name] = batcher
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.warning(f"Serving on http://{self.host}:{self.port}")
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for batcher in self.batchers.values():
+            await batcher.stop()
+        self._executor.shutdown(wait=False)
+        self._enrichment_executor.shutdown(wait=False)
+
+    def _predict_batch(self, prompts: List[str]) -> List[str]:
+        return self.pub_guard.predict_prompts(prompts, batch_size=self.max_batch_size, max_new_token=self.max_new_token,
+                                              temperature=self.temperature, **self.generation_kwargs)
+
+    def _score_batch(self, prompts: List[str]) -> List[Optional[float]]:
+        return self.pub_guard.score_prompts(prompts, batch_size=self.max_batch_size)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as e:
+                    await _write_response(writer, e.status, {'error': e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, payload, extra_headers = await self._dispatch(method, path, body)
+                await _write_response(writer, status, payload, extra_headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Any, dict]:
+        path = path.split("?", 1)[0]
+        if method == "GET" and path == "/health":
+            return 200, {'status': 'ok', 'in_flight': self.in_flight,
+                         'queue_depth': {name: batcher.depth for name, batcher in self.batchers.items()}}, {}
+        if method == "GET" and path == "/stats":
+            return 200, self.pub_guard.stats(), {}
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics.to_prometheus(), {'Content-Type': "text/plain; version=0.0.4; charset=utf-8"}
+        endpoint = path.lstrip("/")
+        if endpoint not in self.batchers:
+            return 404, {'error': f"No such endpoint: {method} {path}"}, {}
+        if method != "POST":
+            return 405, {'error': f"Use POST for {path}"}, {'Allow': "POST"}
+
+        start = time.perf_counter()
+        status, payload, extra_headers = await self._screen(endpoint, body)
+        self.metrics.inc("server_requests_total", endpoint=endpoint, status=str(status))
+        self.metrics.observe("server_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+        return status, payload, extra_headers
+
+    async def _screen(self, endpoint: str, body: bytes) -> Tuple[int, Any, dict]:
+        if self.in_flight >= self.max_concurrency:
+            return 503, {'error': "Too many requests in flight"}, {'Retry-After': "1"}
+        try:
+            article = json.loads(body)
+        except ValueError:
+            return 400, {'error': "The body must be a JSON article"}, {}
+        if not isinstance(article, dict):
+            return 400, {'error': "The body must be a JSON article"}, {}
+        missing_keys = REQUIRED_KEYS - article.keys()
+        if missing_keys:
+            return 400, {'error': f"Missing keys: {sorted(missing_keys)}"}, {}
+
+        self.in_flight += 1
+        self.metrics.set("server_in_flight", self.in_flight)
+        try:
+            (prompt,), (error,) = await asyncio.get_running_loop().run_in_executor(
+                self._enrichment_executor, self.pub_guard.prepare_prompts, [article])
+            if prompt is None:
+                return 500, {'error': error}, {}
+            result = await self.batchers[endpoint].submit(prompt)
+        except Overloaded as e:
+            return 503, {'error': str(e)}, {'Retry-After': "1"}
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Failed to {endpoint} article: {e}")
+            return 500, {'error': error_message(e)}, {}
+        finally:
+            self.in_flight -= 1
+            self.metrics.set("server_in_flight", self.in_flight)
+
+        if endpoint == "predict":
+            if result is None:
+                # No answer could be extracted from the generated text
+                return 500, {'error': "Error: Model failed to generate a response."}, {}
+            if result.startswith("Error:"):
+                return 500, {'error': result}, {}
+            payload = {'answer': result}
+        else:
+            if result is None:
+                return 500, {'error': "Error: Model failed to score the article."}, {}
+            payload = {'score': result}
+        if article.get('Degraded'):
+            payload['degraded'] = article['Degraded']
+        return 200, payload, {}
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str], bytes]]:
+    """
+    Reads one HTTP/1.x request.
+
+    Returns:
+        ``(method, path, version, headers, body)`` with lower-cased header names, or None
+        once the client has closed the connection.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HTTPError(431, "Too many headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "Send the body with a Content-Length")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_SIZE:
+        raise HTTPError(413, f"The body exceeds {MAX_BODY_SIZE} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, version, headers, body
+
+
+async def _write_response(writer: asyncio.StreamWriter, status: int, payload, extra_headers: Optional[dict] = None,
+                          keep_alive: bool = True):
+    headers = {'Content-Type': "application/json"}
+    headers.update(extra_headers or {})
+    data = payload.encode("utf-8") if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers['Content-Length'] = str(len(data))
+    headers['Connection'] = "keep-alive" if keep_alive else "close"
+    head = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n" + data)
+    await writer.drain()
@@ -0,0 +1,111 @@
+# test/cache_test.py
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from pub_guard_llm.model.cache import LRUCache, PredictionCache, SQLiteMetadataCache, normalize_title
+from pub_guard_llm.model.semantic_scholar import SemanticScholarClient
+from pub_guard_llm.model.utils import Metadata
+from pub_guard_llm.test.stand_in_server import StandInSemanticScholar, make_papers
+
+
+def _write_authors(path, worker):
+    cache = SQLiteMetadataCache(path)
+    for i in range(50):
+        cache.put_authors({f"{worker}-{i}": {'aid': f"{worker}-{i}", 'name': f"Author {i}"}})
+    return worker
+
+
+class TestSQLiteMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "metadata.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_normalize_title(self):
+        self.assertEqual(normalize_title("  Challenges in Diagnosis, and Management!"),
+                         normalize_title("challenges in diagnosis and management"))
+
+    def test_lru_evicts_least_recently_used(self):
+        lru = LRUCache(maxsize=2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+        lru.get("a")
+        lru.put("c", 3)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertIsNone(lru.get("b"))
+
+    def test_persists_across_instances(self):
+        SQLiteMetadataCache(self.path).put_author_ids("A Paper.", ["1", "2"])
+        cache = SQLiteMetadataCache(self.path)
+        self.assertEqual(cache.get_author_ids("a paper"), ["1", "2"])
+        self.assertIsNone(cache.get_author_ids("another paper"))
+        self.assertEqual(cache.stats(), {'title_hits': 1, 'title_misses': 1})
+
+    def test_ttl_and_negative_caching(self):
+        cache = SQLiteMetadataCache(self.path, ttl=60, negative_ttl=0.05)
+        cache.put_author_ids("Unknown paper", [])
+        self.assertEqual(cache.get_author_ids("Unknown paper"), [])
+        time.sleep(0.1)
+        self.assertIsNone(cache.get_author_ids("Unknown paper"))
+
+    def test_concurrent_processes(self):
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(_write_authors, [self.path] * 4, range(4)))
+        cache = SQLiteMetadataCache(self.path)
+        self.assertEqual(cache.get_author("3-49")['name'], "Author 49")
+
+    def test_metadata_consults_cache(self):
+        papers = make_papers(2, authors_per_paper=3, shared_authors=2)
+        with StandInSemanticScholar(papers) as stand_in:
+            metadata = Metadata(client=SemanticScholarClient(base_url=stand_in.url, rate_limit=0),
+                                cache=SQLiteMetadataCache(self.path))
+            for title in papers:
+                article = {'Title': title, 'Authors': [], 'Institutions': [], 'Journal': "Nature"}
+                metadata.get_external_knowledge(article)
+            requests_after_first_pass = sum(stand_in.request_counts.values())
+            article = {'Title': "Synthetic paper number 0", 'Authors': [], 'Institutions': [], 'Journal': "Nature"}
+            enriched = metadata.get_external_knowledge(article)
+        # The second paper re-uses two cached authors; re-screening the first costs nothing
+        self.assertEqual(requests_after_first_pass, 2 + 3 + 1)
+        self.assertEqual(sum(stand_in.request_counts.values()), requests_after_first_pass)
+        self.assertIn("Author 1000", enriched['Authors'])
+        self.assertEqual(metadata.cache_stats()['title_hits'], 1)
+
+
+class TestPredictionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "predictions.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key(self):
+        key = PredictionCache.key("prompt", {'temperature': 0.1, 'max_new_token': 8}, "model")
+        self.assertEqual(key, PredictionCache.key("prompt", {'max_new_token': 8, 'temperature': 0.1}, "model"))
+        self.assertNotEqual(key, PredictionCache.key("prompt", {'temperature': 0.1, 'max_new_token': 9}, "model"))
+        self.assertNotEqual(key, PredictionCache.key("prompt", {'temperature': 0.1, 'max_new_token': 8}, "other"))
+        self.assertNotEqual(key, PredictionCache.key("prompt.", {'temperature': 0.1, 'max_new_token': 8}, "model"))
+
+    def test_tiers_and_hit_rate(self):
+        PredictionCache(self.path).put("a", "Yes")
+        cache = PredictionCache(self.path)
+        self.assertEqual(cache.get("a"), "Yes")
+        self.assertEqual(cache.get("a"), "Yes")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats(), {'memory_hits': 1, 'disk_hits': 1, 'misses': 1, 'hit_rate': 2 / 3})
+
+    def test_warm_and_export(self):
+        memory = PredictionCache()
+        memory.warm([("a", "Yes"), ("b", 0.25)])
+        disk = PredictionCache(self.path)
+        self.assertEqual(disk.warm(memory.export()), 2)
+        self.assertEqual(dict(PredictionCache(self.path).export()), {'a': "Yes", 'b': 0.25})
+
+
+if __name__ == '__main__':
+    unittest.main()
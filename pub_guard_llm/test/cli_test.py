@@ -0,0 +1,125 @@
+# test/cli_test.py
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from pub_guard_llm import cli
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.utils import format_prompt
+from pub_guard_llm.test.tiny_model import TinyModelFixture, make_article
+
+
+class TestScreen(TinyModelFixture, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.tmp.cleanup)
+        cls.model_dir = os.path.join(cls.tmp.name, "model")
+        cls.model.save_pretrained(cls.model_dir)
+        cls.tokenizer.save_pretrained(cls.model_dir)
+
+    def write_articles(self, path, articles):
+        with open(path, "w") as file:
+            for article in articles:
+                file.write(json.dumps(article) + "\n")
+
+    def screen(self, input_path, output_path, *extra):
+        return cli.main(["screen", input_path, "-o", output_path, "--model", self.model_dir, "--dtype", "float32",
+                         "--device", "cpu", "--api-url", self.stand_in.url, "--max-new-tokens", "4",
+                         "--batch-size", "2", "--chunk-size", "3", "--workers", "2", "--queue-size", "1", *extra])
+
+    def read_output(self, path):
+        with open(path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_screen_stream_matches_predict_batch(self):
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        expected = pub_guard.predict_batch([make_article(i) for i in range(7)], batch_size=2,
+                                           max_new_token=4, do_sample=False)
+        results = pub_guard.screen_stream((make_article(i) for i in range(7)), batch_size=2, chunk_size=3,
+                                          workers=2, queue_size=1, max_new_token=4, do_sample=False)
+        self.assertEqual([answer for _, answer in results], expected)
+
+    def test_screen_resumes(self):
+        input_path = os.path.join(self.tmp.name, "articles.jsonl")
+        output_path = os.path.join(self.tmp.name, "results.jsonl")
+        articles = [dict(make_article(i), PMID=1000 + i) for i in range(8)]
+        self.write_articles(input_path, articles[:5])
+        self.assertEqual(self.screen(input_path, output_path, "--score"), 0)
+        first = self.read_output(output_path)
+        self.assertEqual([r['id'] for r in first], [str(1000 + i) for i in range(5)])
+        self.assertTrue(all(0 <= r['score'] <= 1 for r in first))
+
+        # An interrupted run leaves a partial line behind
+        with open(output_path, "a") as file:
+            file.write('{"id": "10')
+        self.write_articles(input_path, articles)
+        self.screen(input_path, output_path, "--score")
+        results = self.read_output(output_path)
+        self.assertEqual(results[:5], first)
+        self.assertEqual([r['id'] for r in results], [str(1000 + i) for i in range(8)])
+
+    def test_missing_ids_and_errors(self):
+        input_path = os.path.join(self.tmp.name, "no_ids.jsonl")
+        output_path = os.path.join(self.tmp.name, "no_ids_results.jsonl")
+        broken = make_article(1)
+        del broken['Journal']
+        self.write_articles(input_path, [make_article(0), broken])
+        self.screen(input_path, output_path)
+        results = self.read_output(output_path)
+        self.assertEqual([r['id'] for r in results], ["#0", "#1"])
+        self.assertTrue(results[1]['answer'].startswith("Error: Missing keys"))
+
+    def test_metrics_file(self):
+        input_path = os.path.join(self.tmp.name, "metrics_articles.jsonl")
+        output_path = os.path.join(self.tmp.name, "metrics_results.jsonl")
+        metrics_path = os.path.join(self.tmp.name, "pub_guard.prom")
+        self.write_articles(input_path, [make_article(i) for i in range(3)])
+        self.screen(input_path, output_path, "--metrics", metrics_path)
+        with open(metrics_path) as file:
+            text = file.read()
+        self.assertIn('pub_guard_stage_seconds_count{stage="decode"} 2', text)
+        self.assertIn('pub_guard_generated_tokens_total ', text)
+
+    def test_enrich_then_screen_prompts(self):
+        input_path = os.path.join(self.tmp.name, "enrich_articles.jsonl")
+        prompts_path = os.path.join(self.tmp.name, "prompts.jsonl")
+        broken = dict(make_article(3), PMID=3)
+        del broken['Journal']
+        articles = [dict(make_article(i), PMID=i) for i in range(3)] + [broken]
+        self.write_articles(input_path, articles)
+        self.assertEqual(cli.main(["enrich", input_path, "-o", prompts_path, "--api-url", self.stand_in.url,
+                                   "--chunk-size", "2", "--workers", "2"]), 0)
+        records = self.read_output(prompts_path)
+        self.assertEqual([r['id'] for r in records], ["0", "1", "2", "3"])
+        expected = [format_prompt(article) for article in self.metadata.get_external_knowledge_batch(
+            [make_article(i) for i in range(3)])]
+        self.assertEqual([r['prompt'] for r in records[:3]], expected)
+        self.assertTrue(records[3]['error'].startswith("Error: Missing keys"))
+
+        screened_path = os.path.join(self.tmp.name, "screened.jsonl")
+        prompted_path = os.path.join(self.tmp.name, "prompted.jsonl")
+        self.screen(input_path, screened_path, "--score")
+        self.screen(prompts_path, prompted_path, "--score", "--prompts")
+        screened, prompted = self.read_output(screened_path), self.read_output(prompted_path)
+        self.assertEqual([r['id'] for r in prompted], [r['id'] for r in screened])
+        self.assertIsNone(prompted[3]['score'])
+        for result, expected_result in zip(prompted[:3], screened[:3]):
+            self.assertAlmostEqual(result['score'], expected_result['score'], places=5)
+
+    def test_standard_output_holds_only_records(self):
+        input_path = os.path.join(self.tmp.name, "stdout_articles.jsonl")
+        self.write_articles(input_path, [make_article(i) for i in range(3)])
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            # None of the titles is known, so each lookup has something to report
+            cli.main(["enrich", input_path, "-o", "-", "--api-url", self.stand_in.url])
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([r['id'] for r in records], ["#0", "#1", "#2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# test/cpu_test.py
+import sys
+import tempfile
+import unittest
+import torch
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.cache import PredictionCache
+from pub_guard_llm.model.cpu import CPUWorkerPool, configure_threads, load_cpu_model, mapped_weight_fraction, quantize_int8
+from pub_guard_llm.test.tiny_model import TinyModelFixture, make_article
+
+
+class TestCPUInference(TinyModelFixture, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.tmp.cleanup)
+        cls.model.save_pretrained(cls.tmp.name)
+        cls.tokenizer.save_pretrained(cls.tmp.name)
+
+    def test_quantize_int8(self):
+        model, _ = load_cpu_model(self.tmp.name, "float32")
+        ids = torch.tensor([self.tokenizer(make_article(0)['Abstract'])["input_ids"]])
+        with torch.no_grad():
+            expected = model(ids).logits
+            quantize_int8(model)
+            logits = model(ids).logits
+        self.assertNotIsInstance(model.get_decoder().layers[0].mlp.down_proj, torch.nn.Linear)
+        self.assertIsInstance(model.get_output_embeddings(), torch.nn.Linear)
+        self.assertLess(((logits - expected).norm() / expected.norm()).item(), 0.1)
+
+    def test_int8_results_are_cached_apart(self):
+        prompt = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)._build_prompt(
+            make_article(0))
+        keys = {}
+        for dtype in ("float32", "int8"):
+            model, _ = load_cpu_model(self.tmp.name, dtype)
+            pub_guard = PubGuard(model=model, tokenizer=self.tokenizer, metadata=self.metadata,
+                                 result_cache=PredictionCache())
+            keys[dtype] = pub_guard._result_key(prompt, 'score', {})
+        self.assertIsNotNone(keys['int8'])
+        self.assertNotEqual(keys['int8'], keys['float32'])
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "reads /proc/self/maps")
+    def test_weights_stay_memory_mapped(self):
+        model, _ = load_cpu_model(self.tmp.name, "float32")
+        self.assertEqual(mapped_weight_fraction(model), 1.0)
+        # Converted weights are private copies
+        model, _ = load_cpu_model(self.tmp.name, "bfloat16")
+        self.assertEqual(mapped_weight_fraction(model), 0.0)
+
+    def test_configure_threads(self):
+        threads = torch.get_num_threads()
+        self.addCleanup(torch.set_num_threads, threads)
+        self.assertEqual(configure_threads(1), 1)
+        self.assertEqual(torch.get_num_threads(), 1)
+
+    def test_worker_pool_matches_pub_guard(self):
+        articles = [make_article(i) for i in range(5)]
+        broken = make_article(5)
+        del broken['Journal']
+        articles.append(broken)
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        expected = pub_guard.predict_batch([dict(a) for a in articles], batch_size=2, max_new_token=4, do_sample=False)
+        expected_scores = pub_guard.score_batch([dict(a) for a in articles], batch_size=2)
+        with CPUWorkerPool(self.tmp.name, workers=2, threads_per_worker=1, metadata=self.metadata) as pool:
+            answers = pool.predict_batch([dict(a) for a in articles], batch_size=2, max_new_token=4, do_sample=False)
+            scores = pool.score_batch([dict(a) for a in articles], batch_size=2)
+        self.assertEqual(answers, expected)
+        self.assertIsNone(scores[-1])
+        for score, expected_score in zip(scores[:-1], expected_scores[:-1]):
+            self.assertAlmostEqual(score, expected_score, places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
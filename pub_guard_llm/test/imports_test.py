@@ -0,0 +1,38 @@
+# test/imports_test.py
+import json
+import subprocess
+import sys
+import unittest
+
+HEAVY_MODULES = ("torch", "transformers")
+
+
+def import_in_subprocess(statement: str) -> dict:
+    """
+    Runs ``statement`` in a fresh interpreter and returns which heavy modules it imported
+    and how long it took.
+    """
+    code = (f"import sys, time\nstart = time.perf_counter()\n{statement}\n"
+            f"import json\nprint(json.dumps({{'seconds': time.perf_counter() - start, "
+            f"'imported': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))")
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class TestLightweightImports(unittest.TestCase):
+    def test_enrichment_does_not_import_the_model_stack(self):
+        result = import_in_subprocess(
+            "import pub_guard_llm, pub_guard_llm.cli\n"
+            "from pub_guard_llm.model import Metadata, format_prompt, prepare_prompts\n"
+            "from pub_guard_llm.model.utils import categorize_h_index, categorize_avg_citation, categorize_jcr_partition")
+        self.assertEqual(result['imported'], [])
+        # torch alone takes seconds; a generous bound that still catches it coming back
+        self.assertLess(result['seconds'], 1.5)
+
+    def test_pub_guard_is_imported_on_first_use(self):
+        result = import_in_subprocess("from pub_guard_llm import PubGuard")
+        self.assertEqual(result['imported'], list(HEAVY_MODULES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# test/inference_test.py
+import unittest
+import torch
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.cache import PredictionCache
+from pub_guard_llm.test.tiny_model import TinyModelFixture, build_tiny_llama, make_article
+
+
+class TestPubGuard(TinyModelFixture, unittest.TestCase):
+    def test_predict_batch_matches_predict(self):
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        expected = [pub_guard.predict(make_article(i), max_new_token=8, do_sample=False) for i in range(5)]
+        answers = pub_guard.predict_batch([make_article(i) for i in range(5)], batch_size=2,
+                                          max_new_token=8, do_sample=False)
+        self.assertEqual(answers, expected)
+
+    def test_predict_batch_reports_errors_per_item(self):
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        broken = make_article(1)
+        del broken['Journal']
+        answers = pub_guard.predict_batch([make_article(0), broken, make_article(2)],
+                                          max_new_token=4, do_sample=False)
+        self.assertEqual(len(answers), 3)
+        self.assertTrue(answers[1].startswith("Error: Missing keys"))
+        self.assertFalse(answers[0].startswith("Error"))
+        self.assertFalse(answers[2].startswith("Error"))
+
+    def test_score_matches_label_logits(self):
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        scores = pub_guard.score_batch([make_article(i) for i in range(4)], batch_size=3)
+        for i, score in enumerate(scores):
+            self.assertAlmostEqual(score, pub_guard.score(make_article(i)), places=5)
+
+        ids = pub_guard._encode(pub_guard._build_prompt(make_article(2)))
+        with torch.no_grad():
+            logits = self.model(torch.tensor([ids])).logits[0, -1]
+        yes_ids, no_ids = pub_guard._label_token_ids()
+        expected = torch.sigmoid(torch.logsumexp(logits[yes_ids], 0) - torch.logsumexp(logits[no_ids], 0)).item()
+        self.assertAlmostEqual(scores[2], expected, places=5)
+
+        broken = make_article(1)
+        del broken['Title']
+        self.assertIsNone(pub_guard.score_batch([broken])[0])
+
+    def test_calibrate(self):
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        articles = [make_article(i) for i in range(8)]
+        margins = pub_guard._score_margins([make_article(i) for i in range(8)], batch_size=8)
+        # Label the articles by their margin so that a perfect calibration exists
+        median = sorted(margins)[4]
+        labels = [margin >= median for margin in margins]
+        pub_guard.calibrate(articles, labels)
+        scores = pub_guard.score_batch([make_article(i) for i in range(8)])
+        self.assertTrue(all((score > 0.5) == label for score, label in zip(scores, labels)))
+
+
+class TestPrefixCache(TinyModelFixture, unittest.TestCase):
+    def _longest_forward(self, predict):
+        lengths = []
+
+        def record(module, args, kwargs):
+            lengths.append(kwargs['input_ids'].shape[-1])
+
+        handle = self.model.register_forward_pre_hook(record, with_kwargs=True)
+        try:
+            answers = predict()
+        finally:
+            handle.remove()
+        return answers, max(lengths)
+
+    def test_prefix_cache_matches_uncached_path(self):
+        uncached = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        cached = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata, prefix_cache=True)
+        expected, uncached_prefill = self._longest_forward(
+            lambda: [uncached.predict(make_article(i), max_new_token=8, do_sample=False) for i in range(4)])
+        answers, cached_prefill = self._longest_forward(
+            lambda: [cached.predict(make_article(i), max_new_token=8, do_sample=False) for i in range(4)])
+        self.assertEqual(answers, expected)
+        self.assertEqual(uncached_prefill - cached_prefill, len(cached._prefix_ids))
+        self.assertLess(cached.prefill_tokens, uncached.prefill_tokens)
+
+    def test_prefix_cache_scores(self):
+        uncached = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        cached = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata, prefix_cache=True)
+        expected = uncached.score_batch([make_article(i) for i in range(5)], batch_size=3)
+        scores = cached.score_batch([make_article(i) for i in range(5)], batch_size=3)
+        for score, expected_score in zip(scores, expected):
+            self.assertAlmostEqual(score, expected_score, places=5)
+
+    def test_prefix_cache_in_batches(self):
+        uncached = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        cached = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata, prefix_cache=True)
+        expected = [uncached.predict(make_article(i), max_new_token=8, do_sample=False) for i in range(5)]
+        answers = cached.predict_batch([make_article(i) for i in range(5)], batch_size=3,
+                                       max_new_token=8, do_sample=False)
+        self.assertEqual(answers, expected)
+        self.assertLess(cached.prefill_tokens, uncached.prefill_tokens)
+
+
+class TestDraftModel(TinyModelFixture, unittest.TestCase):
+    model_options = {'hidden_size': 128, 'num_hidden_layers': 4}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.draft_model = build_tiny_llama(cls.tokenizer, seed=1, hidden_size=32, num_hidden_layers=1)
+
+    def test_greedy_answers_unchanged(self):
+        articles = lambda: [make_article(i) for i in range(4)]
+        plain = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata)
+        expected = plain.predict_batch(articles(), batch_size=2, max_new_token=16, do_sample=False)
+
+        draft_calls = []
+        handle = self.draft_model.register_forward_hook(lambda *args: draft_calls.append(1))
+        try:
+            for prefix_cache in (False, True):
+                assisted = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata,
+                                    prefix_cache=prefix_cache, draft_model=self.draft_model)
+                answers = assisted.predict_batch(articles(), batch_size=2, max_new_token=16, do_sample=False)
+                self.assertEqual(answers, expected)
+            events = list(assisted.predict_stream(make_article(0), max_new_token=16, do_sample=False))
+            self.assertEqual(events[-1]['answer'], expected[0])
+        finally:
+            handle.remove()
+        self.assertGreater(len(draft_calls), 0)
+
+
+class TestResultCache(TinyModelFixture, unittest.TestCase):
+    def count_forwards(self):
+        calls = []
+        handle = self.model.register_forward_hook(lambda *args: calls.append(1))
+        self.addCleanup(handle.remove)
+        return calls
+
+    def test_resubmitted_articles_skip_the_model(self):
+        cache = PredictionCache()
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata, result_cache=cache)
+        broken = make_article(9)
+        del broken['Title']
+        expected = pub_guard.predict_batch([make_article(i) for i in range(3)] + [broken],
+                                           max_new_token=8, do_sample=False)
+        calls = self.count_forwards()
+        self.assertEqual(pub_guard.predict_batch([make_article(i) for i in range(3)], max_new_token=8, do_sample=False),
+                         expected[:3])
+        self.assertEqual(pub_guard.predict(make_article(1), max_new_token=8, do_sample=False), expected[1])
+        events = list(pub_guard.predict_stream(make_article(2), max_new_token=8, do_sample=False))
+        self.assertEqual(events[-1]['answer'], expected[2])
+        self.assertTrue(events[-1]['cached'])
+        self.assertEqual(calls, [])
+        self.assertEqual(cache.stats()['memory_hits'], 5)
+
+        # Other generation parameters miss
+        pub_guard.predict(make_article(1), max_new_token=4, do_sample=False)
+        self.assertGreater(len(calls), 0)
+
+    def test_scores_are_cached_before_calibration(self):
+        cache = PredictionCache()
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=self.metadata, result_cache=cache)
+        before = pub_guard.score(make_article(0))
+        pub_guard.score_scale = 2.0
+        calls = self.count_forwards()
+        after = pub_guard.score(make_article(0))
+        self.assertEqual(calls, [])
+        self.assertNotAlmostEqual(before, after)
+
+
+if __name__ == '__main__':
+    unittest.main()
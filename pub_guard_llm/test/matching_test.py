@@ -0,0 +1,166 @@
+# test/matching_test.py
+import os
+import tempfile
+import unittest
+from pub_guard_llm.model import utils
+from pub_guard_llm.model.matching import (FuzzyIndex, InstitutionMatcher, JournalIndex, affiliation_segments,
+                                          journal_index_keys, normalize_institution, normalize_issn, normalize_name,
+                                          word_tokens)
+from pub_guard_llm.model.reference_index import ReferenceIndex, build_reference_index
+
+JOURNALS = [
+    {'jcr': "Q2", 'journal': "ONCOLOGY REPORTS", 'issn': "1021-335X", 'journal_abbr': "Oncol Rep",
+     'nlm_id': "9422756", 'eissn': "1791-2431"},
+    {'jcr': "Q1", 'journal': "The Journal of Physiology & Biochemistry", 'issn': "1138-7548",
+     'journal_abbr': "J Physiol Biochem", 'nlm_id': "9812509", 'eissn': "1877-8755"},
+    {'jcr': "Q3", 'journal': "Applied Bionics and Biomechanics", 'issn': "1176-2322",
+     'journal_abbr': "Appl Bionics Biomech", 'nlm_id': "101208624", 'eissn': "1754-2103"},
+]
+
+
+class TestNormalization(unittest.TestCase):
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("The Journal of Physiology & Biochemistry"),
+                         "journal of physiology and biochemistry")
+        self.assertEqual(normalize_name("Revista Española de Cardiología."), "revista espanola de cardiologia")
+
+    def test_normalize_issn(self):
+        self.assertEqual(normalize_issn("1021335x"), "1021-335X")
+        self.assertEqual(normalize_issn(" 1021-335X "), "1021-335X")
+        self.assertIsNone(normalize_issn("Oncology Reports"))
+
+    def test_fuzzy_index(self):
+        names = [normalize_name(record['journal']) for record in JOURNALS]
+        index = FuzzyIndex(names)
+        (name_id, score), = index.search("oncology reprts")
+        self.assertEqual(name_id, 0)
+        self.assertGreater(score, 0.7)
+        self.assertEqual(index.search("zzzz"), [])
+
+
+class TestJournalIndex(unittest.TestCase):
+    search = {}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "journals.idx")
+        build_reference_index(JOURNALS, journal_index_keys, path, **self.search)
+        self.index = JournalIndex(ReferenceIndex(path))
+        self.assertEqual(self.index.index.searchable, bool(self.search))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resolves_every_key(self):
+        for query in ("oncology reports", "Oncol Rep", "1021-335X", "1791-2431",
+                      "1021335x", "9422756", "Oncology  Reports."):
+            with self.subTest(query=query):
+                self.assertEqual(self.index.resolve(query)['journal'], "ONCOLOGY REPORTS")
+        self.assertEqual(self.index.resolve("Journal of Physiology and Biochemistry")['jcr'], "Q1")
+
+    def test_fuzzy_fallback(self):
+        self.assertEqual(self.index.resolve("Applied Bionics and Biomechanic")['jcr'], "Q3")
+        self.assertIsNone(self.index.resolve("Journal of Unrelated Studies"))
+        self.index.fuzzy_threshold = None
+        self.assertIsNone(self.index.resolve("Applied Bionics and Biomechanic"))
+
+    def test_metadata_shows_canonical_title(self):
+        metadata = utils.Metadata.__new__(utils.Metadata)
+        metadata.journal_index = JournalIndex(utils.open_journal_index())
+        metadata.cache_institution_info = utils.open_institution_index()
+        article = {'Title': "T", 'Authors': ["A"], 'Institutions': [], 'Journal': "1021-335X"}
+        metadata._apply_external_knowledge(article, [])
+        self.assertEqual(article['Journal'], "ONCOLOGY REPORTS (journal JCR: Q4, Low Level Journal)")
+
+
+class TestMappedJournalIndex(TestJournalIndex):
+    search = utils.JOURNAL_SEARCH
+
+
+class TestInstitutionMatcher(unittest.TestCase):
+    search = {}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "institutions.idx")
+        names = ["University of Washington", "University of Madras", "Harvard University", "Boston",
+                 "University of California", "University of California Berkeley", "School of Medicine",
+                 "Department of Medicine", "Mount Sinai Medical Center"]
+        records = [{'name': name, 'works_count': 10, 'cited_by_count': 10 * i} for i, name in enumerate(names)]
+        build_reference_index(records, utils.institution_keys, path, **self.search)
+        self.matcher = InstitutionMatcher(ReferenceIndex(path))
+        self.assertEqual(self.matcher.index.searchable, bool(self.search))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def match(self, affiliation):
+        match = self.matcher.match(affiliation)
+        return match and match[0]['name']
+
+    def test_segments(self):
+        self.assertEqual(affiliation_segments("Dept. of Physics, University of California, Berkeley"),
+                         ["Dept. of Physics", "University of California", "Berkeley",
+                          "Dept. of Physics University of California", "University of California Berkeley"])
+        self.assertEqual(normalize_institution("Mount Sinai Med. Ctr."), "mount sinai med center")
+
+    def test_match(self):
+        self.assertEqual(self.match("Department of Medicine, Univ. of Washington, Seattle, WA 98195, USA"),
+                         "University of Washington")
+        self.assertEqual(self.match("Dept. of Physics, University of California, Berkeley, CA"),
+                         "University of California Berkeley")
+        self.assertEqual(self.match("School of Medicine, Boston, Harvard University"), "Harvard University")
+        self.assertEqual(self.match("Mount Sinai Medical Centre, New York"), "Mount Sinai Medical Center")
+        self.assertEqual(self.match("School of Medicine, Foo Institute, Springfield"), "School of Medicine")
+
+    def test_no_match(self):
+        self.assertIsNone(self.match("Madras Diabetes Research Foundation, 4, Conran Smith Road, Chennai"))
+        self.assertIsNone(self.match("Department of Medicine, Foo Institute, Springfield"))
+        self.assertIsNone(self.match("600 086, India"))
+
+
+class TestMappedInstitutionMatcher(TestInstitutionMatcher):
+    search = utils.INSTITUTION_SEARCH
+
+
+class TestBundledInstitutions(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.matcher = InstitutionMatcher(utils.open_institution_index())
+
+    def match(self, affiliation):
+        match = self.matcher.match(affiliation)
+        return match and match[0]['name']
+
+    def test_places_do_not_match(self):
+        # The bundled list has records named "Chennai", "Paris" and "Boston"
+        self.assertIsNone(self.match("Madras Diabetes Research Foundation & Dr Mohan's Diabetes Specialties Centre, "
+                                     "Who Collaborating Centre for Non-Communicable Diseases Prevention and Control, "
+                                     "4, Conran Smith Road, Gopalapuram, Chennai, 600 086 India."))
+        self.assertIsNone(self.match("Paris, France"))
+        self.assertIsNone(self.match("Boston, MA, USA"))
+
+    def test_institutions_match(self):
+        self.assertEqual(self.match("Institut Pasteur, Paris, France"), "Institut Pasteur")
+        self.assertEqual(self.match("Department of Surgery, Mount Sinai Hospital, New York, NY, USA"),
+                         "Mount Sinai Hospital")
+        self.assertEqual(self.match("Dept. of Oncology, Karolinska Institutet, Stockholm, Sweden"),
+                         "Karolinska Institutet")
+
+    def test_mapped_search_matches_in_memory_search(self):
+        index = self.matcher.index
+        self.assertTrue(index.searchable)
+        mapped = FuzzyIndex.from_reference_index(index, features=word_tokens)
+        in_memory = FuzzyIndex([mapped.name(i) for i in range(len(index))], features=word_tokens)
+        for query in ("harvard university", "mount sinai hospital new york", "university of madras chennai",
+                      "karolinska institutet", "institute of unknown studies"):
+            with self.subTest(query=query):
+                expected = in_memory.search(query, limit=8)
+                results = mapped.search(query, limit=8)
+                self.assertEqual([name_id for name_id, _ in results], [name_id for name_id, _ in expected])
+                for (_, score), (_, expected_score) in zip(results, expected):
+                    self.assertAlmostEqual(score, expected_score)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# test/metrics_test.py
+import unittest
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.metrics import NULL_METRICS, Metrics, NullMetrics
+from pub_guard_llm.model.semantic_scholar import SemanticScholarClient
+from pub_guard_llm.model.utils import Metadata
+from pub_guard_llm.test.stand_in_server import make_papers
+from pub_guard_llm.test.tiny_model import TinyModelFixture, make_article
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counters_and_histograms(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.inc("http_requests_total", endpoint="/paper/search", status="200")
+        metrics.inc("http_requests_total", 2, endpoint="/author/batch", status="200")
+        metrics.inc("http_requests_total", endpoint="/author/batch", status="429")
+        metrics.set("server_queue_depth", 3, endpoint="predict")
+        for value in (0.05, 0.5, 5.0):
+            metrics.observe("stage_seconds", value, stage="decode")
+
+        self.assertEqual(metrics.counter("http_requests_total"), 4)
+        self.assertEqual(metrics.counter("http_requests_total", endpoint="/author/batch"), 3)
+        self.assertEqual(metrics.histogram_totals("stage_seconds", stage="decode"), (3, 5.55))
+        decode = metrics.snapshot()['histograms']['stage_seconds']['stage=decode']
+        self.assertEqual(decode['buckets'], {'0.1': 1, '1.0': 2, 'inf': 3})
+
+        text = metrics.to_prometheus()
+        self.assertIn("# TYPE pub_guard_http_requests_total counter", text)
+        self.assertIn('pub_guard_server_queue_depth{endpoint="predict"} 3', text)
+        self.assertIn('pub_guard_http_requests_total{endpoint="/author/batch",status="429"} 1', text)
+        self.assertIn('pub_guard_stage_seconds_bucket{stage="decode",le="1"} 2', text)
+        self.assertIn('pub_guard_stage_seconds_bucket{stage="decode",le="+Inf"} 3', text)
+        self.assertIn('pub_guard_stage_seconds_count{stage="decode"} 3', text)
+
+    def test_hooks(self):
+        metrics = Metrics()
+        events = []
+        metrics.add_hook(lambda name, value, labels: events.append((name, value, labels)))
+        metrics.inc("prompt_tokens_total", 12)
+        with metrics.timer("stage_seconds", stage="formatting"):
+            pass
+        self.assertEqual(events[0], ("prompt_tokens_total", 12, {}))
+        self.assertEqual(events[1][0], "stage_seconds")
+        self.assertEqual(events[1][2], {'stage': 'formatting'})
+
+    def test_null_metrics_record_nothing(self):
+        metrics = NullMetrics()
+        metrics.inc("prompt_tokens_total", 12)
+        with metrics.timer("stage_seconds", stage="formatting"):
+            pass
+        self.assertEqual(metrics.snapshot(), {'counters': {}, 'gauges': {}, 'histograms': {}})
+
+
+class TestPubGuardStats(TinyModelFixture, unittest.TestCase):
+    papers = make_papers(3)
+
+    def articles(self):
+        return [dict(make_article(i), Title=title) for i, title in enumerate(self.papers)]
+
+    def test_stats(self):
+        metrics = Metrics()
+        metadata = Metadata(client=SemanticScholarClient(base_url=self.stand_in.url, rate_limit=0))
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=metadata, metrics=metrics)
+        pub_guard.predict_batch(self.articles(), batch_size=2, max_new_token=4, do_sample=False)
+        pub_guard.score_batch(self.articles()[:1])
+        stats = pub_guard.stats()
+
+        for stage in ("enrichment", "formatting", "tokenization", "prefill", "decode", "extraction", "scoring"):
+            self.assertGreater(stats['stages'][stage]['count'], 0, stage)
+        self.assertEqual(stats['stages']['prefill']['count'], 2)
+        self.assertGreater(stats['tokens']['prompt'], 0)
+        self.assertEqual(stats['tokens']['generated'], 3 * 4)
+        self.assertGreater(stats['tokens']['tokens_per_sec'], 0)
+        self.assertEqual(stats['http'], {'endpoint=/paper/search,status=200': 4, 'endpoint=/author/batch,status=200': 2})
+        self.assertEqual(stats['reference_lookups']['index=journal,result=hit'], 4)
+        self.assertIn("pub_guard_http_request_seconds_bucket", metrics.to_prometheus())
+
+    def test_streamed_tokens_are_counted(self):
+        metrics = Metrics()
+        metadata = Metadata(client=SemanticScholarClient(base_url=self.stand_in.url, rate_limit=0))
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=metadata, metrics=metrics)
+        events = list(pub_guard.predict_stream(self.articles()[0], max_new_token=4, do_sample=False))
+        self.assertEqual(metrics.counter("generated_tokens_total"), events[-1]['tokens'])
+        self.assertEqual(metrics.histogram_totals("stage_seconds", stage="decode")[0], 1)
+
+    def test_disabled_by_default(self):
+        metadata = Metadata(client=SemanticScholarClient(base_url=self.stand_in.url, rate_limit=0))
+        pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=metadata)
+        pub_guard.predict_batch(self.articles()[:1], max_new_token=2, do_sample=False)
+        self.assertIs(pub_guard.metrics, NULL_METRICS)
+        self.assertEqual(pub_guard.stats()['stages'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
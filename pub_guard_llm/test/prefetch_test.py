@@ -0,0 +1,96 @@
+# test/prefetch_test.py
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from pub_guard_llm import cli
+from pub_guard_llm.model.cache import SQLiteMetadataCache
+from pub_guard_llm.model.openalex import OpenAlexClient
+from pub_guard_llm.model.prefetch import Prefetcher
+from pub_guard_llm.model.semantic_scholar import SemanticScholarClient
+from pub_guard_llm.model.utils import Metadata
+from pub_guard_llm.test.stand_in_server import StandInSemanticScholar, make_papers
+
+GLASGOW = "https://ror.org/00vtgdb53"
+WASHINGTON = "https://ror.org/00cvxb145"
+
+
+class TestPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "metadata.sqlite")
+        self.papers = make_papers(4, shared_authors=1)
+        # Glasgow's average citation went up from 33 (bundled) to 50, Washington's is unchanged
+        institutions = {GLASGOW: {'works_count': 200000, 'cited_by_count': 10000000},
+                        WASHINGTON: {'works_count': 466056, 'cited_by_count': 21708753}}
+        self.stand_in = StandInSemanticScholar(self.papers, institutions=institutions).start()
+        self.metadata = Metadata(client=SemanticScholarClient(base_url=self.stand_in.url, rate_limit=0),
+                                 cache=SQLiteMetadataCache(self.path, ttl=60))
+        self.openalex = OpenAlexClient(base_url=self.stand_in.openalex_url, rate_limit=0)
+
+    def tearDown(self):
+        self.stand_in.stop()
+        self.tmp.cleanup()
+
+    def articles(self):
+        affiliations = ["Institute of Health, University of Glasgow, Glasgow, UK", "University of Washington"]
+        return [{'Title': title, 'Authors': ["A", "B", "C"], 'Institutions': affiliations[:1 + i % 2],
+                 'Journal': "Oncology Reports"} for i, title in enumerate(self.papers)]
+
+    def test_enrichment_is_local_after_prefetch(self):
+        with Prefetcher(self.metadata, openalex=self.openalex, chunk_size=3) as prefetcher:
+            prefetcher.submit(self.articles())
+            prefetcher.join()
+        self.assertEqual(prefetcher.stats(), {'articles': 4, 'institutions_fetched': 2, 'journals_missing': 0})
+        requests_made = sum(self.stand_in.request_counts.values())
+
+        enriched = self.metadata.get_external_knowledge_batch(self.articles())
+        self.assertEqual(sum(self.stand_in.request_counts.values()), requests_made)
+        self.assertIn("Author 1000", enriched[0]['Authors'])
+        self.assertIn("University of Glasgow, Glasgow, UK (institution average citation: 50.0, World-Class Institution)",
+                      enriched[0]['Institutions'])
+
+    def test_needs_a_cache(self):
+        metadata = Metadata(client=SemanticScholarClient(base_url=self.stand_in.url, rate_limit=0))
+        with self.assertRaises(ValueError):
+            Prefetcher(metadata)
+
+    def test_refresh_rewrites_only_changed_records(self):
+        prefetcher = Prefetcher(self.metadata, openalex=self.openalex, refresh_window=3600)
+        prefetcher.prefetch(self.articles())
+        self.stand_in.authors["101"]['hIndex'] = 50
+        self.stand_in.institutions[WASHINGTON]['cited_by_count'] += 1
+
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("CREATE TABLE writes (record TEXT)")
+            for table in ("authors", "institutions"):
+                connection.execute(f"CREATE TRIGGER {table}_written AFTER INSERT ON {table} "
+                                   f"BEGIN INSERT INTO writes VALUES (new.record); END")
+        counts = prefetcher.refresh()
+        self.assertEqual(counts, {'authors_changed': 1, 'authors_unchanged': 8, 'authors_not_found': 0,
+                                  'institutions_changed': 1, 'institutions_unchanged': 1,
+                                  'institutions_not_found': 0})
+        with sqlite3.connect(self.path) as connection:
+            self.assertEqual(len(connection.execute("SELECT * FROM writes").fetchall()), 2)
+
+        enriched = self.metadata.get_external_knowledge(self.articles()[1])
+        self.assertIn("Author 101 (author h-index: 50, Leading Expert)", enriched['Authors'])
+        # Nothing expires within the window any more
+        prefetcher.refresh_window = 0
+        self.assertEqual(prefetcher.refresh()['authors_unchanged'], 0)
+
+    def test_cli(self):
+        input_path = os.path.join(self.tmp.name, "articles.jsonl")
+        with open(input_path, "w") as file:
+            for article in self.articles():
+                file.write(json.dumps(article) + "\n")
+        self.assertEqual(cli.main(["prefetch", input_path, "--cache", self.path, "--api-url", self.stand_in.url,
+                                   "--openalex-url", self.stand_in.openalex_url, "--refresh"]), 0)
+        cache = SQLiteMetadataCache(self.path)
+        self.assertEqual(cache.get_author("1000")['name'], "Author 1000")
+        self.assertEqual(cache.get_institution("University of Glasgow")['cited_by_count'], 10000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# test/reference_index_test.py
+import os
+import tempfile
+import unittest
+from pub_guard_llm.model import utils
+from pub_guard_llm.model.reference_index import ReferenceIndex, build_reference_index, ensure_index, term_idf
+
+
+class TestReferenceIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup_and_last_record_wins(self):
+        path = os.path.join(self.tmp.name, "test.idx")
+        records = [{'name': f"Institution {i}", 'rank': i} for i in range(1000)]
+        records.append({'name': "Institution 7", 'rank': -7})
+        self.assertEqual(build_reference_index(records, lambda r: [r['name'].casefold()], path), 1000)
+        index = ReferenceIndex(path, value=lambda r: r['rank'])
+        self.assertEqual(index.get("institution 999"), 999)
+        self.assertEqual(index.get("institution 7"), -7)
+        self.assertEqual(index.record("institution 3"), {'name': "Institution 3", 'rank': 3})
+        self.assertIsNone(index.get("institution 1000"))
+        self.assertNotIn("Institution 3", index)
+        self.assertEqual(len(index), 1000)
+
+    def test_search_section(self):
+        path = os.path.join(self.tmp.name, "search.idx")
+        records = [{'name': "cancer center"}, {'name': "heart center"}, {'name': "cancer institute"}]
+        build_reference_index(records, lambda r: [r['name']], path, search_text=lambda r: r['name'])
+        index = ReferenceIndex(path)
+        self.assertTrue(index.searchable)
+        self.assertEqual(list(index.postings("cancer")), [0, 2])
+        self.assertEqual(index.document_frequency("center"), 2)
+        self.assertEqual(list(index.postings("lung")), [])
+        self.assertEqual(index.search_text(1), "heart center")
+        self.assertAlmostEqual(index.search_weight(1), term_idf(3, 1) + term_idf(3, 2))
+
+        build_reference_index(records, lambda r: [r['name']], path)
+        self.assertFalse(ReferenceIndex(path).searchable)
+
+    def test_matches_jsonl_loaders(self):
+        journals = utils.load_cache_journal(utils.JOURNAL_SOURCE)
+        institutions = utils.load_cache_affiliation(utils.AFFILIATION_SOURCE)
+        journal_index, institution_index = utils.open_journal_index(), utils.open_institution_index()
+        self.assertEqual({k: journal_index.get(k) for k in journals}, journals)
+        self.assertEqual({k: institution_index.get(k) for k in institutions}, institutions)
+        self.assertEqual(institution_index.record("harvard university")['ror'], "https://ror.org/03vek6s52")
+        self.assertEqual(journal_index.record("nature")['jcr'], "Q1")
+
+    def test_ensure_index_rebuilds_stale_index(self):
+        source = os.path.join(self.tmp.name, "source.jsonl")
+        with open(source, "w") as file:
+            file.write('{"name": "A", "works_count": 1, "cited_by_count": 1}\n')
+        path = ensure_index(source, utils.institution_keys)
+        self.assertIn("a", ReferenceIndex(path))
+        with open(source, "a") as file:
+            file.write('{"name": "B", "works_count": 1, "cited_by_count": 1}\n')
+        os.utime(source, (os.path.getmtime(path) + 10,) * 2)
+        self.assertIn("b", ReferenceIndex(ensure_index(source, utils.institution_keys)))
+
+
+if __name__ == '__main__':
+    unittest.main()
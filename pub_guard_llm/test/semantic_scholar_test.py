@@ -0,0 +1,220 @@
+# test/semantic_scholar_test.py
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from pub_guard_llm.model import utils
+from pub_guard_llm.model.cache import SQLiteMetadataCache
+from pub_guard_llm.model.metrics import Metrics
+from pub_guard_llm.model.semantic_scholar import CircuitBreaker, SemanticScholarClient, TokenBucket
+from pub_guard_llm.test.stand_in_server import StandInSemanticScholar, make_papers
+
+
+class TestSemanticScholarClient(unittest.TestCase):
+    def test_author_lookups_run_concurrently(self):
+        papers = make_papers(1, authors_per_paper=8)
+        with StandInSemanticScholar(papers, latency=0.2) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, max_concurrency=8, rate_limit=0)
+            start = time.perf_counter()
+            author_info = utils.get_author_info_by_title("Synthetic paper number 0", client=client)
+            elapsed = time.perf_counter() - start
+        self.assertEqual([a['name'] for a in author_info], [a['name'] for a in papers["Synthetic paper number 0"]])
+        self.assertEqual(stand_in.max_in_flight, 8)
+        # One search plus one round of author lookups instead of nine sequential requests
+        self.assertLess(elapsed, 0.2 * 4)
+
+    def test_concurrency_limit(self):
+        with StandInSemanticScholar(make_papers(1, authors_per_paper=6), latency=0.05) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, max_concurrency=2, rate_limit=0)
+            author_info = utils.get_author_info_by_title("Synthetic paper number 0", client=client)
+        self.assertEqual(len(author_info), 6)
+        self.assertEqual(stand_in.max_in_flight, 2)
+
+    def test_unknown_title(self):
+        with StandInSemanticScholar(make_papers(1)) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0)
+            self.assertEqual(utils.get_author_info_by_title("Not a paper", client=client), [])
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=20, capacity=1)
+
+        async def acquire_all():
+            await asyncio.gather(*[bucket.acquire() for _ in range(5)])
+
+        start = time.perf_counter()
+        asyncio.run(acquire_all())
+        # The first token is free, the other four arrive every 50 ms
+        self.assertGreaterEqual(time.perf_counter() - start, 0.18)
+
+
+
+class TestBulkEnrichment(unittest.TestCase):
+    def setUp(self):
+        self.papers = make_papers(40, authors_per_paper=5, shared_authors=3)
+        self.titles = list(self.papers)
+        self.paper_ids = {f"PMID:{i}": title for i, title in enumerate(self.titles)}
+
+    def test_bulk_matches_per_title_lookups(self):
+        with StandInSemanticScholar(self.papers) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0)
+            expected = [utils.get_author_info_by_title(title, client=client) for title in self.titles[:5]]
+            bulk = utils.get_author_info_bulk([{'Title': title} for title in self.titles[:5]], client=client)
+        self.assertEqual(bulk, expected)
+
+    def test_bulk_with_identifiers_needs_few_round_trips(self):
+        articles = [{'Title': title, 'PMID': str(i)} for i, title in enumerate(self.titles)]
+        with StandInSemanticScholar(self.papers, paper_ids=self.paper_ids) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0)
+            author_info = utils.get_author_info_bulk(articles, client=client)
+        self.assertEqual(len(author_info), 40)
+        self.assertTrue(all(len(authors) == 5 for authors in author_info))
+        self.assertEqual(author_info[7][4]['name'], self.papers[self.titles[7]][4]['name'])
+        self.assertEqual(sum(stand_in.request_counts.values()), 2)
+        self.assertEqual(stand_in.request_counts[("POST", "/graph/v1/author/batch")], 1)
+
+    def test_bulk_falls_back_to_title_search(self):
+        # Unknown identifiers and articles without one are searched by title
+        articles = [{'Title': self.titles[0], 'PMID': 'missing'}, {'Title': self.titles[1]},
+                    {'Title': self.titles[1]}, {'Title': "Not a paper"}]
+        with StandInSemanticScholar(self.papers, paper_ids=self.paper_ids) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0)
+            author_info = utils.get_author_info_bulk(articles, client=client)
+        self.assertEqual([len(authors) for authors in author_info], [5, 5, 5, 0])
+        self.assertEqual(stand_in.request_counts[("GET", "/graph/v1/paper/search")], 3)
+        self.assertEqual(stand_in.request_counts[("POST", "/graph/v1/author/batch")], 1)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_repeated_failures(self):
+        with StandInSemanticScholar(make_papers(1), error_rate=1.0) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0,
+                                           breaker=CircuitBreaker(failure_threshold=3, cooldown=0.2))
+            for _ in range(6):
+                self.assertEqual(utils.get_author_info_by_title("Synthetic paper number 0", client=client), [])
+            self.assertEqual(sum(stand_in.request_counts.values()), 3)
+            self.assertTrue(client.breaker.is_open)
+            self.assertEqual(client.breaker.stats(), {'opened': 1, 'rejected': 3})
+
+            # After the cool-down one trial request goes out, and its success closes the breaker
+            time.sleep(0.25)
+            stand_in.error_rate = 0.0
+            author_info = utils.get_author_info_by_title("Synthetic paper number 0", client=client)
+            self.assertEqual(len(author_info), 3)
+            self.assertFalse(client.breaker.is_open)
+
+    def test_rate_limiting_opens_at_once(self):
+        with StandInSemanticScholar(make_papers(1), error_rate=1.0, error_status=429) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0)
+            utils.get_author_info_by_title("Synthetic paper number 0", client=client)
+            utils.get_author_info_by_title("Synthetic paper number 0", client=client)
+        self.assertEqual(sum(stand_in.request_counts.values()), 1)
+        self.assertTrue(client.breaker.is_open)
+
+    def test_malformed_bodies_are_invalid_json(self):
+        metrics = Metrics()
+        with StandInSemanticScholar(make_papers(1), malformed=True) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0, metrics=metrics)
+            self.assertEqual(utils.get_author_info_by_title("Synthetic paper number 0", client=client), [])
+        self.assertEqual(metrics.counter("http_requests_total", status="invalid_json"), 1)
+        self.assertEqual(metrics.counter("http_requests_total", status="error"), 0)
+
+    def test_client_errors_do_not_count(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        with StandInSemanticScholar(make_papers(1)) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0, breaker=breaker)
+            for _ in range(3):
+                self.assertIsNone(utils.get_author_info_by_id("unknown", client=client))
+        self.assertFalse(breaker.is_open)
+
+    def test_cancelled_trial_is_released(self):
+        with StandInSemanticScholar(make_papers(1), error_rate=1.0, error_status=429) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=1,
+                                           breaker=CircuitBreaker(cooldown=0.05))
+            utils.get_author_info_by_title("Synthetic paper number 0", client=client)
+            time.sleep(0.1)
+
+            # The trial is granted, then cancelled while it waits for a rate limiter token
+            async def cancelled_trial():
+                await asyncio.wait_for(client.aget_author_id_from_title("Synthetic paper number 0"), 0.1)
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(cancelled_trial())
+        self.assertFalse(client.breaker.is_open)
+        self.assertTrue(client.breaker.allow())
+
+
+class TestEnrichmentDeadline(unittest.TestCase):
+    def article(self, title):
+        return {'Title': title, 'Abstract': "", 'Authors': ["Jane Doe"], 'Institutions': [], 'Journal': "Nature"}
+
+    def test_slow_lookups_degrade_to_null(self):
+        with StandInSemanticScholar(make_papers(1), latency=0.5) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0)
+            metadata = utils.Metadata(client=client, enrichment_timeout=0.1)
+            start = time.perf_counter()
+            article = metadata.get_external_knowledge(self.article("Synthetic paper number 0"))
+            self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(article['Authors'], "Jane Doe (null)")
+        self.assertEqual(article['Degraded'], 'timeout')
+        self.assertEqual(metadata.degradation_stats(), {'timeout': 1})
+
+    def test_batch_keeps_cached_authors(self):
+        papers = make_papers(2)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache = SQLiteMetadataCache(os.path.join(tmp.name, "cache.sqlite"))
+        with StandInSemanticScholar(papers) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0, cache=cache)
+            metadata = utils.Metadata(client=client, enrichment_timeout=0.1)
+            metadata.get_external_knowledge(self.article("Synthetic paper number 0"))
+            stand_in.latency = 0.5
+            articles = metadata.get_external_knowledge_batch([self.article(title) for title in papers])
+        self.assertNotIn('Degraded', articles[0])
+        self.assertIn("Author 000", articles[0]['Authors'])
+        self.assertEqual(articles[1]['Degraded'], 'timeout')
+        self.assertEqual(articles[1]['Authors'], "Jane Doe (null)")
+
+    def test_rate_limited_batch_gets_a_deadline_per_article(self):
+        papers = make_papers(10)
+        with StandInSemanticScholar(papers) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=20, burst=1)
+            metadata = utils.Metadata(client=client, enrichment_timeout=1.5)
+            articles = metadata.get_external_knowledge_batch([self.article(title) for title in papers])
+        self.assertEqual(metadata.degradation_stats(), {})
+        self.assertIn("Author 900", articles[9]['Authors'])
+
+    def test_rate_limiter_wait_counts_against_the_deadline(self):
+        with StandInSemanticScholar(make_papers(1)) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=1, burst=1)
+            client.limiter.reserve()
+            metadata = utils.Metadata(client=client, enrichment_timeout=0.3)
+            start = time.perf_counter()
+            article = metadata.get_external_knowledge(self.article("Synthetic paper number 0"))
+            # The next token is a second away, so the lookup is given up at once
+            self.assertLess(time.perf_counter() - start, 0.2)
+        self.assertEqual(article['Degraded'], 'timeout')
+        self.assertEqual(sum(stand_in.request_counts.values()), 0)
+        # and the token it did not use is returned
+        self.assertLessEqual(client.limiter.reserve(), 1.0)
+
+    def test_rate_limited_batch_is_bounded_by_the_deadline(self):
+        papers = make_papers(4)
+        with StandInSemanticScholar(papers) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=2, burst=1)
+            metadata = utils.Metadata(client=client, enrichment_timeout=0.3)
+            start = time.perf_counter()
+            articles = metadata.get_external_knowledge_batch([self.article(title) for title in papers])
+            self.assertLess(time.perf_counter() - start, 0.3)
+        self.assertEqual([article['Degraded'] for article in articles], ['timeout'] * 4)
+
+    def test_open_breaker_is_reported(self):
+        with StandInSemanticScholar(make_papers(1), error_rate=1.0, error_status=429) as stand_in:
+            client = SemanticScholarClient(base_url=stand_in.url, rate_limit=0)
+            metadata = utils.Metadata(client=client)
+            articles = [metadata.get_external_knowledge(self.article("Synthetic paper number 0")) for _ in range(2)]
+        self.assertEqual([a['Degraded'] for a in articles], ['circuit_open', 'circuit_open'])
+        self.assertEqual(metadata.degradation_stats(), {'circuit_open': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
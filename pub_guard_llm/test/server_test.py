@@ -0,0 +1,111 @@
+# test/server_test.py
+import asyncio
+import threading
+import time
+import unittest
+import requests
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.metrics import Metrics
+from pub_guard_llm.model.semantic_scholar import SemanticScholarClient
+from pub_guard_llm.model.utils import Metadata
+from pub_guard_llm.server import PubGuardServer
+from pub_guard_llm.test.tiny_model import TinyModelFixture, make_article
+
+
+class TestPubGuardServer(TinyModelFixture, unittest.IsolatedAsyncioTestCase):
+    async def start_server(self, **kwargs):
+        metadata = Metadata(client=SemanticScholarClient(base_url=self.stand_in.url, rate_limit=0))
+        self.pub_guard = PubGuard(model=self.model, tokenizer=self.tokenizer, metadata=metadata, metrics=Metrics())
+        server = PubGuardServer(self.pub_guard, port=0, max_new_token=4, generation_kwargs={'do_sample': False},
+                                **kwargs)
+        await server.start()
+        self.addAsyncCleanup(server.close)
+        self.url = f"http://127.0.0.1:{server.port}"
+        return server
+
+    async def post(self, path, payload):
+        return await asyncio.to_thread(requests.post, self.url + path, json=payload, timeout=30)
+
+    async def test_concurrent_requests_are_batched(self):
+        await self.start_server(max_batch_size=4, max_wait=0.5)
+        articles = [make_article(i) for i in range(6)]
+        responses = await asyncio.gather(*[self.post("/predict", article) for article in articles])
+        self.assertEqual([r.status_code for r in responses], [200] * 6)
+
+        expected = self.pub_guard.predict_batch([make_article(i) for i in range(6)], max_new_token=4, do_sample=False)
+        self.assertEqual([r.json()['answer'] for r in responses], expected)
+        metrics = self.pub_guard.metrics
+        self.assertEqual(metrics.counter("server_batch_items_total", endpoint="predict"), 6)
+        self.assertLessEqual(metrics.counter("server_batches_total", endpoint="predict"), 3)
+
+    async def test_score(self):
+        await self.start_server()
+        response = await self.post("/score", make_article(3))
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.json()['score'], self.pub_guard.score(make_article(3)), places=5)
+
+    async def test_backpressure(self):
+        server = await self.start_server(max_concurrency=1)
+        self.stand_in.latency = 0.5
+        self.addCleanup(setattr, self.stand_in, 'latency', 0.0)
+        first = asyncio.ensure_future(self.post("/predict", make_article(0)))
+        while server.in_flight == 0:
+            await asyncio.sleep(0.01)
+        second = await self.post("/predict", make_article(1))
+        self.assertEqual(second.status_code, 503)
+        self.assertEqual(second.headers['Retry-After'], "1")
+        self.assertEqual((await first).status_code, 200)
+
+    async def test_enrichment_does_not_block_the_event_loop(self):
+        await self.start_server()
+        institution_record = self.pub_guard.metadata.institution_record
+        matching = threading.Event()
+
+        def slow_institution_record(affiliation):
+            matching.set()
+            time.sleep(0.5)
+            return institution_record(affiliation)
+
+        def check_health():
+            matching.wait()
+            start = time.perf_counter()
+            health = requests.get(self.url + "/health", timeout=30)
+            return time.perf_counter() - start, health.json()
+
+        self.pub_guard.metadata.institution_record = slow_institution_record
+        (elapsed, health), predicted = await asyncio.gather(asyncio.to_thread(check_health),
+                                                            self.post("/predict", make_article(0)))
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual(health['in_flight'], 1)
+        self.assertEqual(predicted.status_code, 200)
+
+    async def test_missing_answer_is_an_error(self):
+        await self.start_server()
+        self.pub_guard.predict_prompts = lambda prompts, **kwargs: [None] * len(prompts)
+        response = await self.post("/predict", make_article(0))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'error': "Error: Model failed to generate a response."})
+        self.assertEqual((await self.post("/score", make_article(0))).status_code, 200)
+
+    async def test_errors_and_introspection(self):
+        await self.start_server()
+        broken = make_article(0)
+        del broken['Journal']
+        response = await self.post("/predict", broken)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Journal", response.json()['error'])
+        self.assertEqual((await self.post("/predict", [1, 2])).status_code, 400)
+        self.assertEqual((await self.post("/explain", make_article(0))).status_code, 404)
+
+        health = await asyncio.to_thread(requests.get, self.url + "/health")
+        self.assertEqual(health.json(), {'status': 'ok', 'in_flight': 0, 'queue_depth': {'predict': 0, 'score': 0}})
+        await self.post("/predict", make_article(0))
+        metrics = await asyncio.to_thread(requests.get, self.url + "/metrics")
+        self.assertIn('pub_guard_server_requests_total{endpoint="predict",status="200"} 1', metrics.text)
+        self.assertIn('pub_guard_server_queue_depth{endpoint="predict"} 0', metrics.text)
+        stats = await asyncio.to_thread(requests.get, self.url + "/stats")
+        self.assertEqual(stats.json()['stages']['decode']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# test/stand_in_server.py
+"""
+A local stand-in for the Semantic Scholar Graph API, serving a fixed set of papers, and for
+the OpenAlex institutions endpoint.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_papers(n_papers: int, authors_per_paper: int = 3, shared_authors: int = 0) -> dict:
+    """
+    Builds ``n_papers`` synthetic papers; the first ``shared_authors`` authors of every
+    paper are the same people, the rest are unique to the paper.
+    """
+    papers = {}
+    for i in range(n_papers):
+        authors = []
+        for k in range(authors_per_paper):
+            aid = str(1000 + k) if k < shared_authors else f"{i}{k:02d}"
+            authors.append({'authorId': aid, 'name': f"Author {aid}", 'hIndex': (i + k) % 60})
+        papers[f"Synthetic paper number {i}"] = authors
+    return papers
+
+
+class StandInSemanticScholar:
+    """
+    Serves ``/graph/v1/paper/search``, ``/graph/v1/author/{id}`` and the ``/paper/batch`` and
+    ``/author/batch`` endpoints for ``papers``, a dict mapping titles to author records with
+    ``authorId``, ``name`` and ``hIndex``. Under ``openalex_url``, ``/institutions`` answers
+    ``ror:`` filters from ``institutions``.
+
+    Args:
+        papers (dict): The papers to serve.
+        paper_ids (dict): Maps identifiers such as ``PMID:1`` to titles in ``papers``.
+        institutions (dict): Maps ROR IDs to ``works_count`` and ``cited_by_count``.
+        latency (float): Seconds each request sleeps before answering.
+        error_rate (float): The fraction of requests answered with ``error_status`` instead.
+        error_status (int): The status of failed requests, e.g. 503 or 429.
+        malformed (bool): Answer 200 with a body that is not valid JSON.
+    """
+    def __init__(self, papers: dict, paper_ids: dict = None, latency: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, institutions: dict = None, malformed: bool = False):
+        self.papers = {title.casefold(): authors for title, authors in papers.items()}
+        self.paper_ids = {pid: title.casefold() for pid, title in (paper_ids or {}).items()}
+        self.authors = {a['authorId']: a for authors in papers.values() for a in authors}
+        self.institutions = dict(institutions or {})
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.malformed = malformed
+        self._random = random.Random(0)
+        self.request_counts = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/graph/v1"
+
+    @property
+    def openalex_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/openalex"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def author_record(self, author_id: str) -> dict:
+        author = self.authors[author_id]
+        return {
+            'authorId': author_id, 'name': author['name'], 'affiliations': [],
+            'paperCount': 10, 'citationCount': 100, 'hIndex': author['hIndex'],
+        }
+
+    def handle(self, method: str, path: str, query: dict, body) -> tuple:
+        """
+        Returns ``(status, payload)`` for one request.
+        """
+        if method == "GET" and path == "/graph/v1/paper/search":
+            authors = self.papers.get(query.get("query", [""])[0].casefold())
+            if authors is None:
+                return 200, {'total': 0, 'data': []}
+            return 200, {'total': 1, 'data': [{'title': query["query"][0], 'authors': [
+                {'authorId': a['authorId'], 'name': a['name'], 'affiliations': []} for a in authors]}]}
+        if method == "POST" and path == "/graph/v1/paper/batch":
+            papers = []
+            for pid in body['ids']:
+                authors = self.papers.get(self.paper_ids.get(pid))
+                papers.append(None if authors is None else {'paperId': pid, 'authors': [
+                    {'authorId': a['authorId'], 'name': a['name'], 'affiliations': []} for a in authors]})
+            return 200, papers
+        if method == "POST" and path == "/graph/v1/author/batch":
+            return 200, [self.author_record(aid) if aid in self.authors else None for aid in body['ids']]
+        if method == "GET" and path.startswith("/graph/v1/author/"):
+            author_id = path.rsplit("/", 1)[1]
+            if author_id not in self.authors:
+                return 404, {'error': 'Author not found'}
+            return 200, self.author_record(author_id)
+        if method == "GET" and path == "/openalex/institutions":
+            rors = query.get("filter", [""])[0].removeprefix("ror:").split("|")
+            return 200, {'results': [dict(self.institutions[ror], ror=ror) for ror in rors if ror in self.institutions]}
+        return 404, {'error': 'Not found'}
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _serve(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with stand_in._lock:
+                    stand_in.request_counts[(method, url.path)] += 1
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                try:
+                    if stand_in.latency:
+                        time.sleep(stand_in.latency)
+                    with stand_in._lock:
+                        failed = stand_in.error_rate and stand_in._random.random() < stand_in.error_rate
+                    if failed:
+                        status, payload = stand_in.error_status, {'error': 'Injected failure'}
+                    else:
+                        status, payload = stand_in.handle(method, url.path, parse_qs(url.query), body)
+                finally:
+                    with stand_in._lock:
+                        stand_in.in_flight -= 1
+                data = json.dumps(payload).encode("utf-8")
+                if stand_in.malformed:
+                    data = data[:len(data) // 2]
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+        return Handler
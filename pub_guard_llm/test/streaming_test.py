@@ -0,0 +1,71 @@
+# test/streaming_test.py
+import asyncio
+import time
+import unittest
+from pub_guard_llm.model import PubGuard
+from pub_guard_llm.model.streaming import StreamDecoder
+from pub_guard_llm.test.tiny_model import TinyModelFixture, make_article
+
+
+class TestPredictStream(TinyModelFixture, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pub_guard = PubGuard(model=cls.model, tokenizer=cls.tokenizer, metadata=cls.metadata)
+
+    def check_events(self, events, expected_answer):
+        self.assertEqual(events[0]['type'], 'label')
+        self.assertEqual(events[-1]['type'], 'done')
+        self.assertTrue(all(event['type'] == 'text' for event in events[1:-1]))
+        done = events[-1]
+        self.assertEqual(done['answer'], expected_answer)
+        text = "".join(event['text'] for event in events[1:-1])
+        self.assertEqual(((events[0]['label'] or "") + text).strip(), expected_answer)
+        self.assertEqual(done['tokens'], 12)
+        self.assertGreater(done['tokens_per_sec'], 0)
+        self.assertLessEqual(done['ttft'], done['latency'])
+
+    def test_stream_matches_predict(self):
+        expected = self.pub_guard.predict(make_article(3), max_new_token=12, do_sample=False)
+        events = list(self.pub_guard.predict_stream(make_article(3), max_new_token=12, do_sample=False))
+        self.check_events(events, expected)
+
+    def test_async_stream_matches_predict(self):
+        expected = self.pub_guard.predict(make_article(4), max_new_token=12, do_sample=False)
+
+        async def collect():
+            return [event async for event in self.pub_guard.apredict_stream(make_article(4), max_new_token=12,
+                                                                              do_sample=False)]
+        self.check_events(asyncio.run(collect()), expected)
+
+    def test_closing_the_stream_stops_generation(self):
+        start = time.perf_counter()
+        stream = self.pub_guard.predict_stream(make_article(5), max_new_token=100_000, do_sample=False,
+                                               eos_token_id=None)
+        next(stream)
+        stream.close()
+        self.assertLess(time.perf_counter() - start, 30)
+
+    def test_label_from_first_token(self):
+        yes_ids, no_ids = self.pub_guard._label_token_ids()
+        answer_ids = self.tokenizer("Yes\n\nThe journal is ranked Q4.", add_special_tokens=False)["input_ids"]
+        self.assertIn(answer_ids[0], yes_ids)
+        decoder = StreamDecoder(self.tokenizer, [], yes_ids, no_ids, time.perf_counter())
+        events = list(decoder.feed(answer_ids[:1]))
+        self.assertEqual(events, [{'type': 'label', 'label': "Yes", 'ttft': events[0]['ttft']}])
+        for token_id in answer_ids[1:]:
+            events += decoder.feed([token_id])
+        events += decoder.finish()
+        self.assertEqual("".join(e['text'] for e in events if e['type'] == 'text'), "\n\nThe journal is ranked Q4.")
+
+    def test_label_from_first_word(self):
+        yes_ids, no_ids = self.pub_guard._label_token_ids()
+        decoder = StreamDecoder(self.tokenizer, [], yes_ids, no_ids, time.perf_counter())
+        answer_ids = self.tokenizer("Maybe not", add_special_tokens=False)["input_ids"]
+        events = [event for token_id in answer_ids for event in decoder.feed([token_id])] + list(decoder.finish())
+        self.assertIsNone(events[0]['label'])
+        self.assertEqual("".join(e['text'] for e in events if e['type'] == 'text'), "Maybe not")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# test/tiny_model.py
+"""
+Offline stand-ins for the published checkpoints: a byte-level BPE tokenizer with the
+project's chat template and a randomly initialised Llama small enough to run on CPU.
+"""
+import functools
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+from pub_guard_llm.model.semantic_scholar import SemanticScholarClient
+from pub_guard_llm.model.utils import Metadata, format_prompt
+from pub_guard_llm.test.stand_in_server import StandInSemanticScholar
+
+CHAT_TEMPLATE = (
+    "{{ bos_token }}"
+    "{% for message in messages %}"
+    "{% if message['from'] == 'human' %}{{ '<|im_start|>user\n' + message['value'] + '<|im_end|>\n' }}"
+    "{% elif message['from'] == 'gpt' %}{{ '<|im_start|>assistant\n' + message['value'] + '<|im_end|>\n' }}"
+    "{% else %}{{ '<|im_start|>system\n' + message['value'] + '<|im_end|>\n' }}{% endif %}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}{{ '<|im_start|>assistant\n' }}{% endif %}"
+)
+
+SPECIAL_TOKENS = ["<|begin_of_text|>", "<|end_of_text|>", "<|im_start|>", "<|im_end|>"]
+
+WORDS = [
+    "diabetes", "children", "adolescents", "prevalence", "cancer", "cell", "tumor", "growth",
+    "protein", "expression", "patients", "clinical", "trial", "randomized", "study", "analysis",
+    "University", "Hospital", "Institute", "Research", "Center", "Journal", "Frontiers", "Biology",
+]
+
+
+def make_article(i: int) -> dict:
+    """
+    Builds a deterministic synthetic article whose length varies with ``i``.
+    """
+    words = [WORDS[(i * 7 + k) % len(WORDS)] for k in range(8 + (i * 13) % 40)]
+    return {
+        'Title': f"Synthetic study {i} of {WORDS[i % len(WORDS)]} {WORDS[(i + 3) % len(WORDS)]}",
+        'Abstract': " ".join(words) + ".",
+        'Authors': [f"Author {i}-{k}" for k in range(1 + i % 4)],
+        'Institutions': [f"Department {i}, {WORDS[(i + 5) % len(WORDS)]} University, City"],
+        'Journal': "Frontiers in Cell and Developmental Biology",
+    }
+
+
+def build_tiny_tokenizer(vocab_size: int = 600) -> PreTrainedTokenizerFast:
+    """
+    Trains a small byte-level BPE on the instruction text so prompts stay short.
+    """
+    corpus = [format_prompt(make_article(i)) for i in range(20)]
+    corpus += ["Yes", "No", "Yes\n", "No\n"] * 50
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=SPECIAL_TOKENS,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        show_progress=False,
+    )
+    tokenizer.train_from_iterator(corpus, trainer=trainer)
+    fast = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<|begin_of_text|>",
+        eos_token="<|im_end|>",
+    )
+    fast.chat_template = CHAT_TEMPLATE
+    return fast
+
+
+def build_tiny_llama(tokenizer, seed: int = 0, hidden_size: int = 64, num_hidden_layers: int = 2) -> LlamaForCausalLM:
+    """
+    Builds a randomly initialised Llama sharing ``tokenizer``'s vocabulary.
+    """
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    model = LlamaForCausalLM(config)
+    model.eval()
+    return model
+
+
+@functools.lru_cache(maxsize=None)
+def shared_tiny_tokenizer() -> PreTrainedTokenizerFast:
+    """
+    ``build_tiny_tokenizer()``, trained once per process; nothing may modify it.
+    """
+    return build_tiny_tokenizer()
+
+
+class TinyModelFixture:
+    """
+    Class fixtures for running PubGuard offline, mixed in before a ``unittest.TestCase``:
+    the shared ``tokenizer``, a ``model`` built with ``model_options``, and a ``stand_in``
+    Semantic Scholar serving ``papers`` behind ``metadata``. The stand-in knows no papers
+    by default, so every author is "(null)".
+    """
+    papers: dict = {}
+    model_options: dict = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tokenizer = shared_tiny_tokenizer()
+        cls.model = build_tiny_llama(cls.tokenizer, **cls.model_options)
+        cls.stand_in = StandInSemanticScholar(cls.papers).start()
+        cls.addClassCleanup(cls.stand_in.stop)
+        cls.metadata = Metadata(client=SemanticScholarClient(base_url=cls.stand_in.url))